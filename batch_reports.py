@@ -0,0 +1,142 @@
+"""
+Headless batch PDF reports for many Fitbit Takeout exports.
+
+Each entry in the input directory is one athlete: a Takeout folder or a
+Takeout .zip. Reports are built in a process pool with the same loaders and
+report pipeline as the dashboard, without importing Streamlit.
+
+    python batch_reports.py athletes/ --out reports/ --jobs 4
+
+Writes <athlete>.pdf (or <athlete>.html when WeasyPrint is unavailable) per
+athlete, plus summary.csv with per-stage timings and any failure.
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from health_data import extract_takeout_zip, find_fitbit_folder, parse_takeout
+from health_report import REPORT_CHART_FORMATS, REPORT_OPTIONS, build_report
+
+warnings.filterwarnings('ignore')
+
+SUMMARY_FIELDS = ["athlete", "status", "output", "load_s", "charts_s", "report_s",
+                  "total_s", "chart_errors", "error"]
+
+
+# ── Discovery ─────────────────────────────────────────────────────────────────
+
+def find_athletes(input_dir):
+    """(name, path) for every Takeout folder or .zip directly under input_dir."""
+    athletes = []
+    for entry in sorted(os.scandir(input_dir), key=lambda e: e.name):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            athletes.append((entry.name, entry.path))
+        elif entry.is_file() and entry.name.lower().endswith(".zip"):
+            athletes.append((entry.name[:-4], entry.path))
+    return athletes
+
+
+# ── Worker ────────────────────────────────────────────────────────────────────
+
+def build_athlete_report(name, source, out_dir, options):
+    """Load one export and write its report; returns a summary row."""
+    row = {"athlete": name, "status": "failed", "output": "", "chart_errors": "", "error": ""}
+    started = time.perf_counter()
+    temp_dir = None
+    try:
+        if source.lower().endswith(".zip"):
+            temp_dir = tempfile.mkdtemp(prefix="takeout-")
+            base_path = extract_takeout_zip(source, temp_dir)
+        else:
+            base_path = find_fitbit_folder(source)
+
+        t0 = time.perf_counter()
+        data = parse_takeout(base_path)
+        row["load_s"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        result = build_report(data, options)
+        row["report_s"] = time.perf_counter() - t0
+        row["charts_s"] = result["charts_elapsed"]
+        row["chart_errors"] = "; ".join(f"{k}: {v}" for k, v in result["chart_errors"].items())
+
+        if result["pdf"]:
+            output = os.path.join(out_dir, f"{name}.pdf")
+            with open(output, "wb") as f:
+                f.write(result["pdf"])
+            row["status"] = "ok"
+        else:
+            output = os.path.join(out_dir, f"{name}.html")
+            with open(output, "w", encoding="utf-8") as f:
+                f.write(result["html"])
+            row["status"] = "html"
+            row["error"] = result["pdf_error"] or ""
+        row["output"] = output
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    row["total_s"] = time.perf_counter() - started
+    return row
+
+
+# ── Driver ────────────────────────────────────────────────────────────────────
+
+def run_batch(input_dir, out_dir, jobs, options):
+    """Build every athlete's report across `jobs` processes; returns the rows."""
+    athletes = find_athletes(input_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"{len(athletes)} athletes, {jobs} workers -> {out_dir}")
+
+    rows = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(build_athlete_report, name, source, out_dir, options)
+                   for name, source in athletes]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            detail = row["error"] or row["output"]
+            print(f"  [{len(rows)}/{len(athletes)}] {row['athlete']:<24} {row['status']:<6} "
+                  f"{row['total_s']:>6.1f}s  {detail}")
+
+    rows.sort(key=lambda r: r["athlete"])
+    with open(os.path.join(out_dir, "summary.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: f"{v:.2f}" if isinstance(v, float) else v for k, v in row.items()})
+
+    failed = sum(row["status"] == "failed" for row in rows)
+    print(f"Done in {time.perf_counter() - started:.1f}s: "
+          f"{len(rows) - failed} built, {failed} failed (summary.csv)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input_dir", help="directory of Takeout folders and/or .zip files")
+    parser.add_argument("--out", default="reports", help="output directory (default: reports)")
+    parser.add_argument("--jobs", type=int, default=min(4, os.cpu_count() or 1),
+                        help="worker processes (default: min(4, CPUs))")
+    parser.add_argument("--charts", choices=list(REPORT_CHART_FORMATS),
+                        default=REPORT_OPTIONS["chart_format"], help="chart image format")
+    args = parser.parse_args()
+
+    options = {**REPORT_OPTIONS, "chart_format": args.charts}
+    rows = run_batch(args.input_dir, args.out, args.jobs, options)
+    sys.exit(1 if any(row["status"] == "failed" for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
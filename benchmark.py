@@ -0,0 +1,574 @@
+"""
+Benchmarks for the Fitbit AI Health Coach dashboard.
+
+Runs the dashboard's data and chart functions against synthetic data of a
+chosen length, so results do not depend on a real Takeout export.
+
+    python benchmark.py transport --days 14 365
+    python benchmark.py charts --days 14
+    python benchmark.py pdf-memory --days 14 365
+    python benchmark.py report --days 14 365
+    python benchmark.py summary --days 30 90 365
+    python benchmark.py coach --days 30 --latency 0.5
+    python benchmark.py incremental --days 365
+    python benchmark.py questions --days 365
+    python benchmark.py chat --turns 6
+    python benchmark.py goals --goals 4 --latency 1
+"""
+
+import argparse
+import base64
+import gzip
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+import health_coach
+import health_data
+import health_query
+import health_report
+from fake_gemini import FakeGemini, canned_plan_text
+
+
+# ── Synthetic data ────────────────────────────────────────────────────────────
+
+def synthetic_dataset(days, seed=0):
+    """Continuous HR (~5 s sampling), per-minute steps and calories."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2025-01-01")
+
+    n_hr = days * 17280
+    hr_ts = start + pd.to_timedelta(np.arange(n_hr) * 5 + rng.integers(0, 3, n_hr), unit="s")
+    daily_cycle = 12 * np.sin(np.arange(n_hr) / 17280 * 2 * np.pi - np.pi / 2)
+    bpm = np.clip(68 + daily_cycle + np.cumsum(rng.normal(0, 0.3, n_hr)) % 20, 40, 200)
+    hr_df = pd.DataFrame({"timestamp": hr_ts, "bpm": bpm.round().astype(int), "confidence": 2})
+
+    n_min = days * 1440
+    minutes = start + pd.to_timedelta(np.arange(n_min), unit="min")
+    steps = rng.poisson(8, n_min) * (rng.random(n_min) < 0.4)
+    steps_df = pd.DataFrame({"timestamp": minutes, "steps": steps})
+    cals_df = pd.DataFrame({"timestamp": minutes, "calories": 1.1 + steps * 0.05})
+    return hr_df, steps_df, cals_df
+
+
+def synthetic_daily_tables(days, seed=0):
+    """Per-day/per-night tables (RHR, HRV, sleep, SpO2, stress, AZM, temp) ending today."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+    walk = lambda scale: np.cumsum(rng.normal(0, scale, days))
+    duration = np.clip(420 + rng.normal(0, 45, days), 240, 600)
+    zones = np.repeat(["FAT_BURN", "CARDIO", "PEAK"], days)
+    return {
+        "hr_summary_df": pd.DataFrame({"date": dates, "resting_hr": np.clip(60 + walk(0.3), 45, 80).round()}),
+        "hrv_df": pd.DataFrame({"timestamp": dates, "rmssd": np.clip(45 + walk(1.0) + rng.normal(0, 6, days), 10, 120)}),
+        "sleep_df": pd.DataFrame({
+            "date": dates, "main_sleep": True, "duration_minutes": duration,
+            "efficiency": rng.integers(82, 97, days), "deep_minutes": (duration * 0.18).round(),
+            "light_minutes": (duration * 0.5).round(), "rem_minutes": (duration * 0.22).round(),
+            "wake_minutes": (duration * 0.1).round()}),
+        "sleep_score_df": pd.DataFrame({"timestamp": dates, "overall_score": rng.integers(70, 96, days)}),
+        "spo2_df": pd.DataFrame({"timestamp": dates, "average_value": 96 + rng.normal(0, 0.6, days),
+                                 "lower_bound": 92 + rng.normal(0, 1.2, days)}),
+        "stress_df": pd.DataFrame({"DATE": dates, "STRESS_SCORE": rng.integers(55, 90, days)}),
+        "azm_df": pd.DataFrame({"date": np.tile(dates, 3), "zone": zones,
+                                "minutes": rng.poisson(12, days * 3)}),
+        "temp_df": pd.DataFrame({"date": dates, "temp_c": 33.5 + rng.normal(0, 0.3, days),
+                                 "deviation": rng.normal(0, 0.3, days)}),
+    }
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    """Best-of-N wall time in seconds and the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+# ── Chart transport ───────────────────────────────────────────────────────────
+
+def bench_transport(days_list):
+    """Plotly payload size and serialisation time, JSON lists vs typed arrays."""
+    print(f"{'days':>5} {'chart':<10} {'mode':<9} {'points':>8} {'bytes':>11} {'gzip':>10} {'to_json':>9}")
+    for days in days_list:
+        hr_df, steps_df, cals_df = synthetic_dataset(days)
+        builders = {
+            "hr": lambda: health_report.create_continuous_hr_chart(hr_df),
+            "activity": lambda: health_report.create_continuous_activity_chart(steps_df, cals_df),
+        }
+        for name, build in builders.items():
+            for mode in ("json", "typed"):
+                fig = build()
+                if mode == "typed":
+                    health_report.pack_figure_arrays(fig)
+                points = sum(len(trace.x) for trace in fig.data if trace.x is not None)
+                seconds, payload = timed(pio.to_json, fig, validate=False)
+                print(f"{days:>5} {name:<10} {mode:<9} {points:>8,} {len(payload):>11,} "
+                      f"{len(gzip.compress(payload.encode())):>10,} {seconds * 1000:>7.0f}ms")
+
+
+# ── Report chart export ───────────────────────────────────────────────────────
+
+def report_figures(days):
+    """The figures the PDF report embeds that synthetic data can drive."""
+    hr_df, steps_df, cals_df = synthetic_dataset(days)
+    rollups = health_data.build_daily_rollups(hr_df, steps_df, cals_df)
+    return {
+        "heart_rate": health_report.create_continuous_hr_chart(hr_df),
+        "activity": health_report.create_continuous_activity_chart(steps_df, cals_df),
+        "hr_bands": health_report.create_hr_percentile_bands_chart(rollups["hr_bands"]),
+        "timeline": health_report.create_multi_metric_timeline(
+            health_data.align_timeline(hr_df, steps_df, cals_df, pd.DataFrame(), pd.DataFrame())),
+    }
+
+
+def bench_charts(days_list):
+    """PNG export of the report charts, one after another vs batched."""
+    for days in days_list:
+        figs = report_figures(days)
+
+        t0 = time.perf_counter()
+        per_chart = {}
+        for name, fig in figs.items():
+            t1 = time.perf_counter()
+            pio.to_image(fig, format="png", width=700, height=350, scale=2)
+            per_chart[name] = time.perf_counter() - t1
+        sequential = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        _, batched_timings, errors = health_report.render_chart_images(figs)
+        batched = time.perf_counter() - t0
+
+        print(f"{days} days, {len(figs)} charts")
+        for name in figs:
+            print(f"  {name:<12} sequential {per_chart[name]:>6.2f}s   "
+                  f"batched {batched_timings.get(name, float('nan')):>6.2f}s"
+                  + (f"   error: {errors[name]}" if name in errors else ""))
+        print(f"  {'total':<12} sequential {sequential:>6.2f}s   batched {batched:>6.2f}s")
+
+
+# ── PDF pipeline memory ───────────────────────────────────────────────────────
+
+def legacy_pdf_pipeline(tables, images):
+    """The report path before in-memory rendering, kept for comparison."""
+    from weasyprint import HTML
+    html = health_report.generate_printable_html(*tables, images)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        HTML(string=html).write_pdf(tmp.name)
+        with open(tmp.name, "rb") as f:
+            pdf = f.read()
+        os.unlink(tmp.name)
+    b64_pdf = base64.b64encode(pdf).decode("utf-8")
+    page = f"<a href='data:application/pdf;base64,{b64_pdf}'></a>" * 2
+    return pdf, page
+
+
+def in_memory_pdf_pipeline(tables, images):
+    """Charts served to WeasyPrint by URL, PDF returned as bytes."""
+    html = health_report.generate_printable_html(*tables, images, inline_images=False)
+    return health_report.generate_pdf_from_html(html, images)
+
+
+def bench_pdf_memory(days_list):
+    """Peak Python heap (tracemalloc) of the legacy vs in-memory PDF pipelines."""
+    empty = pd.DataFrame()
+    for days in days_list:
+        hr_df, steps_df, cals_df = synthetic_dataset(days)
+        figs = {
+            "heart_rate": health_report.create_continuous_hr_chart(hr_df, print_columns=1400),
+            "activity": health_report.create_continuous_activity_chart(steps_df, cals_df, print_columns=1400),
+        }
+        images, _, errors = health_report.render_chart_images(figs)
+        if errors:
+            raise SystemExit(f"chart export failed: {errors}")
+        tables = ({}, empty, empty, empty, empty, empty, hr_df, steps_df)
+
+        for name, pipeline in (("legacy", legacy_pdf_pipeline), ("in-memory", in_memory_pdf_pipeline)):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            pipeline(tables, images)
+            elapsed = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{days:>5} days  {name:<10} peak {peak / 2**20:>7.1f} MiB  {elapsed:>6.2f}s")
+
+
+# ── Full report, PNG vs SVG ───────────────────────────────────────────────────
+
+def synthetic_report_data(days):
+    """A load_dataset-shaped dict; tables without a generator are empty."""
+    hr_df, steps_df, cals_df = synthetic_dataset(days)
+    empty = pd.DataFrame()
+    return {
+        "profile": {}, "detailed_hr_df": hr_df, "detailed_steps_df": steps_df,
+        "detailed_cals_df": cals_df, "hr_summary_df": empty, "sleep_df": empty,
+        "hrv_df": empty, "spo2_df": empty, "stress_df": empty,
+    }
+
+
+def bench_report(days_list):
+    """End-to-end build_report time and output size per chart format."""
+    print(f"{'days':>5} {'format':<7} {'charts':>11} {'pdf':>11} {'charts s':>9} {'total s':>8}")
+    for days in days_list:
+        data = synthetic_report_data(days)
+        for chart_format in health_report.REPORT_CHART_FORMATS:
+            options = {**health_report.REPORT_OPTIONS, "chart_format": chart_format}
+            seconds, result = timed(health_report.build_report, data, options, repeat=1)
+            if result["chart_errors"]:
+                raise SystemExit(f"chart export failed: {result['chart_errors']}")
+            pdf_size = len(result["pdf"]) if result["pdf"] else float("nan")
+            print(f"{days:>5} {chart_format:<7} {result['chart_bytes']:>11,} {pdf_size:>11,} "
+                  f"{result['charts_elapsed']:>9.2f} {seconds:>8.2f}")
+
+
+# ── AI coach (offline) ────────────────────────────────────────────────────────
+
+def coach_data(days=None, takeout=None):
+    """A parse_takeout-style dataset from a Takeout export or synthetic data."""
+    if takeout:
+        return health_data.parse_takeout(health_data.find_fitbit_folder(takeout))
+    hr_df, steps_df, cals_df = synthetic_dataset(days)
+    # Shift so the data ends today and falls inside the summary window
+    shift = pd.Timestamp.now().normalize() - hr_df["timestamp"].max().normalize()
+    for df in (hr_df, steps_df, cals_df):
+        df["timestamp"] += shift
+    return {**synthetic_report_data(days), **synthetic_daily_tables(days),
+            "detailed_hr_df": hr_df, "detailed_steps_df": steps_df,
+            "detailed_cals_df": cals_df}
+
+
+def summary_inputs(days=None, takeout=None, data=None):
+    """create_health_summary arguments from a Takeout export or synthetic data."""
+    if data is None:
+        data = coach_data(days, takeout)
+    empty = pd.DataFrame()
+    args = [data.get(k, empty) for k in (
+        "hr_summary_df", "sleep_df", "sleep_score_df", "hrv_df", "spo2_df", "stress_df",
+        "detailed_steps_df", "detailed_cals_df", "exercise_df")]
+    kwargs = {k: data.get(f"{k}_df", empty) for k in ("detailed_hr", "azm", "temp")}
+    return (data.get("profile") or {}, *args), {f"{k}_df": v for k, v in kwargs.items()}
+
+
+def summary_encoding(summary):
+    """Which per-day table encoding create_health_summary settled on."""
+    for marker, name in ((" at change points only", "changes"), (", weekly (", "weekly"),
+                         (", delta-encoded", "delta")):
+        if marker in summary:
+            return name
+    return "daily"
+
+
+def bench_summary(days_list, budget):
+    """Health summary build time and size as the analysed history grows."""
+    print(f"{'days':>5} {'build ms':>9} {'tokens, no budget':>18} "
+          f"{f'tokens, budget {budget}':>20} {'encoding':>9}")
+    for days in days_list:
+        args, kwargs = summary_inputs(days)
+        seconds, full = timed(health_data.create_health_summary, *args, **kwargs,
+                              data_period=days, token_budget=None)
+        budgeted = health_data.create_health_summary(*args, **kwargs, data_period=days,
+                                                     token_budget=budget)
+        print(f"{days:>5} {seconds * 1000:>9.1f} {health_data.estimate_tokens(full):>18,} "
+              f"{health_data.estimate_tokens(budgeted):>20,} {summary_encoding(budgeted):>9}")
+
+    # Several look-back windows: one summary per window vs one pass over the daily table
+    args, kwargs = summary_inputs(max(days_list))
+    windows = health_data.SUMMARY_WINDOWS
+    per_window, _ = timed(lambda: [health_data.create_health_summary(
+        *args, **kwargs, data_period=w, trend_windows=()) for w in windows])
+    profile, hr_summary, sleep, sleep_score, hrv, spo2, stress, steps, cals, _ = args
+    rollups = {"steps": health_data._daily_totals(steps, "steps"),
+               "calories": health_data._daily_totals(cals, "calories")}
+    build, daily = timed(health_data.build_daily_metrics, hr_summary, hrv, sleep, sleep_score,
+                         spo2, stress, kwargs["azm_df"], kwargs["temp_df"], rollups)
+    one_pass, _ = timed(health_data.window_aggregates, daily, windows)
+    print(f"\n{max(days_list)} days, windows {windows}: one summary per window "
+          f"{per_window * 1000:.1f} ms; daily table {build * 1000:.1f} ms + "
+          f"window aggregates {one_pass * 1000:.2f} ms")
+
+
+def data_before(data, day):
+    """The dataset as exported the day before: every row dated before day."""
+    older = {}
+    for key, df in data.items():
+        column = next((c for c in ("timestamp", "date", "DATE", "start_time")
+                       if isinstance(df, pd.DataFrame) and c in df.columns), None)
+        if column is None:
+            older[key] = df
+            continue
+        dates = pd.to_datetime(df[column])
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)
+        older[key] = df[(dates < day).to_numpy()]
+    return older
+
+
+def bench_incremental(days, takeout=None):
+    """Summary after one new day: full recompute vs the stored daily aggregates."""
+    data = coach_data(days, takeout)
+    args, kwargs = summary_inputs(data=data)
+    last_day = pd.to_datetime(data["detailed_hr_df"]["timestamp"]).max().normalize()
+    period = health_data.SUMMARY_WINDOWS[-1]
+    path = os.path.join(tempfile.mkdtemp(prefix="daily-aggregates-"), "daily.csv")
+
+    build, store = timed(lambda: health_data.update_daily_aggregates(
+        health_data.DailyAggregates(), data_before(data, last_day)), repeat=1)
+    store.save(path)
+    load, store = timed(health_data.DailyAggregates.load, path)
+    update, store = timed(lambda: health_data.update_daily_aggregates(
+        health_data.DailyAggregates.load(path), data))
+    from_store, summary = timed(health_data.create_health_summary, *args, **kwargs,
+                                data_period=period, aggregates=store)
+    full, reference = timed(health_data.create_health_summary, *args, **kwargs,
+                            data_period=period)
+
+    print(f"source        {takeout or f'synthetic, {days} days'}")
+    print(f"store         {len(store)} days, {os.path.getsize(path) / 1024:,.0f} KB CSV")
+    print(f"first build   {build * 1000:>8.1f} ms   (all raw readings)")
+    print(f"load          {load * 1000:>8.1f} ms")
+    print(f"add a day     {update * 1000:>8.1f} ms   (load + last two days of readings)")
+    print(f"summary       {from_store * 1000:>8.1f} ms from the store vs "
+          f"{full * 1000:.1f} ms from raw readings "
+          f"({'identical' if summary == reference else 'differs'})")
+
+
+SAMPLE_QUESTIONS = (
+    "What was my average heart rate during workouts last month?",
+    "How many steps did I take yesterday?",
+    "Highest heart rate in the last 2 weeks",
+    "Median heart rate on weekends",
+    "How many nights did I sleep over 8 hours?",
+    "How many days with more than 10k steps this year?",
+    "Lowest resting heart rate last 90 days",
+    "Average HRV this month",
+)
+
+
+def bench_questions(days, takeout=None):
+    """Local answers to numeric questions: parse plus execution time."""
+    data = coach_data(days, takeout)
+    seconds, _ = timed(health_query.data_end, data, repeat=1)
+    print(f"source        {takeout or f'synthetic, {days} days'}")
+    print(f"daily aggregates built once: {seconds * 1000:.1f} ms\n")
+    for question in SAMPLE_QUESTIONS:
+        seconds, answer = timed(health_query.answer_question, question, data)
+        print(f"{seconds * 1000:>7.2f} ms  {question}\n            {answer['text']}")
+
+
+CHAT_MESSAGES = (
+    "How is my recovery looking?",
+    "Make week 2 easier, I travel that week.",
+    "What heart rate should my long runs stay under?",
+    "Is my sleep good enough for this plan?",
+    "Can I swap Wednesday's strength session for swimming?",
+    "What should I watch in the data next month?",
+)
+
+
+def bench_chat(days, turns, latency):
+    """Tokens sent per chat turn: a new prompt each time vs a cached summary prefix."""
+    args, kwargs = summary_inputs(days)
+    summary = health_data.create_health_summary(*args, **kwargs, data_period=30)
+    reply = ("Your HRV has held steady, so keep the plan but move the long run to Sunday "
+             "and keep it under 150 bpm. ") * 3
+    messages = [CHAT_MESSAGES[i % len(CHAT_MESSAGES)] for i in range(turns)]
+
+    one_shot = [health_data.estimate_tokens(health_coach.build_question_prompt(summary, m))
+                for m in messages]
+    plan = canned_plan_text()
+    print(f"summary ~{health_data.estimate_tokens(summary):,} tokens, fake latency {latency:g} s")
+    print(f"{'turn':>4} {'one-shot':>9} {'chat, inline':>13} {'chat, provider cache':>21}")
+    runs = {}
+    for name, caching in (("inline", False), ("provider", True)):
+        client = FakeGemini(text=reply, latency=latency, context_caching=caching)
+        # min_tokens=0 forces the provider path, whatever the prefix size
+        chat = health_coach.CoachChat(summary, "fake-key", client=client, plan=plan,
+                                      context_cache=health_coach.ContextCache(min_tokens=0))
+        runs[name] = [chat.send(m) for m in messages]
+    real = health_coach.CoachChat(summary, "fake-key", plan=plan,
+                                  client=FakeGemini(context_caching=True))
+    for i in range(turns):
+        print(f"{i + 1:>4} {one_shot[i]:>9,} {runs['inline'][i]['sent_tokens']:>13,} "
+              f"{runs['provider'][i]['sent_tokens']:>21,}")
+    print(f"{'sum':>4} {sum(one_shot):>9,} "
+          f"{sum(t['sent_tokens'] for t in runs['inline']):>13,} "
+          f"{sum(t['sent_tokens'] for t in runs['provider']):>21,}")
+    print("one-shot turns carry no conversation; chat turns carry the plan and the last "
+          f"{health_coach.CHAT_HISTORY_TOKENS:,} tokens of it")
+    skipped = real.provider_caching_skipped
+    print(f"prefix (summary and plan) ~{real.prefix_tokens:,} tokens: " + (
+        f"with the real minimum, provider caching is skipped ({skipped})" if skipped
+        else "long enough for provider caching"))
+
+
+COMPARED_GOALS = [
+    "Run a half marathon in October",
+    "Lose 5 kg without losing strength",
+    "Sleep 8 hours a night",
+    "Swim 2 km without stopping",
+    "Climb a 6b route by summer",
+    "Walk 12,000 steps a day",
+]
+
+
+def bench_goals(days, n_goals, latency):
+    """Several goals at once: one plan after another vs concurrently."""
+    args, kwargs = summary_inputs(days)
+    summary = health_data.create_health_summary(*args, **kwargs, data_period=30)
+    goals = [COMPARED_GOALS[i % len(COMPARED_GOALS)] for i in range(n_goals)]
+    print(f"{n_goals} goals, fake latency {latency:g} s per plan")
+    print(f"{'concurrency':<12} {'first plan':>10} {'all plans':>10}")
+    for concurrency in sorted({1, health_coach.MULTI_GOAL_CONCURRENCY, n_goals}):
+        cache = health_coach.ResponseCache(tempfile.mkdtemp(prefix="coach-bench-"))
+        finished = []
+        t0 = time.perf_counter()
+        health_coach.generate_plans(
+            summary, goals, "fake-key", max_concurrency=concurrency, cache=cache,
+            client=FakeGemini(latency=latency),
+            on_result=lambda i, goal, result: finished.append(time.perf_counter() - t0))
+        print(f"{concurrency:<12} {finished[0]:>9.2f}s {time.perf_counter() - t0:>9.2f}s")
+
+
+def stream_parse(answer, chunk_chars=80):
+    """Feed an answer to PlanParser the way a stream delivers it."""
+    parser = health_coach.PlanParser()
+    for i in range(0, len(answer), chunk_chars):
+        parser.feed(answer[i:i + chunk_chars])
+    return parser.plan
+
+
+def bench_coach(days, takeout, latency, goals="Run a 10 km race in two months"):
+    """Summary, prompt, parsing and end-to-end plan latency against FakeGemini."""
+    args, kwargs = summary_inputs(days, takeout)
+    seconds, summary = timed(health_data.create_health_summary, *args, **kwargs,
+                             data_period=days)
+    prompt = health_coach.build_plan_prompt(summary, goals)
+    full_prompt = health_coach.build_plan_prompt(summary, goals, context_budget=None)
+    select_s, (_, sections) = timed(health_coach.select_context, summary, goals,
+                                    required=health_coach.PLAN_CONTEXT_TAGS)
+    print(f"source        {takeout or f'synthetic, {days} days'}")
+    print(f"summary       {seconds * 1000:>8.1f} ms   {len(summary):>7,} chars  "
+          f"~{health_data.estimate_tokens(summary):,} tokens ({summary_encoding(summary)} tables)")
+    print(f"context       {select_s * 1000:>8.1f} ms   {sum(s['kept'] for s in sections)} of "
+          f"{len(sections)} sections for \"{goals}\"")
+    print(f"prompt        {len(prompt):>19,} chars  ~{health_data.estimate_tokens(prompt):,} tokens "
+          f"(whole summary: ~{health_data.estimate_tokens(full_prompt):,})")
+
+    answer = canned_plan_text()
+    for name, fn in (("clean", health_coach.clean_ai_response),
+                     ("parse_json", health_coach.parse_plan_json),
+                     ("split", health_coach.split_plan_text),
+                     ("stream_parse", stream_parse)):
+        seconds, _ = timed(lambda: [fn(answer) for _ in range(1000)])
+        print(f"{name:<13} {seconds * 1000:>8.1f} us   per {len(answer):,}-char answer")
+
+    print(f"\nend to end, fake latency {latency:g} s (pro overloaded where marked)")
+    print(f"{'strategy':<11} {'mode':<9} {'scenario':<11} {'model':<17} {'ttft':>7} {'total':>7}")
+    cache = health_coach.ResponseCache(tempfile.mkdtemp(prefix="coach-bench-"))
+    scenarios = {
+        "healthy": {},
+        "pro slow": {"latency": {"gemini-2.5-pro": latency * 4, "gemini-2.0-flash": latency}},
+        "pro down": {"errors": {"gemini-2.5-pro": "503 overloaded"}},
+    }
+    for strategy in health_coach.DISPATCH_STRATEGIES:
+        dispatch = {"strategy": strategy, "hedge_after": latency * 2}
+        for scenario, fake_options in scenarios.items():
+            for mode in ("blocking", "stream"):
+                client = FakeGemini(**{"latency": latency, **fake_options})
+                t0 = time.perf_counter()
+                if mode == "stream":
+                    stream = health_coach.PlanStream(summary, goals, "fake-key", cache=cache,
+                                                     refresh=True, client=client, dispatch=dispatch)
+                    for _ in stream:
+                        pass
+                    model, ttft = stream.model, f"{stream.ttft:.2f}"
+                else:
+                    model = health_coach.generate_ai_fitness_plan(
+                        summary, goals, "fake-key", cache=cache, refresh=True,
+                        client=client, dispatch=dispatch)["model"]
+                    ttft = "-"
+                print(f"{strategy:<11} {mode:<9} {scenario:<11} {model:<17} {ttft:>7} "
+                      f"{time.perf_counter() - t0:>7.2f}")
+
+    t0 = time.perf_counter()
+    health_coach.generate_ai_fitness_plan(summary, goals, "fake-key", cache=cache,
+                                          client=FakeGemini(latency=latency))
+    print(f"cache hit   {(time.perf_counter() - t0) * 1000:>39.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("transport", help="chart payload size, JSON vs typed arrays")
+    p.add_argument("--days", type=int, nargs="+", default=[14, 365])
+
+    p = sub.add_parser("charts", help="report PNG export, sequential vs batched")
+    p.add_argument("--days", type=int, nargs="+", default=[14, 365])
+
+    p = sub.add_parser("pdf-memory", help="peak memory of the PDF pipeline, legacy vs in-memory")
+    p.add_argument("--days", type=int, nargs="+", default=[14, 365])
+
+    p = sub.add_parser("report", help="full PDF report, PNG vs SVG charts")
+    p.add_argument("--days", type=int, nargs="+", default=[14, 365])
+
+    p = sub.add_parser("summary", help="health summary build time and token count vs history")
+    p.add_argument("--days", type=int, nargs="+", default=[30, 90, 365])
+    p.add_argument("--budget", type=int, default=health_data.SUMMARY_TOKEN_BUDGET)
+
+    p = sub.add_parser("coach", help="AI coach path against an in-process fake Gemini")
+    p.add_argument("--days", type=int, default=30, help="synthetic data length")
+    p.add_argument("--takeout", help="use this Takeout folder instead of synthetic data")
+    p.add_argument("--latency", type=float, default=0.5, help="fake first-token latency (s)")
+
+    p = sub.add_parser("incremental", help="summary after a new day, stored aggregates vs raw")
+    p.add_argument("--days", type=int, default=365, help="synthetic data length")
+    p.add_argument("--takeout", help="use this Takeout folder instead of synthetic data")
+
+    p = sub.add_parser("questions", help="local answers to numeric questions")
+    p.add_argument("--days", type=int, default=365, help="synthetic data length")
+    p.add_argument("--takeout", help="use this Takeout folder instead of synthetic data")
+
+    p = sub.add_parser("chat", help="coach chat: tokens sent per turn, with and without a cached prefix")
+    p.add_argument("--days", type=int, default=30, help="synthetic data length")
+    p.add_argument("--turns", type=int, default=6)
+    p.add_argument("--latency", type=float, default=0.05, help="fake first-token latency (s)")
+
+    p = sub.add_parser("goals", help="plans for several goals, sequential vs concurrent")
+    p.add_argument("--days", type=int, default=30, help="synthetic data length")
+    p.add_argument("--goals", type=int, default=4, help="number of goals")
+    p.add_argument("--latency", type=float, default=1.0, help="fake first-token latency (s)")
+
+    args = parser.parse_args()
+    if args.command == "transport":
+        bench_transport(args.days)
+    elif args.command == "charts":
+        bench_charts(args.days)
+    elif args.command == "pdf-memory":
+        bench_pdf_memory(args.days)
+    elif args.command == "report":
+        bench_report(args.days)
+    elif args.command == "summary":
+        bench_summary(args.days, args.budget)
+    elif args.command == "coach":
+        bench_coach(args.days, args.takeout, args.latency)
+    elif args.command == "incremental":
+        bench_incremental(args.days, args.takeout)
+    elif args.command == "questions":
+        bench_questions(args.days, args.takeout)
+    elif args.command == "chat":
+        bench_chat(args.days, args.turns, args.latency)
+    elif args.command == "goals":
+        bench_goals(args.days, args.goals, args.latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+In-process stand-in for the google.generativeai client.
+
+Has the same surface the coach uses (configure, then
+GenerativeModel(name).generate_content(prompt, stream=..., request_options=...)),
+so it can be passed as `client` to generate_ai_fitness_plan and PlanStream to
+exercise the coach path offline: no network, no API key.
+
+    client = FakeGemini(latency={"gemini-2.5-pro": 3.0, "gemini-2.0-flash": 0.5},
+                        errors={"gemini-2.5-pro": "503 overloaded"})
+    generate_ai_fitness_plan(summary, goals, "fake-key", client=client)
+
+Latency is the wait before the first chunk (or before the whole answer when
+not streaming); the rest of the text is produced at chars_per_second. With
+context_caching, caching.CachedContent.create and
+GenerativeModel.from_cached_content work as in the real client, and a call
+on a cached model does not count the cached prefix as sent.
+"""
+
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+# ── Canned answer ─────────────────────────────────────────────────────────────
+
+CANNED_PLAN = {
+    "weeks": [
+        {
+            "week": week,
+            "focus": focus,
+            "sessions": [
+                {"day": "Monday", "activity": "Easy run", "duration_min": 30 + 5 * week,
+                 "effort": "easy", "details": "Conversational pace, nose breathing if you can."},
+                {"day": "Wednesday", "activity": "Strength circuit", "duration_min": 35,
+                 "effort": "moderate", "details": "Squats, lunges, rows, planks; 3 rounds."},
+                {"day": "Saturday", "activity": "Long run", "duration_min": 45 + 10 * week,
+                 "effort": "easy" if week < 3 else "moderate",
+                 "details": "Keep heart rate in zone 2 for the first two thirds."},
+            ],
+            "checkpoint": checkpoint,
+        }
+        for week, focus, checkpoint in (
+            (1, "Re-establish a regular aerobic base", "Three sessions done without soreness"),
+            (2, "Extend the long run", "Long run feels easy at the same heart rate"),
+            (3, "Introduce steady efforts", "Resting HR flat or lower than week 1"),
+            (4, "Consolidate and recover", "Long run pace up at the same heart rate"),
+        )
+    ],
+    "after_week_4": "Add ten minutes to the long run every other week and keep one "
+                    "recovery week in four. Watch resting heart rate and HRV; back off "
+                    "if both move the wrong way for more than three days.",
+}
+
+
+def canned_plan_text(plan=CANNED_PLAN):
+    """A plan answer in the section layout build_plan_prompt asks for."""
+    return (
+        "## Where they are right now\n\n"
+        "Your resting heart rate and step counts point to a reasonable base with "
+        "little structured training lately. Most days are light, with a few harder "
+        "sessions that were not followed by enough recovery.\n\n"
+        "That is a good starting point for the goal: the aim for the next month is "
+        "consistency rather than intensity.\n\n"
+        "## 4-week plan\n\n"
+        f"```json\n{json.dumps(plan, indent=2)}\n```\n\n"
+        "## Heart rate targets\n\n"
+        "With a resting heart rate around 60 bpm, keep easy sessions between 125 and "
+        "145 bpm. Steady efforts in week 3 can go up to 160 bpm.\n\n"
+        "## Sleep and recovery\n\n"
+        "Sleep duration is fine on average but varies a lot between weekdays and "
+        "weekends. A fixed wake-up time would help more than an earlier bedtime.\n\n"
+        "## Worth noting in the data\n\n"
+        "HRV dips after the longest sessions and takes two days to recover, so keep "
+        "hard days apart.\n"
+    )
+
+
+# ── Fake client ───────────────────────────────────────────────────────────────
+
+class FakeResponse:
+    """A generate_content result or stream chunk: only .text is used."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGemini:
+    """
+    Stand-in for the google.generativeai module.
+
+    latency and chars_per_second are a number or a {model: number} dict.
+    errors maps a model to an exception (instance or class) or a message;
+    the call raises it straight away, like an overloaded endpoint. A
+    request_options timeout shorter than the model's latency raises
+    TimeoutError once the timeout has passed. truncate_at cuts every answer
+    to that many characters, like a max-token stop. Every call is appended
+    to calls as a dict (model, prompt_chars, stream, cached); prompt_chars
+    includes the system instruction unless it came from a context cache.
+    """
+
+    def __init__(self, text=None, latency=0.5, chars_per_second=4000.0,
+                 chunk_chars=80, errors=None, truncate_at=None, context_caching=False):
+        self.text = text if text is not None else canned_plan_text()
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        self.chunk_chars = chunk_chars
+        self.errors = errors or {}
+        self.truncate_at = truncate_at
+        self.api_key = None
+        self.calls = []
+        self.cached_contents = []
+        self._lock = threading.Lock()
+        self.GenerativeModel = _FakeModelFactory(self)
+        if context_caching:
+            self.caching = SimpleNamespace(CachedContent=_FakeCachedContents(self))
+
+    def configure(self, api_key=None, **kwargs):
+        self.api_key = api_key
+
+    def _setting(self, value, model_name):
+        return value.get(model_name, 0.0) if isinstance(value, dict) else value
+
+
+class FakeCachedContent:
+    """A caching.CachedContent: the model and the prefix it holds."""
+
+    def __init__(self, name, model, system_instruction):
+        self.name = name
+        self.model = model
+        self.system_instruction = system_instruction
+
+
+class _FakeCachedContents:
+    """client.caching.CachedContent; create records what was cached."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, system_instruction=None, contents=None, ttl=None, **kwargs):
+        client = self.client
+        with client._lock:
+            cached = FakeCachedContent(f"cachedContents/{len(client.cached_contents) + 1}",
+                                       model, system_instruction)
+            client.cached_contents.append(cached)
+        return cached
+
+
+class _FakeModelFactory:
+    """client.GenerativeModel: callable, plus from_cached_content."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __call__(self, model_name, system_instruction=None, **kwargs):
+        return _FakeModel(self.client, model_name, system_instruction)
+
+    def from_cached_content(self, cached_content, **kwargs):
+        return _FakeModel(self.client, cached_content.model, cached=cached_content)
+
+
+class _FakeModel:
+    def __init__(self, client, model_name, system_instruction=None, cached=None):
+        self.client = client
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached = cached
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        client = self.client
+        with client._lock:
+            client.calls.append({'model': self.model_name, 'stream': stream,
+                                 'prompt_chars': len(str(contents)) + len(self.system_instruction or ''),
+                                 'cached': self.cached is not None})
+
+        error = client.errors.get(self.model_name)
+        if error is not None:
+            raise RuntimeError(error) if isinstance(error, str) else error
+
+        latency = client._setting(client.latency, self.model_name)
+        speed = client._setting(client.chars_per_second, self.model_name)
+        timeout = (request_options or {}).get('timeout')
+        text = client.text[:client.truncate_at] if client.truncate_at else client.text
+
+        if stream:
+            return self._stream(text, latency, speed, timeout)
+        total = latency + (len(text) / speed if speed else 0.0)
+        self._wait(total, timeout)
+        return FakeResponse(text)
+
+    def _stream(self, text, latency, speed, timeout):
+        self._wait(latency, timeout)
+        step = self.client.chunk_chars
+        for i in range(0, len(text), step):
+            piece = text[i:i + step]
+            if speed:
+                time.sleep(len(piece) / speed)
+            yield FakeResponse(piece)
+
+    def _wait(self, seconds, timeout):
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"{self.model_name}: deadline of {timeout:g} s exceeded")
+        time.sleep(seconds)
@@ -0,0 +1,1208 @@
+"""
+================================================================================
+Fitbit AI Health Coach - Gemini coaching
+================================================================================
+Builds the coaching and question prompts, dispatches them to Gemini models
+(sequential, hedged or raced), caches answers on disk and parses the
+returned 4-week plan.
+Does not import Streamlit, so the coach can be driven and benchmarked
+without the UI.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+
+import pandas as pd
+
+from health_data import estimate_tokens, split_summary
+
+# -- Gemini AI (optional) -----------------------------------------------------
+try:
+    import google.generativeai as genai
+    GEMINI_AVAILABLE = True
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+# Tried in order: the first model that answers wins
+COACH_MODELS = ("gemini-2.5-pro", "gemini-2.0-flash")
+
+# ==============================================================================
+# GEMINI RESPONSE CACHE
+# ==============================================================================
+
+# Answers quote the user's health figures, so they stay in memory unless
+# disk persistence is asked for: by the dashboard's opt-in toggle (which
+# uses COACH_DISK_CACHE_DIR) or, for scripts, by setting COACH_CACHE_DIR
+COACH_CACHE_DIR = os.environ.get("COACH_CACHE_DIR") or None
+COACH_DISK_CACHE_DIR = COACH_CACHE_DIR or os.path.join(
+    os.path.expanduser("~"), ".cache", "fitbit-ai-coach")
+
+# Cached answers expire after a week; the whole cache is capped at 20 MB
+COACH_CACHE_TTL = 7 * 24 * 3600
+COACH_CACHE_MAX_BYTES = 20 * 2**20
+
+
+class ResponseCache:
+    """
+    Cache of model answers by prompt: in memory, or one JSON file per
+    prompt when directory is given.
+
+    Entries older than ttl seconds are ignored and removed. When the cache
+    grows past max_bytes the least recently used entries are dropped (on
+    disk, a hit refreshes the file's mtime).
+    """
+
+    def __init__(self, directory=None, ttl=COACH_CACHE_TTL, max_bytes=COACH_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt, models):
+        """Hash of everything that determines the answer."""
+        payload = json.dumps({'prompt': prompt, 'models': list(models)}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """The cached entry for key, or None if missing or expired."""
+        if self.directory is None:
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is None:
+                    return None
+                if time.time() - entry['created'] > self.ttl:
+                    del self._memory[key]
+                    return None
+                self._memory.move_to_end(key)
+                return entry
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('created', 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, text, model):
+        """Store an answer, then evict expired and least recently used entries."""
+        entry = {'created': time.time(), 'model': model, 'text': text}
+        if self.directory is None:
+            with self._lock:
+                self._memory[key] = entry
+                self._memory.move_to_end(key)
+                self._evict_memory()
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp, self._path(key))
+            self.evict()
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove every cached answer."""
+        with self._lock:
+            self._memory.clear()
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(('.json', '.tmp')):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _evict_memory(self):
+        """evict for the in-memory store; entries are kept in least recently used order."""
+        now = time.time()
+        for key in [k for k, e in self._memory.items() if now - e['created'] > self.ttl]:
+            del self._memory[key]
+        total = sum(len(e['text'].encode('utf-8')) for e in self._memory.values())
+        while total > self.max_bytes and len(self._memory) > 1:
+            _, entry = self._memory.popitem(last=False)
+            total -= len(entry['text'].encode('utf-8'))
+
+    def evict(self):
+        """Drop expired entries, then the oldest-used ones until under max_bytes."""
+        if self.directory is None:
+            with self._lock:
+                self._evict_memory()
+            return
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            # mtime is refreshed on every hit, so it never lags 'created'
+            if total <= self.max_bytes and now - mtime <= self.ttl:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# Default for every coach call in the process; on disk only with COACH_CACHE_DIR
+COACH_CACHE = ResponseCache(COACH_CACHE_DIR)
+
+
+# ==============================================================================
+# MODEL DISPATCH
+# ==============================================================================
+
+# How COACH_MODELS are tried:
+#   sequential - the next model starts only after the previous one failed
+#   hedged     - the next model also starts if the previous one has not
+#                answered within hedge_after seconds; first good answer wins
+#   race       - every model starts at once; first good answer wins
+DISPATCH_STRATEGIES = {
+    "sequential": "Sequential (fallback on failure)",
+    "hedged": "Hedged (fallback after a delay)",
+    "race": "Race (all models at once)",
+}
+
+# Timeouts bound the wait for an answer (for streams: for the first chunk)
+DISPATCH_OPTIONS = {
+    "strategy": "sequential",
+    "hedge_after": 15.0,
+    "timeouts": {"gemini-2.5-pro": 120.0, "gemini-2.0-flash": 60.0},
+}
+
+# A stream that started in time may take this long in total; the
+# first-chunk timeouts above are enforced by dispatch_models
+STREAM_TOTAL_TIMEOUT = 600.0
+
+
+class ModelStats:
+    """
+    Rolling per-model latency and outcome counts, shared by every coach call
+    in the process. Outcomes are ok, error, timeout and abandoned (still
+    running when another model won).
+    """
+
+    def __init__(self, window=50):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=self.window))
+        self._outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, model, outcome, seconds=None):
+        with self._lock:
+            self._outcomes[model][outcome] += 1
+            if outcome == 'ok' and seconds is not None:
+                self._latencies[model].append(seconds)
+
+    def summary(self):
+        """One row per model: call counts by outcome and p50/p95 of successes."""
+        with self._lock:
+            rows = []
+            for model, outcomes in self._outcomes.items():
+                latencies = sorted(self._latencies[model])
+                pct = (lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+                       if latencies else None)
+                rows.append({
+                    'Model': model,
+                    'Calls': sum(outcomes.values()),
+                    'OK': outcomes['ok'],
+                    'Errors': outcomes['error'],
+                    'Timeouts': outcomes['timeout'],
+                    'Abandoned': outcomes['abandoned'],
+                    'p50 (s)': pct(0.5),
+                    'p95 (s)': pct(0.95),
+                })
+        return pd.DataFrame(rows)
+
+
+MODEL_STATS = ModelStats()
+
+
+def dispatch_models(call, models=COACH_MODELS, options=None, stats=MODEL_STATS):
+    """
+    Run call(model, timeout) for models according to options (see
+    DISPATCH_OPTIONS) and return (model, result) for the first success.
+
+    Each attempt runs in a worker thread. A model that misses its timeout is
+    given up on and, like a failure, lets the next model start at once.
+    Threads of losing or timed-out models are not interrupted; their
+    results are discarded. Every attempt is recorded in stats. Raises
+    RuntimeError listing each model's error if none succeeds.
+    """
+    options = {**DISPATCH_OPTIONS, **(options or {})}
+    strategy = options['strategy']
+    if strategy not in DISPATCH_STRATEGIES:
+        raise ValueError(f"Unknown dispatch strategy: {strategy}")
+    timeouts = options['timeouts']
+
+    queue = list(models)
+    pending = {}
+    started = {}
+    errors = {}
+    last_launch = [0.0]
+    pool = ThreadPoolExecutor(max_workers=len(queue), thread_name_prefix="coach")
+
+    def launch():
+        model = queue.pop(0)
+        timeout = timeouts.get(model)
+        started[model] = last_launch[0] = time.perf_counter()
+        pending[pool.submit(call, model, timeout)] = model
+
+    try:
+        launch()
+        while strategy == 'race' and queue:
+            launch()
+
+        while pending:
+            now = time.perf_counter()
+            deadlines = [started[m] + timeouts[m] for m in pending.values() if timeouts.get(m)]
+            if strategy == 'hedged' and queue:
+                deadlines.append(last_launch[0] + options['hedge_after'])
+            wait_for = max(0.0, min(deadlines) - now) if deadlines else None
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                model = pending.pop(future)
+                seconds = time.perf_counter() - started[model]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[model] = e
+                    stats.record(model, 'error', seconds)
+                    continue
+                stats.record(model, 'ok', seconds)
+                for other in pending.values():
+                    stats.record(other, 'abandoned')
+                return model, result
+
+            now = time.perf_counter()
+            for future, model in list(pending.items()):
+                timeout = timeouts.get(model)
+                if timeout and now - started[model] >= timeout:
+                    del pending[future]
+                    errors[model] = TimeoutError(f"no answer within {timeout:g} s")
+                    stats.record(model, 'timeout', now - started[model])
+
+            hedge_due = (strategy == 'hedged'
+                         and now - last_launch[0] >= options['hedge_after'])
+            if queue and (not pending or hedge_due):
+                launch()
+    finally:
+        pool.shutdown(wait=False)
+
+    raise RuntimeError("All models failed: " + "; ".join(
+        f"{model}: {error}" for model, error in errors.items()))
+
+
+# ==============================================================================
+# CONTEXT SELECTION
+# ==============================================================================
+
+# Token budget for the summary sections sent with a prompt; None sends all
+CONTEXT_TOKEN_BUDGET = 1500
+
+# Always sent with a plan: the prompt asks for HR targets from resting HR,
+# sleep advice and session counts from the exercise history
+PLAN_CONTEXT_TAGS = ('profile', 'period', 'trends', 'cardio', 'sleep', 'exercise')
+QUESTION_CONTEXT_TAGS = ('profile', 'period', 'trends')
+
+# Words a goal or question uses for each topic; added to the tagged
+# sections' text so "marathon" or "lose weight" finds them
+TAG_TERMS = {
+    'cardio': "heart rate resting hrv variability cardio cardiovascular aerobic endurance "
+              "stamina fitness vo2 run running marathon race 5k 10k cycling ride swim "
+              "triathlon rowing conditioning",
+    'zones': "zone zones intensity interval intervals threshold tempo pace speed effort "
+             "hiit sprint fat burn peak",
+    'sleep': "sleep sleeping insomnia rest tired fatigue energy nap bedtime wake recovery",
+    'activity': "steps walk walking active activity sedentary calories weight loss lose fat "
+                "burn diet daily movement hiking",
+    'exercise': "exercise workout training train session sessions gym strength lifting weights "
+                "climbing bouldering yoga hiit sport muscle build run cycling swimming",
+    'oxygen': "oxygen spo2 saturation altitude mountain mountaineering breathing apnea snoring "
+              "lungs",
+    'stress': "stress stressed anxiety relax calm mental burnout recovery readiness mood "
+              "meditation",
+    'temperature': "temperature fever illness sick cold flu cycle menstrual ovulation",
+}
+
+
+def _terms(text):
+    """Lower-case word stems: plural s and -ing dropped, so runs / running match run."""
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(word) > 5 and word.endswith('ing'):
+            word = word[:-3]
+            if len(word) > 2 and word[-1] == word[-2]:
+                word = word[:-1]
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class SectionIndex:
+    """
+    BM25 index over the sections of a health summary. Each section is
+    indexed with its text plus the TAG_TERMS of its tags, so a goal can
+    match a section that never uses the goal's words.
+    """
+
+    def __init__(self, sections, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(_terms(" ".join([s['title'], s['text'],
+                                              *(TAG_TERMS.get(t, '') for t in s['tags'])])))
+                     for s in sections]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.docs) if self.docs else 0.0
+        self.doc_freq = Counter(term for doc in self.docs for term in doc)
+
+    def scores(self, query):
+        """BM25 score of every section for query, in section order."""
+        n = len(self.docs)
+        terms = set(_terms(query))
+        idf = {t: math.log(1 + (n - self.doc_freq[t] + 0.5) / (self.doc_freq[t] + 0.5))
+               for t in terms if self.doc_freq[t]}
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            scores.append(sum(w * doc[t] * (self.k1 + 1) / (doc[t] + norm)
+                              for t, w in idf.items() if doc[t]))
+        return scores
+
+
+def select_context(health_summary, query, token_budget=CONTEXT_TOKEN_BUDGET,
+                   required=QUESTION_CONTEXT_TAGS):
+    """
+    The summary cut down to the sections relevant to query (a goal or a
+    question), offline.
+
+    Sections whose own topic (first tag) is in required, and untagged ones,
+    are always kept. The rest are ranked by SectionIndex score and added
+    while they fit in token_budget; sections that share no term with the
+    query are left out. Returns (text, sections) with each section's score
+    and whether it was kept; token_budget None keeps everything.
+    """
+    sections = split_summary(health_summary)
+    scores = SectionIndex(sections).scores(query)
+    used = 0
+    for section, score in zip(sections, scores):
+        section['score'] = score
+        section['tokens'] = estimate_tokens(section['text'])
+        section['kept'] = (token_budget is None or not section['tags']
+                           or section['tags'][0] in required)
+        used += section['tokens'] if section['kept'] else 0
+    for section in sorted(sections, key=lambda s: -s['score']):
+        if section['kept'] or section['score'] <= 0:
+            continue
+        if used + section['tokens'] <= token_budget:
+            section['kept'] = True
+            used += section['tokens']
+    text = "\n\n".join(s['text'] for s in sections if s['kept'])
+    return text, sections
+
+
+# ==============================================================================
+# GEMINI AI COACH FUNCTIONS
+# ==============================================================================
+
+def build_plan_prompt(health_summary: str, goals: str, language: str = "English",
+                      context_budget=CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    The coaching prompt for one health summary and set of goals. The summary
+    is cut to the sections relevant to the goals within context_budget
+    tokens (select_context); None sends all of it.
+    """
+    health_summary, _ = select_context(health_summary, goals, context_budget, PLAN_CONTEXT_TAGS)
+    lang_line = "Please respond in French." if language == "Fran\u00e7ais" else "Please respond in English."
+    prompt = f"""You are a fitness coach reviewing someone's Fitbit data. Write in plain, direct English -- no bullet points with bold headers, no emojis, no promotional language, no rule-of-three lists, no "testament to" or "pivotal" or "landscape" or "delve" or similar AI filler. Write like a person, not a consultant deck.
+
+Here is the user's health data:
+
+{health_summary}
+
+Their goal: {goals}
+
+The entire plan -- the activities chosen, the type of training, the progression -- must be specific to their stated goal. If the goal is a marathon, build running endurance. If the goal is rock climbing, focus on grip strength, pulling strength, and body tension. If the goal is weight loss, focus on caloric burn and sustainable activity. Do not default to a generic running plan regardless of what the user asked for.
+
+Respond using these exact section headers in this order:
+
+## Where they are right now
+Write 2-4 paragraphs. Be direct and specific about their current fitness level based on the numbers. What does the data actually show? Explain what their current fitness means in the context of their specific goal.
+
+## 4-week plan
+
+Output ONLY a JSON code block for this section (no prose before or after the block). Use this exact JSON structure:
+
+```json
+{{{{
+  "weeks": [
+    {{{{
+      "week": 1,
+      "focus": "one-line description of the week's goal",
+      "sessions": [
+        {{{{
+          "day": "Monday",
+          "activity": "activity name",
+          "duration_min": 30,
+          "effort": "easy/moderate/hard",
+          "details": "concrete description of what to do"
+        }}}}
+      ],
+      "checkpoint": "what should be measurably different after this week"
+    }}}}
+  ],
+  "after_week_4": "What to do from week 5 onward. Be specific about progression -- how to increase volume or intensity, what metrics to watch, when to move to the next level."
+}}}}
+```
+
+Include all 4 weeks. Be specific with durations and effort levels.
+
+IMPORTANT -- session count per week: Use the average sessions per week from their exercise history as your reference point, not their peak week. Apply this logic:
+- Zero or near-zero logged exercise: start with 2-3 sessions per week. Check their step count -- if they average over 10,000 steps/day they are not sedentary, just unstructured. Treat them accordingly, not as a complete beginner.
+- 1-2 sessions per week average: suggest 2-3 sessions per week. A small, sustainable step up.
+- 3-4 sessions per week average: keep 3-4 sessions per week. Do not inflate it.
+- 5+ sessions per week average: keep a similar volume, but if their HRV is declining or their resting HR is trending up, reduce by one session and add recovery instead.
+Do not jump more than 1 session per week above their recent average in Week 1, regardless of their goal. If the goal eventually requires more volume (e.g. marathon training), increase gradually across the 4 weeks, not from day one.
+
+IMPORTANT -- capability calibration: Do not default to a beginner template. Look at the actual session durations in the exercise history and use them as the baseline for Week 1. If they have been training for 40-50 minutes per session, do not prescribe 20-25 minute sessions. A gap of a few weeks does not reset someone to zero -- it means reducing intensity or effort, not duration. If the problem is that they have been training at too high an intensity, say so clearly and prescribe the same durations at a lower effort, not shorter sessions. This applies to any activity type, not just running.
+
+## Heart rate targets
+1-2 paragraphs. Use their actual resting heart rate from the data to give real bpm numbers. Adapt this section to their goal: for endurance goals (running, cycling, swimming), explain aerobic zones and the specific range to target. For strength or skill-based goals (climbing, weightlifting, martial arts, yoga), explain how to use heart rate as a recovery and effort gauge rather than a training zone target -- in those cases the HR data is useful for spotting overtraining, not for pacing sessions.
+
+## Sleep and recovery
+1-2 paragraphs. What does their sleep data say, and what specific changes would help?
+
+## Worth noting in the data
+1 paragraph. Observations that might affect training. Not warnings.
+
+{lang_line}
+"""
+    return prompt
+
+
+def generate_ai_fitness_plan(health_summary: str, goals: str,
+                              api_key: str, language: str = "English",
+                              cache=None, refresh: bool = False, client=None,
+                              dispatch=None, context_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Call Gemini to generate a personalised fitness plan.
+
+    Answers are cached by prompt and model list (see ResponseCache; by
+    default COACH_CACHE, in memory), so an unchanged request costs no API call. refresh skips the lookup but
+    still stores the new answer. client stands in for the google.generativeai
+    module (configure / GenerativeModel), e.g. a local fake. dispatch
+    overrides DISPATCH_OPTIONS (strategy, hedge delay, per-model timeouts).
+    context_budget caps the summary sections sent (see build_plan_prompt).
+    Returns a dict with the plan text, the model that answered, whether it
+    came from the cache, and elapsed seconds. Raises if every model fails.
+    """
+    prompt = build_plan_prompt(health_summary, goals, language, context_budget)
+    return _generate(prompt, api_key, cache, refresh, client, dispatch)
+
+
+def build_question_prompt(health_summary: str, question: str, language: str = "English",
+                          context_budget=CONTEXT_TOKEN_BUDGET) -> str:
+    """The prompt for an open-ended question, with the summary sections relevant to it."""
+    health_summary, _ = select_context(health_summary, question, context_budget)
+    lang_line = "Please respond in French." if language == "Fran\u00e7ais" else "Please respond in English."
+    return f"""You are a fitness coach reviewing someone's Fitbit data. Answer their question in plain, direct English, in one to three short paragraphs. Use the numbers in the data where they help and say so when the data cannot answer the question. No bullet points with bold headers, no emojis, no filler.
+
+Here is the user's health data:
+
+{health_summary}
+
+Their question: {question}
+
+{lang_line}
+"""
+
+
+def ask_coach(question: str, health_summary: str, api_key: str, language: str = "English",
+              cache=None, refresh: bool = False, client=None, dispatch=None,
+              context_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Answer an open-ended question about the data with Gemini.
+
+    Same caching, client, dispatch and context options and the same result dict as
+    generate_ai_fitness_plan.
+    """
+    prompt = build_question_prompt(health_summary, question, language, context_budget)
+    return _generate(prompt, api_key, cache, refresh, client, dispatch)
+
+
+def _generate(prompt, api_key, cache=None, refresh=False, client=None, dispatch=None):
+    """One cached, dispatched, non-streaming Gemini call for prompt."""
+    started = time.perf_counter()
+    cache = cache or COACH_CACHE
+    key = cache.key(prompt, COACH_MODELS)
+
+    if not refresh:
+        entry = cache.get(key)
+        if entry is not None:
+            return {'text': entry['text'], 'model': entry['model'], 'cached': True,
+                    'seconds': time.perf_counter() - started}
+
+    client = client or genai
+    client.configure(api_key=api_key)
+
+    def call(model_name, timeout):
+        response = client.GenerativeModel(model_name).generate_content(
+            prompt, request_options={'timeout': timeout} if timeout else None)
+        # .text raises for blocked or empty answers, which counts as a failure
+        return response.text
+
+    model_name, text = dispatch_models(call, COACH_MODELS, dispatch)
+    cache.put(key, text, model_name)
+    return {'text': text, 'model': model_name, 'cached': False,
+            'seconds': time.perf_counter() - started}
+
+
+class PlanStream:
+    """
+    Iterate over a fitness plan's text as Gemini streams it.
+
+    Same prompt, cache and dispatch options as generate_ai_fitness_plan;
+    the dispatch is decided on the first chunk, so a hedge or race is won by
+    the model that starts writing first. Once text has been shown, errors
+    propagate. A cache hit yields the whole answer at once. After iteration,
+    text, model, cached, ttft (seconds to the first chunk) and seconds (total)
+    are set, and the answer is cached.
+    """
+
+    def __init__(self, health_summary, goals, api_key, language="English",
+                 cache=None, refresh=False, client=None, dispatch=None,
+                 context_budget=CONTEXT_TOKEN_BUDGET):
+        self.prompt = build_plan_prompt(health_summary, goals, language, context_budget)
+        self.api_key = api_key
+        self.cache = cache or COACH_CACHE
+        self.key = self.cache.key(self.prompt, COACH_MODELS)
+        self.refresh = refresh
+        self.client = client or genai
+        self.dispatch = dispatch
+        self.text = ''
+        self.model = None
+        self.cached = False
+        self.ttft = None
+        self.seconds = None
+
+    def __iter__(self):
+        started = time.perf_counter()
+        entry = None if self.refresh else self.cache.get(self.key)
+        if entry is not None:
+            self.text, self.model, self.cached = entry['text'], entry['model'], True
+            self.ttft = self.seconds = time.perf_counter() - started
+            yield self.text
+            return
+
+        self.client.configure(api_key=self.api_key)
+        self.model, pieces = dispatch_models(self._open, COACH_MODELS, self.dispatch)
+        self.ttft = time.perf_counter() - started
+        chunks = []
+        for piece in pieces:
+            chunks.append(piece)
+            yield piece
+
+        self.text = ''.join(chunks)
+        self.seconds = time.perf_counter() - started
+        self.cache.put(self.key, self.text, self.model)
+
+    def _open(self, model_name, timeout):
+        """
+        Start a stream and wait for its first text; returns the text iterator.
+        timeout is not passed on: the client would apply it to the whole
+        stream, while dispatch_models already gives up on a late first chunk.
+        """
+        response = self.client.GenerativeModel(model_name).generate_content(
+            self.prompt, stream=True,
+            request_options={'timeout': STREAM_TOTAL_TIMEOUT})
+        pieces = self._texts(response)
+        first = next(pieces, None)
+        if first is None:
+            raise RuntimeError(f"{model_name} returned no text")
+        return _prepend(first, pieces)
+
+    @staticmethod
+    def _texts(response):
+        for chunk in response:
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only finish metadata)
+                continue
+            if piece:
+                yield piece
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+# Plans generated at once when comparing goals
+MULTI_GOAL_CONCURRENCY = 3
+
+
+async def generate_plans_async(health_summary, goals, api_key, language="English",
+                               max_concurrency=MULTI_GOAL_CONCURRENCY, on_result=None,
+                               **options):
+    """
+    One plan per goal, at most max_concurrency in flight at a time.
+
+    Each plan is a generate_ai_fitness_plan call (options: cache, refresh,
+    client, dispatch, context_budget) on a worker thread, since the Gemini
+    client blocks. on_result(index, goal, result) runs on the event loop
+    as each plan finishes, in completion order; result is the plan dict or
+    the exception that call raised. Returns the results in goals order.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def one(index, goal):
+        async with semaphore:
+            try:
+                result = await loop.run_in_executor(executor, partial(
+                    generate_ai_fitness_plan, health_summary, goal, api_key, language, **options))
+            except Exception as e:
+                result = e
+        if on_result is not None:
+            on_result(index, goal, result)
+        return result
+
+    try:
+        return await asyncio.gather(*(one(i, goal) for i, goal in enumerate(goals)))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def generate_plans(health_summary, goals, api_key, language="English", **kwargs):
+    """Blocking generate_plans_async, for scripts and the dashboard."""
+    return asyncio.run(generate_plans_async(health_summary, goals, api_key, language, **kwargs))
+
+
+def split_plan_text(text):
+    """
+    Split a (possibly partial) plan into what can be rendered so far.
+
+    Returns (prose, plan_json, plan_pending). prose is the markdown without
+    the 4-week plan section. plan_json is the parsed plan; while the ```json
+    block is still open (streaming or truncated) it holds only the weeks
+    and sessions finished so far, or None before the first. plan_pending is
+    True while the block is open, in which case prose stops at the plan
+    header.
+    """
+    header = re.search(r'## 4-week plan', text, re.IGNORECASE)
+    if header is None:
+        return text, None, False
+    closed = re.search(r'```json.*?```', text[header.start():], re.DOTALL)
+    if closed is None:
+        return text[:header.start()], parse_plan_json(text), True
+    prose = text[:header.start()] + text[header.start() + closed.end():]
+    return re.sub(r'\n{3,}', '\n\n', prose).strip(), parse_plan_json(text), False
+
+
+def clean_ai_response(text: str) -> str:
+    """Remove HTML tags and clean AI response for clean markdown rendering."""
+    # Remove HTML br tags
+    text = re.sub(r'<br\s*/?>', '\n', text)
+    # Remove other HTML tags
+    text = re.sub(r'<[^>]+>', '', text)
+    # Remove excessive blank lines (more than 2 in a row)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    # Remove curly quotes
+    text = text.replace('\u201c', '"').replace('\u201d', '"')
+    text = text.replace('\u2018', "'").replace('\u2019', "'")
+    return text.strip()
+
+
+def parse_plan_json(text):
+    """
+    Extract and parse the JSON 4-week plan block from the AI response.
+
+    A block that is cut short or slightly malformed (trailing commas, an
+    unterminated string) is repaired by PlanParser: the weeks and sessions
+    that did finish are kept.
+    """
+    match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except (json.JSONDecodeError, ValueError):
+            pass
+    parser = PlanParser()
+    parser.feed(text)
+    return parser.plan
+
+
+def render_plan_as_df(plan_data):
+    """Flatten the weekly plan JSON into a display DataFrame."""
+    rows = []
+    for week in plan_data.get('weeks', []):
+        wk_num = week.get('week', '')
+        focus = week.get('focus', '')
+        checkpoint = week.get('checkpoint', '')
+        for session in week.get('sessions', []):
+            rows.append({
+                'Week': wk_num,
+                'Focus': focus,
+                'Day': session.get('day', ''),
+                'Activity': session.get('activity', ''),
+                'Duration': f"{session.get('duration_min', '')} min",
+                'Effort': session.get('effort', ''),
+                'Details': session.get('details', ''),
+                'Checkpoint': checkpoint,
+            })
+    return pd.DataFrame(rows) if rows else pd.DataFrame()
+
+
+# ==============================================================================
+# INCREMENTAL PLAN PARSING
+# ==============================================================================
+
+_STRING_END = re.compile(r'["\\]')
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def _loads_tolerant(text):
+    """json.loads that accepts trailing commas and raw newlines in strings."""
+    return json.loads(_TRAILING_COMMA.sub(r'\1', text), strict=False)
+
+
+class JsonScanner:
+    """
+    Tracks the structure of a JSON document fed a chunk at a time.
+
+    Each character is looked at once. The scanner knows the open containers
+    (with the key each sits under), the end of the last complete value and
+    whether a closing ``` fence has been reached, which is enough to cut
+    finished objects out of a partial document and to close a truncated one.
+    on_close(path, start, end) is called for every object that closes; path
+    is the keys of its enclosing containers, None for list items.
+    """
+
+    def __init__(self, on_close=None):
+        self.text = ''
+        self.on_close = on_close
+        self.stack = []
+        self.done = False
+        self._pos = 0
+        self._string_start = None
+        self._scalar = False
+        self._safe = (0, '')
+
+    def feed(self, chunk):
+        self.text += chunk
+        text, i, n = self.text, self._pos, len(self.text)
+        while i < n and not self.done:
+            if self._string_start is not None:
+                match = _STRING_END.search(text, i)
+                if match is None:
+                    i = n
+                    break
+                i = match.end()
+                if match.group() == '\\':
+                    if i == n:
+                        # Escape split across chunks: look at it again next time
+                        i -= 1
+                        break
+                    i += 1
+                else:
+                    self._end_string(i)
+                continue
+            c = text[i]
+            if c == '"':
+                self._string_start = i
+            elif c in '{[':
+                parent = self.stack[-1] if self.stack else None
+                self.stack.append({'open': c, 'start': i, 'expect_key': c == '{', 'key': None,
+                                   'name': parent['key'] if parent else None})
+                self._mark_safe(i + 1)
+            elif c in '}]':
+                self._end_scalar(i)
+                if self.stack:
+                    frame = self.stack.pop()
+                    if frame['open'] == '{' and self.on_close is not None:
+                        self.on_close([f['name'] for f in self.stack] + [frame['name']],
+                                      frame['start'], i + 1)
+                    if self.stack and self.stack[-1]['open'] == '{':
+                        self.stack[-1]['key'] = None
+                self._mark_safe(i + 1)
+            elif c == ',':
+                self._end_scalar(i)
+                if self.stack and self.stack[-1]['open'] == '{':
+                    self.stack[-1]['expect_key'] = True
+                    self.stack[-1]['key'] = None
+            elif c == '`':
+                self._end_scalar(i)
+                self.done = True
+            elif c.isspace():
+                self._end_scalar(i)
+            elif c != ':':
+                self._scalar = True
+            i += 1
+        self._pos = i
+
+    def _end_string(self, end):
+        frame = self.stack[-1] if self.stack else None
+        if frame and frame['open'] == '{' and frame['expect_key']:
+            frame['key'] = self.text[self._string_start + 1:end - 1]
+            frame['expect_key'] = False
+        else:
+            self._mark_safe(end)
+        self._string_start = None
+
+    def _end_scalar(self, end):
+        if self._scalar:
+            self._scalar = False
+            self._mark_safe(end)
+
+    def _mark_safe(self, end):
+        self._safe = (end, ''.join(_CLOSERS[f['open']] for f in reversed(self.stack)))
+
+    def repaired(self):
+        """
+        The document so far, cut after its last complete value and closed.
+        A value still being written (a string, a number that may have more
+        digits) is left out along with its key.
+        """
+        end, closers = self._safe
+        return self.text[:end] + closers
+
+
+def repair_json(text):
+    """Close a truncated JSON document and drop its unfinished last value."""
+    scanner = JsonScanner()
+    scanner.feed(text)
+    return scanner.repaired()
+
+
+class PlanParser:
+    """
+    Incremental, tolerant parser for the ```json plan block of an answer.
+
+    Feed it the answer a chunk at a time, as it streams. feed returns what
+    the new text completed, in order: ('session', week_index, session) for
+    each finished session and ('week', week_index, week) for each finished
+    week. plan is the plan so far (every finished week, the week being
+    written with its finished sessions, and any other complete fields), or
+    None before the first session is done. Small mistakes models make
+    (trailing commas, raw newlines in strings) are tolerated, and an answer
+    cut off mid-plan still yields the part that arrived.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.weeks = []
+        self.sessions = []
+        self._scanner = None
+        self._events = []
+
+    @property
+    def closed(self):
+        """True once the block's closing fence has arrived."""
+        return self._scanner is not None and self._scanner.done
+
+    def feed(self, chunk):
+        self.text += chunk
+        if self._scanner is None:
+            start = self.text.find('```json')
+            if start < 0:
+                return []
+            self._scanner = JsonScanner(on_close=self._on_close)
+            chunk = self.text[start + len('```json'):]
+        self._events = []
+        self._scanner.feed(chunk)
+        return self._events
+
+    def _on_close(self, path, start, end):
+        if path[1:] == ['weeks', None, 'sessions', None]:
+            kind, store = 'session', self.sessions
+        elif path[1:] == ['weeks', None]:
+            kind, store = 'week', self.weeks
+        else:
+            return
+        try:
+            item = _loads_tolerant(self._scanner.text[start:end])
+        except ValueError:
+            return
+        store.append(item)
+        self._events.append((kind, len(self.weeks) - (kind == 'week'), item))
+        if kind == 'week':
+            self.sessions = []
+
+    @property
+    def plan(self):
+        if self._scanner is None or not (self.weeks or self.sessions):
+            return None
+        try:
+            plan = _loads_tolerant(self._scanner.repaired())
+        except ValueError:
+            plan = None
+        if not isinstance(plan, dict) or not isinstance(plan.get('weeks'), list):
+            plan = {'weeks': []}
+        weeks = list(self.weeks)
+        stack = self._scanner.stack
+        if len(stack) >= 3 and stack[1]['name'] == 'weeks':
+            # The week being written: its complete fields, finished sessions only
+            partial = plan['weeks'][len(weeks)] if len(plan['weeks']) > len(weeks) else {}
+            weeks.append({**(partial if isinstance(partial, dict) else {}),
+                          'sessions': list(self.sessions)})
+        plan['weeks'] = weeks
+        return plan
+
+
+# ==============================================================================
+# COACH CHAT
+# ==============================================================================
+
+# Providers reject explicit context caches shorter than this many tokens
+PROVIDER_CACHE_MIN_TOKENS = 4096
+PROVIDER_CACHE_TTL = 3600
+
+# Earlier turns sent with each chat message, newest first, up to this many tokens
+CHAT_HISTORY_TOKENS = 2000
+
+
+def build_chat_prefix(health_summary: str, language: str = "English",
+                      goals: str = None, plan: str = None) -> str:
+    """
+    The system instruction of a coach chat: its rules, the whole health
+    summary and, when there is one, the plan already written for goals.
+    The plan is part of the prefix rather than the history, so it is never
+    trimmed away however long the conversation gets.
+    """
+    lang_line = "Please respond in French." if language == "Fran\u00e7ais" else "Please respond in English."
+    plan_section = "" if not plan else f"""
+Their goal: {goals or "not stated"}
+
+The 4-week plan you already wrote for them, which the conversation is about:
+
+{plan}
+"""
+    return f"""You are a fitness coach chatting with someone about their Fitbit data. Answer in plain, direct English, briefly unless they ask for detail. Use the numbers in the data where they help, refer back to anything already discussed in the conversation (including a plan you wrote), and say so when the data cannot answer. No bullet points with bold headers, no emojis, no filler.
+
+Here is the user's health data:
+
+{health_summary}
+{plan_section}
+{lang_line}
+"""
+
+
+class ContextCache:
+    """
+    Stable prompt prefixes, stored once and referred to by key.
+
+    A chat keeps only the key of its prefix (the system instruction with the
+    health summary). When the client supports explicit context caching
+    (caching.CachedContent in google.generativeai) and the prefix is long
+    enough, the prefix is uploaded once per model and API key and later
+    turns send only the conversation. Otherwise it goes out as the system
+    instruction of every call, byte for byte the same, so a provider's
+    implicit prefix caching can still reuse it.
+    """
+
+    def __init__(self, min_tokens=PROVIDER_CACHE_MIN_TOKENS, ttl=PROVIDER_CACHE_TTL):
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self._prefixes = {}
+        self._provider = {}
+        self._lock = threading.Lock()
+
+    def put(self, prefix):
+        """Store prefix (once) and return its key."""
+        key = hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            self._prefixes.setdefault(key, prefix)
+        return key
+
+    def get(self, key):
+        with self._lock:
+            return self._prefixes.get(key)
+
+    def model(self, client, model_name, key, api_key=None):
+        """(GenerativeModel carrying the prefix, whether it is a provider cache)."""
+        prefix = self.get(key)
+        if prefix is None:
+            raise KeyError(f"Unknown context prefix {key}")
+        cached = self._provider_cache(client, model_name, key, prefix, api_key)
+        if cached is not None:
+            return client.GenerativeModel.from_cached_content(cached), True
+        return client.GenerativeModel(model_name, system_instruction=prefix), False
+
+    def _provider_cache(self, client, model_name, key, prefix, api_key):
+        caching = getattr(client, 'caching', None)
+        if caching is None or estimate_tokens(prefix) < self.min_tokens:
+            return None
+        owner = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:8]
+        slot = (key, model_name, owner)
+        with self._lock:
+            entry = self._provider.get(slot)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        try:
+            cached = caching.CachedContent.create(
+                model=model_name, system_instruction=prefix, ttl=timedelta(seconds=self.ttl))
+        except Exception:
+            # Model without explicit caching, quota, prefix too short for it:
+            # send the prefix inline instead (and do not retry until the TTL)
+            cached = None
+        with self._lock:
+            # Renewed a little before the provider expires it
+            self._provider[slot] = (cached, time.time() + self.ttl * 0.9)
+        return cached
+
+
+# Shared by every chat in the process, like MODEL_STATS
+CONTEXT_CACHE = ContextCache()
+
+
+class CoachChat:
+    """
+    A multi-turn conversation with the coach about one health summary.
+
+    The summary, and the plan under discussion when given (with its goals),
+    live in a stable prefix held by a ContextCache. The chat
+    keeps the prefix key, the turns as [role, text] pairs and one metrics
+    dict per turn: plain data (state) that fits in st.session_state and
+    rebuilds the chat with CoachChat(..., state=state). Each message sends
+    the prefix (or a provider cache reference), the latest turns within
+    history_tokens and the new message, dispatched like the plan
+    (DISPATCH_OPTIONS).
+    """
+
+    def __init__(self, health_summary, api_key, language="English", context_cache=None,
+                 client=None, dispatch=None, history_tokens=CHAT_HISTORY_TOKENS, state=None,
+                 goals=None, plan=None):
+        self.context_cache = context_cache or CONTEXT_CACHE
+        self.plan = plan
+        prefix = build_chat_prefix(health_summary, language, goals, plan)
+        self.prefix_key = self.context_cache.put(prefix)
+        self.prefix_tokens = estimate_tokens(prefix)
+        self.api_key = api_key
+        self.client = client or genai
+        self.dispatch = dispatch
+        self.history_tokens = history_tokens
+        state = state or {}
+        self.turns = [list(turn) for turn in state.get('turns', [])]
+        self.metrics = list(state.get('metrics', []))
+
+    @property
+    def state(self):
+        return {'prefix_key': self.prefix_key, 'turns': self.turns, 'metrics': self.metrics}
+
+    @property
+    def provider_caching_skipped(self):
+        """Why the prefix cannot go to a provider context cache, or None if it can."""
+        if getattr(self.client, 'caching', None) is None:
+            return "the Gemini client has no context caching"
+        if self.prefix_tokens < self.context_cache.min_tokens:
+            what = "summary and plan are" if self.plan else "summary is"
+            return (f"the {what} ~{self.prefix_tokens:,} tokens, below the provider's "
+                    f"{self.context_cache.min_tokens:,}-token minimum")
+        return None
+
+    def _history(self):
+        """The latest turns within history_tokens, oldest first, starting with the user."""
+        kept, used = [], 0
+        for role, text in reversed(self.turns):
+            tokens = estimate_tokens(text)
+            if used + tokens > self.history_tokens:
+                break
+            kept.append((role, text))
+            used += tokens
+        kept.reverse()
+        while kept and kept[0][0] != 'user':
+            used -= estimate_tokens(kept.pop(0)[1])
+        return kept, used
+
+    def send(self, message):
+        """
+        Send one message; returns the reply text and the turn's metrics:
+        model, seconds, prefix tokens and whether a provider cache served
+        them, history turns and tokens, tokens sent and reply tokens.
+        """
+        started = time.perf_counter()
+        history, history_tokens = self._history()
+        contents = [{'role': role, 'parts': [text]} for role, text in history]
+        contents.append({'role': 'user', 'parts': [message]})
+        self.client.configure(api_key=self.api_key)
+        served_from_cache = {}
+
+        def call(model_name, timeout):
+            model, cached = self.context_cache.model(self.client, model_name, self.prefix_key,
+                                                     self.api_key)
+            response = model.generate_content(
+                contents, request_options={'timeout': timeout} if timeout else None)
+            served_from_cache[model_name] = cached
+            return response.text
+
+        model_name, text = dispatch_models(call, COACH_MODELS, self.dispatch)
+        prefix_cached = served_from_cache[model_name]
+        message_tokens = estimate_tokens(message)
+        metric = {
+            'turn': len(self.metrics) + 1,
+            'model': model_name,
+            'seconds': time.perf_counter() - started,
+            'prefix_tokens': self.prefix_tokens,
+            'prefix_cached': prefix_cached,
+            'history_turns': len(history),
+            'history_tokens': history_tokens,
+            'sent_tokens': history_tokens + message_tokens + (0 if prefix_cached else self.prefix_tokens),
+            'reply_tokens': estimate_tokens(text),
+        }
+        self.turns += [['user', message], ['model', text]]
+        self.metrics.append(metric)
+        return {'text': text, **metric}
+
+    def metrics_table(self):
+        """Per-turn metrics as a display DataFrame."""
+        if not self.metrics:
+            return pd.DataFrame()
+        df = pd.DataFrame(self.metrics)
+        df['prefix_cached'] = df['prefix_cached'].map({True: 'provider cache', False: 'inline'})
+        return df.rename(columns={
+            'turn': 'Turn', 'model': 'Model', 'seconds': 'Seconds',
+            'prefix_tokens': 'Summary tokens', 'prefix_cached': 'Summary sent',
+            'history_turns': 'History turns', 'history_tokens': 'History tokens',
+            'sent_tokens': 'Tokens sent', 'reply_tokens': 'Reply tokens',
+        })
@@ -0,0 +1,1973 @@
+"""
+================================================================================
+Fitbit AI Health Coach - Data loading and analytics
+================================================================================
+Parsers for a Fitbit Takeout export and the numeric work built on them:
+exercise metrics, daily rollups, the shared time grid and the health summary.
+Does not import Streamlit, so batch tools can use it without the UI.
+"""
+
+import glob
+import json
+import os
+import re
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# TAKEOUT FILES
+# ==============================================================================
+
+def find_takeout_folder():
+    patterns = [
+        "./Takeout*/Fitbit/Global Export Data",
+        "./Takeout*/Fitbit",
+        "./**/Takeout*/Fitbit/Global Export Data",
+        "./**/Takeout*/Fitbit",
+        "./Fitbit/Global Export Data",
+        "./Fitbit",
+    ]
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if matches:
+            return matches[0]
+    return None
+
+def load_json_file(filepath):
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except:
+        return None
+
+def load_csv_file(filepath):
+    try:
+        return pd.read_csv(filepath)
+    except:
+        return None
+
+def find_files(base_path, pattern):
+    if base_path is None:
+        return []
+    search_path = os.path.join(base_path, "**", pattern)
+    return glob.glob(search_path, recursive=True)
+
+def find_fitbit_folder(root):
+    """The Fitbit export folder inside an extracted Takeout, or root itself."""
+    patterns = [
+        os.path.join(root, "Takeout*", "Fitbit", "Global Export Data"),
+        os.path.join(root, "Takeout*", "Fitbit"),
+        os.path.join(root, "Fitbit", "Global Export Data"),
+        os.path.join(root, "Fitbit"),
+        os.path.join(root, "**", "Fitbit", "Global Export Data"),
+        os.path.join(root, "**", "Fitbit"),
+    ]
+
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if matches:
+            return matches[0]
+
+    # If no Fitbit folder found, return the root
+    return root
+
+def extract_takeout_zip(zip_path, dest_dir):
+    """Extract a Takeout ZIP into dest_dir and return its Fitbit folder."""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(dest_dir)
+    return find_fitbit_folder(dest_dir)
+
+# ==============================================================================
+# DATA LOADERS -- CONTINUOUS DETAILED DATA
+# ==============================================================================
+
+def parse_detailed_heart_rate(base_path):
+    """Load ALL continuous heart rate data."""
+    files = find_files(base_path, "heart_rate-*.json")
+    all_data = []
+
+    for f in files:
+        data = load_json_file(f)
+        if data and isinstance(data, list):
+            for entry in data:
+                value_data = entry.get('value', {})
+                bpm = value_data.get('bpm', 0)
+                if bpm and 30 <= bpm <= 220:
+                    all_data.append({
+                        'timestamp': entry.get('dateTime'),
+                        'bpm': bpm,
+                        'confidence': value_data.get('confidence', 0)
+                    })
+
+    if all_data:
+        df = pd.DataFrame(all_data)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], format='%m/%d/%y %H:%M:%S')
+        df = df.sort_values('timestamp')
+        return df
+    return pd.DataFrame()
+
+def parse_detailed_steps(base_path):
+    """Load ALL continuous step data."""
+    files = find_files(base_path, "steps-*.json")
+    all_data = []
+
+    for f in files:
+        data = load_json_file(f)
+        if data and isinstance(data, list):
+            for entry in data:
+                try:
+                    steps = int(entry.get('value', 0))
+                    all_data.append({
+                        'timestamp': entry.get('dateTime'),
+                        'steps': steps
+                    })
+                except:
+                    pass
+
+    if all_data:
+        df = pd.DataFrame(all_data)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], format='%m/%d/%y %H:%M:%S')
+        df = df.sort_values('timestamp')
+        return df
+    return pd.DataFrame()
+
+def parse_detailed_calories(base_path):
+    """Load ALL continuous calorie data."""
+    files = find_files(base_path, "calories-*.json")
+    all_data = []
+
+    for f in files:
+        data = load_json_file(f)
+        if data and isinstance(data, list):
+            for entry in data:
+                try:
+                    cals = float(entry.get('value', 0))
+                    all_data.append({
+                        'timestamp': entry.get('dateTime'),
+                        'calories': cals
+                    })
+                except:
+                    pass
+
+    if all_data:
+        df = pd.DataFrame(all_data)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], format='%m/%d/%y %H:%M:%S')
+        df = df.sort_values('timestamp')
+        return df
+    return pd.DataFrame()
+
+def parse_sleep_data(base_path):
+    """Load sleep data."""
+    sleep_files = find_files(base_path, "sleep-*.json")
+    all_sleep = []
+
+    for f in sleep_files:
+        data = load_json_file(f)
+        if data and isinstance(data, list):
+            for entry in data:
+                sleep_record = {
+                    'date': entry.get('dateOfSleep'),
+                    'start_time': entry.get('startTime'),
+                    'end_time': entry.get('endTime'),
+                    'duration_minutes': entry.get('duration', 0) / 60000 if entry.get('duration') else 0,
+                    'minutes_asleep': entry.get('minutesAsleep'),
+                    'minutes_awake': entry.get('minutesAwake'),
+                    'time_in_bed': entry.get('timeInBed'),
+                    'efficiency': entry.get('efficiency'),
+                    'type': entry.get('type'),
+                    'main_sleep': entry.get('mainSleep', False),
+                }
+
+                levels = entry.get('levels', {})
+                summary = levels.get('summary', {})
+
+                if sleep_record['type'] == 'stages':
+                    if 'deep' in summary:
+                        sleep_record['deep_minutes'] = summary['deep'].get('minutes', 0)
+                    if 'light' in summary:
+                        sleep_record['light_minutes'] = summary['light'].get('minutes', 0)
+                    if 'rem' in summary:
+                        sleep_record['rem_minutes'] = summary['rem'].get('minutes', 0)
+                    if 'wake' in summary:
+                        sleep_record['wake_minutes'] = summary['wake'].get('minutes', 0)
+                else:
+                    if 'restless' in summary:
+                        sleep_record['restless_minutes'] = summary['restless'].get('minutes', 0)
+                    if 'awake' in summary:
+                        sleep_record['awake_minutes'] = summary['awake'].get('minutes', 0)
+                    if 'asleep' in summary:
+                        sleep_record['asleep_minutes'] = summary['asleep'].get('minutes', 0)
+
+                all_sleep.append(sleep_record)
+
+    if all_sleep:
+        # Sort before DataFrame creation to avoid pandas nullable-type sort issues
+        all_sleep.sort(key=lambda x: str(x.get('date', '')))
+        # Normalise all values to plain Python types (no pd.NA, no pd.BooleanDtype)
+        clean = []
+        for rec in all_sleep:
+            clean.append({k: (bool(v) if isinstance(v, bool) else
+                              (int(v) if isinstance(v, int) else
+                               (float(v) if isinstance(v, float) else v)))
+                          for k, v in rec.items()})
+        df = pd.DataFrame(clean)
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df = df[df['date'].notna()].reset_index(drop=True)
+        return df
+    return pd.DataFrame()
+
+def parse_heart_rate_summary(base_path):
+    """Load resting heart rate summaries."""
+    files = find_files(base_path, "resting_heart_rate-*.json")
+    all_data = []
+
+    for f in files:
+        data = load_json_file(f)
+        if data and isinstance(data, list):
+            for entry in data:
+                value_data = entry.get('value', {})
+                hr_value = value_data.get('value', 0)
+                if hr_value and hr_value > 30:
+                    all_data.append({
+                        'date': entry.get('dateTime'),
+                        'resting_hr': hr_value,
+                        'error': value_data.get('error', 0)
+                    })
+
+    if all_data:
+        df = pd.DataFrame(all_data)
+        df['date'] = pd.to_datetime(df['date'], format='%m/%d/%y %H:%M:%S')
+        df = df.sort_values('date')
+        return df
+    return pd.DataFrame()
+
+def parse_hrv(base_path):
+    """Load heart rate variability data."""
+    search_dirs = [
+        base_path.replace("Global Export Data", "Heart Rate Variability"),
+        base_path
+    ]
+
+    all_data = []
+    for search_dir in search_dirs:
+        files = find_files(search_dir, "Daily Heart Rate Variability Summary*.csv")
+        for f in files:
+            df = load_csv_file(f)
+            if df is not None and not df.empty and 'timestamp' in df.columns:
+                all_data.append(df)
+
+    if all_data:
+        combined = pd.concat(all_data, ignore_index=True)
+        combined['timestamp'] = pd.to_datetime(combined['timestamp'])
+        combined = combined.sort_values('timestamp').drop_duplicates(subset=['timestamp'])
+        return combined
+    return pd.DataFrame()
+
+def parse_spo2(base_path):
+    """Load oxygen saturation data."""
+    search_dirs = [
+        base_path.replace("Global Export Data", "Oxygen Saturation (SpO2)"),
+        base_path
+    ]
+
+    for search_dir in search_dirs:
+        files = find_files(search_dir, "Daily SpO2*.csv")
+        if files:
+            df = load_csv_file(files[0])
+            if df is not None and not df.empty:
+                df['timestamp'] = pd.to_datetime(df['timestamp'])
+                return df
+    return pd.DataFrame()
+
+def parse_stress_score(base_path):
+    """Load stress score data."""
+    search_dirs = [
+        base_path.replace("Global Export Data", "Stress Score"),
+        base_path
+    ]
+
+    for search_dir in search_dirs:
+        files = find_files(search_dir, "Stress Score.csv")
+        if files:
+            df = load_csv_file(files[0])
+            if df is not None and not df.empty:
+                df['DATE'] = pd.to_datetime(df['DATE'])
+                return df
+    return pd.DataFrame()
+
+def parse_sleep_score(base_path):
+    """Load sleep score data."""
+    files = find_files(base_path.replace("Global Export Data", "").rstrip("/"), "*/sleep_score.csv")
+    if not files:
+        files = find_files(base_path, "sleep_score.csv")
+
+    if files:
+        df = load_csv_file(files[0])
+        if df is not None and not df.empty:
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            df['date'] = df['timestamp'].dt.date
+            return df
+    return pd.DataFrame()
+
+def parse_profile(base_path):
+    """Load user profile."""
+    search_dirs = [
+        base_path.replace("Global Export Data", "Your Profile"),
+        base_path
+    ]
+
+    for search_dir in search_dirs:
+        files = find_files(search_dir, "Profile.csv")
+        if files:
+            df = load_csv_file(files[0])
+            if df is not None and not df.empty:
+                return df.iloc[0].to_dict()
+    return {}
+
+# ==============================================================================
+# EXERCISE DATA PARSER
+# ==============================================================================
+
+def parse_exercise_data(base_path):
+    """
+    Parse exercise sessions from Fitbit export:
+      - exercise-*.json  (Global Export Data)
+      - UserExercises*.csv (Health Fitness Data_GoogleData)
+    Returns a DataFrame sorted most-recent first.
+    """
+    all_exercises = []
+
+    # 1. JSON exercise files
+    json_files = find_files(base_path, "exercise-*.json")
+    for f in sorted(json_files):
+        data = load_json_file(f)
+        if not data or not isinstance(data, list):
+            continue
+        for ex in data:
+            start_time = ex.get('startTime', '')
+            date_str = start_time[:10] if start_time else ''
+            if not date_str:
+                continue
+            record = {
+                'date': date_str,
+                'start_time': start_time,
+                'end_time': ex.get('endTime', ''),
+                'activity_name': ex.get('activityName', 'Unknown'),
+                'duration_minutes': round(ex.get('duration', 0) / 60000, 1),
+                'calories': float(ex.get('calories', 0) or 0),
+                'avg_heart_rate': float(ex.get('averageHeartRate', 0) or 0),
+                'steps': float(ex.get('steps', 0) or 0),
+                'distance_km': round(float(ex.get('distance', 0) or 0), 2),
+            }
+            all_exercises.append(record)
+
+    # 2. CSV exercise files (broader search from Fitbit root)
+    fitbit_root = base_path
+    for _ in range(4):
+        fitbit_root = os.path.dirname(fitbit_root)
+        if os.path.basename(fitbit_root).lower().startswith('fitbit'):
+            break
+    csv_files = find_files(fitbit_root, "UserExercises*.csv")
+    for csv_f in csv_files:
+        df_csv = load_csv_file(csv_f)
+        if df_csv is None or df_csv.empty:
+            continue
+        for _, row in df_csv.iterrows():
+            try:
+                # Support both old export format (human-readable columns) and
+                # new Google Takeout format (snake_case columns)
+                start_raw = str(row.get('exercise_start', row.get('Start Time', '')) or '')
+                date_str = start_raw[:10] if len(start_raw) >= 10 else ''
+                if not date_str:
+                    continue
+
+                # Duration: compute from start/end if no Duration column
+                dur_min = 0.0
+                if 'exercise_end' in row.index:
+                    try:
+                        t_start = pd.to_datetime(start_raw, utc=True)
+                        t_end = pd.to_datetime(str(row.get('exercise_end', '') or ''), utc=True)
+                        dur_min = (t_end - t_start).total_seconds() / 60
+                    except Exception:
+                        dur_min = 0.0
+                else:
+                    dur_raw = str(row.get('Duration', '0:0') or '0:0')
+                    dur_parts = dur_raw.replace('h', ':').replace('m', ':').replace('s', '').split(':')
+                    if len(dur_parts) >= 2:
+                        try:
+                            dur_min = float(dur_parts[0]) * 60 + float(dur_parts[1])
+                        except Exception:
+                            dur_min = 0.0
+
+                # Distance: new format stores in mm, old format in km
+                dist_km = 0.0
+                if 'tracker_total_distance_mm' in row.index:
+                    try:
+                        dist_km = float(str(row.get('tracker_total_distance_mm', '0') or '0') or 0) / 1_000_000
+                    except Exception:
+                        dist_km = 0.0
+                else:
+                    try:
+                        dist_km = float(str(row.get('Distance (km)', '0') or '0').replace(',', '.') or 0)
+                    except Exception:
+                        dist_km = 0.0
+
+                def _safe_float(val):
+                    try:
+                        return float(str(val or '0').replace(',', '.') or 0)
+                    except Exception:
+                        return 0.0
+
+                record = {
+                    'date': date_str,
+                    'start_time': start_raw,
+                    'end_time': str(row.get('exercise_end', '') or ''),
+                    'activity_name': str(
+                        row.get('activity_name', row.get('Activity Name', 'Unknown')) or 'Unknown'
+                    ),
+                    'duration_minutes': round(dur_min, 1),
+                    'calories': _safe_float(
+                        row.get('tracker_total_calories', row.get('Calories (kcal)', 0))
+                    ),
+                    'avg_heart_rate': _safe_float(
+                        row.get('tracker_avg_heart_rate', row.get('Average Heart Rate', 0))
+                    ),
+                    'steps': _safe_float(
+                        row.get('tracker_total_steps', row.get('Steps', 0))
+                    ),
+                    'distance_km': round(dist_km, 2),
+                }
+                all_exercises.append(record)
+            except Exception:
+                pass
+
+    if not all_exercises:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(all_exercises)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    # Session bounds as naive timestamps on the same clock as the HR export.
+    # JSON start times are naive, CSV ones carry a +0000 offset; sessions
+    # without an explicit end are closed from their duration.
+    for col in ('start_time', 'end_time'):
+        df[col] = pd.to_datetime(df[col].replace('', None), errors='coerce',
+                                 utc=True, format='mixed').dt.tz_localize(None)
+    df['end_time'] = df['end_time'].fillna(
+        df['start_time'] + pd.to_timedelta(df['duration_minutes'], unit='m'))
+    df = df.sort_values(['date', 'start_time'], ascending=False)
+    df = df.drop_duplicates(subset=['date', 'activity_name', 'duration_minutes'])
+    return df.reset_index(drop=True)
+
+
+def parse_azm(base_path):
+    """Load Active Zone Minutes data (actual minutes in each HR zone per day)."""
+    # Files: Active Zone Minutes - YYYY-MM-DD.csv
+    # Columns: date_time, heart_zone_id, total_minutes
+    files = find_files(base_path, "Active Zone Minutes*.csv")
+    if not files:
+        # Try from Fitbit root
+        fitbit_root = base_path
+        for _ in range(4):
+            fitbit_root = os.path.dirname(fitbit_root)
+            if os.path.basename(fitbit_root).lower().startswith('fitbit'):
+                break
+        files = find_files(fitbit_root, "Active Zone Minutes*.csv")
+    all_rows = []
+    for f in files:
+        df_f = load_csv_file(f)
+        if df_f is None or df_f.empty:
+            continue
+        for _, row in df_f.iterrows():
+            try:
+                dt_raw = str(row.get('date_time', '') or '')
+                if not dt_raw:
+                    continue
+                date_str = dt_raw[:10]
+                zone = str(row.get('heart_zone_id', '') or '').strip()
+                mins = float(str(row.get('total_minutes', '0') or '0') or 0)
+                all_rows.append({'date': date_str, 'zone': zone, 'minutes': mins})
+            except Exception:
+                pass
+    if not all_rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(all_rows)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    return df
+
+
+def parse_temperature(base_path):
+    """Load nightly computed wrist skin temperature from Fitbit."""
+    # Files: Computed Temperature - YYYY-MM-DD.csv
+    # Columns: type, sleep_start, sleep_end, temperature_samples, nightly_temperature,
+    #          baseline_relative_nightly_standard_deviation, ...
+    files = find_files(base_path, "Computed Temperature*.csv")
+    if not files:
+        fitbit_root = base_path
+        for _ in range(4):
+            fitbit_root = os.path.dirname(fitbit_root)
+            if os.path.basename(fitbit_root).lower().startswith('fitbit'):
+                break
+        files = find_files(fitbit_root, "Computed Temperature*.csv")
+    all_rows = []
+    for f in files:
+        df_f = load_csv_file(f)
+        if df_f is None or df_f.empty:
+            continue
+        for _, row in df_f.iterrows():
+            try:
+                sleep_start = str(row.get('sleep_start', '') or '')
+                if not sleep_start or len(sleep_start) < 10:
+                    continue
+                date_str = sleep_start[:10]
+                temp = float(str(row.get('nightly_temperature', '') or '') or 0)
+                dev = float(str(row.get('baseline_relative_nightly_standard_deviation', '') or '') or 0)
+                if temp > 0:
+                    all_rows.append({'date': date_str, 'temp_c': temp, 'deviation': dev})
+            except Exception:
+                pass
+    if not all_rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(all_rows)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date'])
+    df = df.sort_values('date')
+    return df
+
+
+# ==============================================================================
+# EXERCISE SESSION DRILL-DOWN
+# ==============================================================================
+
+# Zone bounds as a fraction of max HR (same split as the health summary)
+HR_ZONES = [
+    ('fat_burn', 'Fat-burn', 0.50),
+    ('cardio', 'Cardio', 0.70),
+    ('peak', 'Peak', 0.85),
+]
+
+
+def estimate_max_hr(profile, default_age=30):
+    """Estimated max HR (220 minus age) from the profile date of birth."""
+    age = default_age
+    if profile and 'date_of_birth' in profile:
+        try:
+            dob = datetime.strptime(str(profile['date_of_birth']), '%Y-%m-%d')
+            age = int((datetime.now() - dob).days / 365.25)
+        except Exception:
+            pass
+    return 220 - age
+
+
+def _timestamps_ns(values):
+    """Timestamps as int64 nanoseconds, for searchsorted against the HR trace."""
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').view('i8')
+
+
+def _nearest_sample(ts, targets, tolerance_ns):
+    """Index of the HR sample closest to each target, or -1 if none within tolerance."""
+    right = np.clip(np.searchsorted(ts, targets), 1, len(ts) - 1)
+    left = right - 1
+    pick = np.where(np.abs(ts[right] - targets) < np.abs(targets - ts[left]), right, left)
+    return np.where(np.abs(ts[pick] - targets) <= tolerance_ns, pick, -1)
+
+
+def compute_exercise_hr_metrics(exercise_df, hr_df, max_hr, tolerance_s=15):
+    """
+    Per-session heart rate metrics from the continuous HR trace.
+
+    Every session is mapped to its slice of the (sorted) HR series with
+    searchsorted, then all sessions are reduced together from cumulative sums
+    and reduceat -- no per-session loop, so the cost is O(readings + sessions).
+    Returns a frame aligned on exercise_df.index with sample count, average,
+    peak, cardiac drift (2nd half minus 1st half average), 1/2-minute HR
+    recovery after the session end and minutes in each HR zone.
+    """
+    columns = (['hr_samples', 'hr_avg', 'hr_peak', 'hr_drift', 'hrr_1min', 'hrr_2min']
+               + [f'{key}_min' for key, _, _ in HR_ZONES])
+    if (exercise_df.empty or hr_df.empty or 'start_time' not in exercise_df.columns):
+        return pd.DataFrame(columns=columns, index=exercise_df.index, dtype=float)
+
+    sessions = exercise_df[['start_time', 'end_time']]
+    valid = sessions.notna().all(axis=1).to_numpy()
+    ts = _timestamps_ns(hr_df['timestamp'])
+    bpm = hr_df['bpm'].to_numpy(dtype=float)
+    n = len(ts)
+
+    start = _timestamps_ns(sessions['start_time'].fillna(pd.Timestamp(0)))
+    end = np.maximum(_timestamps_ns(sessions['end_time'].fillna(pd.Timestamp(0))), start)
+    lo = np.searchsorted(ts, start, side='left')
+    hi = np.searchsorted(ts, end, side='left')
+    mid = np.searchsorted(ts, start + (end - start) // 2, side='left')
+    count = np.where(valid, hi - lo, 0)
+
+    # Prefix sums: one O(n) pass, then every session is two lookups
+    cs_bpm = np.concatenate(([0.0], np.cumsum(bpm)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hr_avg = np.where(count > 0, (cs_bpm[hi] - cs_bpm[lo]) / count, np.nan)
+        first = (cs_bpm[mid] - cs_bpm[lo]) / (mid - lo)
+        second = (cs_bpm[hi] - cs_bpm[mid]) / (hi - mid)
+    hr_drift = np.where((mid > lo) & (hi > mid) & valid, second - first, np.nan)
+
+    # Peak: reduceat over interleaved [lo, hi) bounds; even slots are the sessions
+    bpm_ext = np.append(bpm, np.nan)
+    bounds = np.empty(2 * len(lo), dtype=np.intp)
+    bounds[0::2] = lo
+    bounds[1::2] = hi
+    hr_peak = np.maximum.reduceat(bpm_ext, bounds)[0::2]
+    hr_peak = np.where(count > 0, hr_peak, np.nan)
+
+    # Time in zone: each reading counts until the next one, capped so that
+    # off-wrist gaps are not credited to a zone
+    dt_s = np.minimum(np.diff(ts, append=ts[-1]) / 1e9, 60.0)
+    zone_edges = [max_hr * frac for _, _, frac in HR_ZONES] + [np.inf]
+    zone_minutes = {}
+    for (key, _, _), low, high in zip(HR_ZONES, zone_edges[:-1], zone_edges[1:]):
+        cs_zone = np.concatenate(([0.0], np.cumsum(dt_s * ((bpm >= low) & (bpm < high)))))
+        zone_minutes[f'{key}_min'] = np.where(valid, (cs_zone[hi] - cs_zone[lo]) / 60, np.nan)
+
+    # Recovery: HR at the session end minus HR 1 and 2 minutes later
+    tol = int(tolerance_s * 1e9)
+    end_idx = _nearest_sample(ts, end, tol) if n > 1 else np.full(len(end), -1)
+    recovery = {}
+    for label, offset_s in [('hrr_1min', 60), ('hrr_2min', 120)]:
+        after_idx = (_nearest_sample(ts, end + int(offset_s * 1e9), tol)
+                     if n > 1 else np.full(len(end), -1))
+        ok = valid & (end_idx >= 0) & (after_idx >= 0)
+        recovery[label] = np.where(ok, bpm[end_idx] - bpm[after_idx], np.nan)
+
+    metrics = pd.DataFrame({
+        'hr_samples': count,
+        'hr_avg': hr_avg,
+        'hr_peak': hr_peak,
+        'hr_drift': hr_drift,
+        **recovery,
+        **zone_minutes,
+    }, index=exercise_df.index)
+    return metrics[columns]
+
+
+# ==============================================================================
+# DAILY ROLLUPS
+# ==============================================================================
+
+HR_BAND_QUANTILES = (0.05, 0.25, 0.50, 0.75, 0.95)
+
+
+def grouped_quantiles(keys, values, quantiles):
+    """
+    Quantiles of values per key with one sort instead of one per group.
+
+    Group rank and value are packed into a single float key (rank * span +
+    value), so one np.sort orders every group internally; each quantile is
+    then read by index with linear interpolation (same as pandas' default).
+    Returns the unique keys, per-group counts, min, max and a dict of
+    quantile -> array.
+    """
+    values = np.asarray(values, dtype=float)
+    changes = keys[1:] != keys[:-1]
+    if np.all(keys[1:] >= keys[:-1]):
+        # Already grouped (e.g. a time-sorted series): rank without sorting
+        rank = np.r_[0, np.cumsum(changes)]
+        uniq = keys[np.r_[True, changes]]
+    else:
+        uniq, rank = np.unique(keys, return_inverse=True)
+
+    offset = values.min()
+    span = values.max() - offset + 1
+    packed = np.sort(rank * span + (values - offset))
+    counts = np.bincount(rank)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    ends = starts + counts
+    v = packed - np.repeat(np.arange(len(uniq)) * span, counts) + offset
+
+    result = {}
+    for q in quantiles:
+        pos = starts + q * (counts - 1)
+        below = np.floor(pos).astype(np.intp)
+        above = np.ceil(pos).astype(np.intp)
+        result[q] = v[below] + (v[above] - v[below]) * (pos - below)
+    return uniq, counts, v[starts], v[ends - 1], result
+
+
+def compute_daily_hr_percentiles(hr_df, quantiles=HR_BAND_QUANTILES):
+    """Per-day min, max and percentile bands of the continuous heart rate."""
+    if hr_df.empty or 'bpm' not in hr_df.columns:
+        return pd.DataFrame()
+
+    day_keys = hr_df['timestamp'].to_numpy(dtype='datetime64[D]').view('i8')
+    days, counts, mins, maxs, bands = grouped_quantiles(
+        day_keys, hr_df['bpm'].to_numpy(), quantiles)
+
+    df = pd.DataFrame({
+        'date': pd.to_datetime(days.astype('datetime64[D]')),
+        'readings': counts,
+        'min': mins,
+    })
+    for q in quantiles:
+        df[f'p{int(round(q * 100))}'] = bands[q]
+    df['max'] = maxs
+    return df
+
+
+def _daily_totals(df, column):
+    """Sum a minute-level series per calendar day."""
+    if df.empty or column not in df.columns:
+        return pd.DataFrame(columns=['date', column])
+    daily = df.groupby(df['timestamp'].dt.floor('D'))[column].sum()
+    return daily.rename_axis('date').reset_index()
+
+
+def build_daily_rollups(hr_df, steps_df, cals_df):
+    """
+    Day-level aggregates of the continuous series, computed once per dataset.
+
+    The dashboard caches this via cached_daily_rollups, so reruns reuse the
+    tables instead of re-grouping millions of readings.
+    """
+    return {
+        'hr_bands': compute_daily_hr_percentiles(hr_df),
+        'steps': _daily_totals(steps_df, 'steps'),
+        'calories': _daily_totals(cals_df, 'calories'),
+    }
+
+
+# ==============================================================================
+# SHARED TIME GRID
+# ==============================================================================
+
+# Candidate bucket widths for the combined timeline, finest first
+GRID_BUCKET_WIDTHS = [pd.Timedelta(w) for w in (
+    '1min', '2min', '5min', '10min', '15min', '30min',
+    '1h', '2h', '3h', '6h', '12h', '1D', '2D', '7D',
+)]
+
+
+def build_time_grid(start, end, max_buckets):
+    """
+    Bucket edges (int64 ns) covering [start, end] with the finest width from
+    GRID_BUCKET_WIDTHS that keeps the number of buckets within max_buckets.
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    span = max(end - start, pd.Timedelta('1min'))
+    width = next((w for w in GRID_BUCKET_WIDTHS if span / w <= max_buckets),
+                 GRID_BUCKET_WIDTHS[-1])
+    first = start.floor(width) if width <= pd.Timedelta('1D') else start.floor('1D')
+    n_buckets = int(np.ceil((end - first) / width)) or 1
+    edges = first.value + np.arange(n_buckets + 1, dtype=np.int64) * width.value
+    return edges, width
+
+
+def align_series_to_grid(edges, ts, values, how='mean'):
+    """
+    Reduce a time-sorted series onto grid buckets in one pass.
+
+    Bucket boundaries are found with searchsorted and every bucket is reduced
+    with ufunc.reduceat, so the cost is O(readings + buckets). Empty buckets
+    are NaN for mean/min/max and 0 for sum. Buckets are [edge, next edge),
+    except the last, which also takes a reading exactly on the final edge.
+    """
+    n_buckets = len(edges) - 1
+    i0 = np.searchsorted(ts, edges[0])
+    i1 = np.searchsorted(ts, edges[-1], side='right')
+    sub = np.asarray(values[i0:i1], dtype=float)
+    empty_value = 0.0 if how == 'sum' else np.nan
+    if len(sub) == 0:
+        return np.full(n_buckets, empty_value)
+
+    idx = np.searchsorted(ts[i0:i1], edges[:-1])
+    bounds = np.r_[idx, len(sub)]
+    counts = np.diff(bounds)
+    # The sentinel makes trailing empty buckets (idx == len(sub)) valid
+    # reduceat indices; the extra final bound stops the last bucket with
+    # data at len(sub), so it neither loses nor gains a reading
+    sub_ext = np.append(sub, np.nan)
+    if how in ('sum', 'mean'):
+        out = np.add.reduceat(sub_ext, bounds)[:-1]
+        if how == 'mean':
+            out = out / np.maximum(counts, 1)
+    elif how == 'min':
+        out = np.minimum.reduceat(sub_ext, bounds)[:-1]
+    elif how == 'max':
+        out = np.maximum.reduceat(sub_ext, bounds)[:-1]
+    else:
+        raise ValueError(f"Unknown aggregation: {how}")
+    return np.where(counts > 0, out, empty_value)
+
+
+def align_intervals_to_grid(edges, starts, ends):
+    """Fraction of each grid bucket covered by a set of [start, end) intervals."""
+    n_buckets = len(edges) - 1
+    if len(starts) == 0:
+        return np.zeros(n_buckets)
+    starts = np.asarray(starts, dtype=np.int64)[:, None]
+    durations = np.maximum(np.asarray(ends, dtype=np.int64)[:, None] - starts, 0)
+    # Covered time up to each edge, summed over intervals, then differenced
+    covered = np.clip(edges[None, :] - starts, 0, durations).sum(axis=0).astype(float)
+    return np.clip(np.diff(covered) / np.diff(edges), 0, 1)
+
+
+def align_timeline(hr_df, steps_df, cals_df, sleep_df, exercise_df,
+                   start=None, end=None, max_points=24000):
+    """
+    Resample every metric onto one shared time grid for the combined timeline.
+
+    The bucket width is chosen so that buckets x traces stays within
+    max_points. Returns a DataFrame with one row per bucket, or an empty
+    frame when there is nothing to plot. The bucket width is stored in
+    df.attrs['bucket_width'].
+    """
+    series_bounds = [df['timestamp'].iloc[[0, -1]] for df in (hr_df, steps_df, cals_df)
+                     if not df.empty and 'timestamp' in df.columns]
+    if not series_bounds:
+        return pd.DataFrame()
+    start = pd.Timestamp(start) if start is not None else min(b.iloc[0] for b in series_bounds)
+    end = pd.Timestamp(end) if end is not None else max(b.iloc[1] for b in series_bounds)
+    if end <= start:
+        return pd.DataFrame()
+
+    # HR mean/min/max, steps, calories, sleep and exercise coverage
+    n_traces = 7
+    edges, width = build_time_grid(start, end, max(max_points // n_traces, 1))
+    aligned = pd.DataFrame({'time': pd.to_datetime(edges[:-1])})
+
+    if not hr_df.empty:
+        hr_ts = _timestamps_ns(hr_df['timestamp'])
+        hr_values = hr_df['bpm'].to_numpy()
+        for how in ('mean', 'min', 'max'):
+            aligned[f'hr_{how}'] = align_series_to_grid(edges, hr_ts, hr_values, how)
+    for df, column in ((steps_df, 'steps'), (cals_df, 'calories')):
+        if not df.empty and column in df.columns:
+            aligned[column] = align_series_to_grid(
+                edges, _timestamps_ns(df['timestamp']), df[column].to_numpy(), 'sum')
+
+    if not sleep_df.empty and {'start_time', 'end_time'} <= set(sleep_df.columns):
+        nights = sleep_df[['start_time', 'end_time']].apply(pd.to_datetime, errors='coerce').dropna()
+        aligned['asleep'] = align_intervals_to_grid(
+            edges, _timestamps_ns(nights['start_time']), _timestamps_ns(nights['end_time']))
+    if not exercise_df.empty and 'start_time' in exercise_df.columns:
+        sessions = exercise_df[['start_time', 'end_time']].dropna()
+        aligned['exercise'] = align_intervals_to_grid(
+            edges, _timestamps_ns(sessions['start_time']), _timestamps_ns(sessions['end_time']))
+
+    aligned.attrs['bucket_width'] = width
+    return aligned
+
+
+# ==============================================================================
+# MULTI-PERIOD AGGREGATES
+# ==============================================================================
+
+# One column per metric in the daily table: label, unit, decimals
+DAILY_METRICS = {
+    'resting_hr': ("Resting HR", "bpm", 0),
+    'hrv_rmssd': ("HRV RMSSD", "ms", 0),
+    'sleep_hours': ("Sleep", "h", 1),
+    'sleep_efficiency': ("Sleep efficiency", "%", 0),
+    'sleep_score': ("Sleep score", "/100", 0),
+    'spo2': ("SpO2", "%", 1),
+    'stress_score': ("Stress/recovery score", "/100", 0),
+    'azm_minutes': ("Active zone minutes", "min", 0),
+    'wrist_temp': ("Wrist temp", "°C", 2),
+    'steps': ("Steps", "", 0),
+    'calories': ("Calories", "kcal", 0),
+}
+
+# Metrics whose daily value is a total rather than a mean of readings
+DAILY_TOTAL_METRICS = ('azm_minutes', 'steps', 'calories')
+
+# Look-back windows (days) of the summary's trends and the coach's selector
+SUMMARY_WINDOWS = (7, 30, 90)
+
+
+def _as_datetime(values):
+    """values as datetime64, converting only when they are not already."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, errors='coerce')
+
+
+def _per_day(dates, values, how='mean'):
+    """Reduce a dated series to one value per calendar day (local wall time)."""
+    dates = _as_datetime(dates)
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    series = pd.Series(np.asarray(values, dtype=float), index=dates.dt.normalize().to_numpy())
+    series = series[series.index.notna() & series.notna().to_numpy()]
+    return series.groupby(level=0).agg(how)
+
+
+def _daily_metric_sources(hr_summary_df, hrv_df, sleep_df, sleep_score_df, spo2_df,
+                          stress_df, azm_df=None, temp_df=None):
+    """(metric, dates, values) for every DAILY_METRICS entry the day-level frames have."""
+    if 'resting_hr' in hr_summary_df.columns and 'date' in hr_summary_df.columns:
+        yield 'resting_hr', hr_summary_df['date'], hr_summary_df['resting_hr']
+    if 'rmssd' in hrv_df.columns and 'timestamp' in hrv_df.columns:
+        yield 'hrv_rmssd', hrv_df['timestamp'], hrv_df['rmssd']
+    if 'date' in sleep_df.columns:
+        nights = sleep_df
+        if 'main_sleep' in nights.columns:
+            nights = nights[nights['main_sleep'] == True]
+        if 'duration_minutes' in nights.columns:
+            yield 'sleep_hours', nights['date'], nights['duration_minutes'] / 60
+        if 'efficiency' in nights.columns:
+            yield 'sleep_efficiency', nights['date'], nights['efficiency']
+    if 'overall_score' in sleep_score_df.columns:
+        date_col = 'timestamp' if 'timestamp' in sleep_score_df.columns else 'date'
+        if date_col in sleep_score_df.columns:
+            yield 'sleep_score', sleep_score_df[date_col], sleep_score_df['overall_score']
+    if 'average_value' in spo2_df.columns:
+        date_col = 'timestamp' if 'timestamp' in spo2_df.columns else 'date'
+        if date_col in spo2_df.columns:
+            yield 'spo2', spo2_df[date_col], spo2_df['average_value']
+    if 'STRESS_SCORE' in stress_df.columns:
+        date_col = next((c for c in ['DATE', 'date', 'Date', 'UPDATED_AT', 'updated_at']
+                         if c in stress_df.columns), None)
+        if date_col:
+            valid = stress_df[stress_df['STRESS_SCORE'] > 0]
+            yield 'stress_score', valid[date_col], valid['STRESS_SCORE']
+    if azm_df is not None and not azm_df.empty:
+        zones = azm_df[azm_df['zone'].isin(['FAT_BURN', 'CARDIO', 'PEAK'])]
+        yield 'azm_minutes', zones['date'], zones['minutes']
+    if temp_df is not None and not temp_df.empty and 'temp_c' in temp_df.columns:
+        yield 'wrist_temp', temp_df['date'], temp_df['temp_c']
+
+
+def build_daily_metrics(hr_summary_df, hrv_df, sleep_df, sleep_score_df, spo2_df,
+                        stress_df, azm_df=None, temp_df=None, rollups=None):
+    """
+    One row per calendar day, one column per DAILY_METRICS entry (NaN where a
+    source has no data). rollups is build_daily_rollups' output, used for
+    the step and calorie totals.
+    """
+    series = {
+        name: _per_day(dates, values, how='sum' if name in DAILY_TOTAL_METRICS else 'mean')
+        for name, dates, values in _daily_metric_sources(
+            hr_summary_df, hrv_df, sleep_df, sleep_score_df, spo2_df, stress_df, azm_df, temp_df)
+    }
+    for name in ('steps', 'calories'):
+        totals = (rollups or {}).get(name)
+        if totals is not None and not totals.empty:
+            series[name] = _per_day(totals['date'], totals[name], how='sum')
+
+    daily = pd.DataFrame(series, columns=list(DAILY_METRICS), dtype=float).sort_index()
+    daily.index.name = 'date'
+    return daily
+
+
+def window_aggregates(daily, windows=SUMMARY_WINDOWS, end=None):
+    """
+    Days with data, mean, std, min and max of every daily metric over
+    several look-back windows ending at end (default today), in one pass.
+
+    Window sums come from cumulative count / sum / sum-of-squares columns
+    over the date-sorted table, so each window costs two lookups per
+    metric. The windows are nested, so min/max are reduced once per ring
+    between consecutive window starts and combined outwards. Returns
+    {window: DataFrame indexed by metric}.
+    """
+    end = pd.Timestamp(end if end is not None else datetime.now()).normalize()
+    dates = daily.index.to_numpy(dtype='datetime64[ns]')
+    values = daily.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    zeros = np.zeros((1, values.shape[1]))
+    csum = np.vstack([zeros, np.cumsum(filled, axis=0)])
+    csq = np.vstack([zeros, np.cumsum(filled ** 2, axis=0)])
+    ccount = np.vstack([zeros, np.cumsum(present, axis=0)])
+
+    # Longest window first, so starts are ascending
+    windows = sorted(set(windows), reverse=True)
+    starts = [np.searchsorted(dates, (end - pd.Timedelta(days=w - 1)).to_datetime64())
+              for w in windows]
+    stop = np.searchsorted(dates, (end + pd.Timedelta(days=1)).to_datetime64())
+
+    out = {}
+    lo_min = np.full(values.shape[1], np.nan)
+    hi_max = np.full(values.shape[1], np.nan)
+    for i in reversed(range(len(windows))):
+        start = starts[i]
+        ring_end = starts[i + 1] if i + 1 < len(windows) else stop
+        if ring_end > start:
+            lo_min = np.fmin(lo_min, np.fmin.reduce(values[start:ring_end], axis=0))
+            hi_max = np.fmax(hi_max, np.fmax.reduce(values[start:ring_end], axis=0))
+        count = ccount[stop] - ccount[start]
+        total = csum[stop] - csum[start]
+        squares = csq[stop] - csq[start]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            var = (squares - count * mean ** 2) / (count - 1)
+        std = np.where(count > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+        out[windows[i]] = pd.DataFrame(
+            {'days': count.astype(int), 'mean': mean, 'std': std, 'min': lo_min, 'max': hi_max},
+            index=daily.columns)
+    return dict(sorted(out.items()))
+
+
+def _trend_lines(daily_metrics, windows, now):
+    """Summary lines with each metric's daily mean over every window."""
+    aggs = window_aggregates(daily_metrics, windows, end=now)
+    windows = sorted(aggs)
+    lines = []
+    for metric, (label, unit, decimals) in DAILY_METRICS.items():
+        means = [aggs[w].at[metric, 'mean'] for w in windows]
+        if np.isnan(means).all():
+            continue
+        values = " / ".join("-" if np.isnan(m) else f"{m:,.{decimals}f}" for m in means)
+        lines.append(f"{label}{f' ({unit})' if unit else ''}: {values}")
+    if not lines:
+        return []
+    header = " / ".join(f"{w}d" for w in windows)
+    return [f"\n=== TRENDS: DAILY MEAN OVER LAST {header} ==="] + lines
+
+
+# ==============================================================================
+# DAILY AGGREGATE STORE
+# ==============================================================================
+
+# Heart-rate readings are stored as 'bpm' plus per-zone reading counts
+HR_ZONE_METRICS = {'hr_fat_burn': (0.50, 0.70), 'hr_cardio': (0.70, 0.85), 'hr_peak': (0.85, None)}
+
+
+class DailyAggregates:
+    """
+    Running statistics per calendar day and metric: count, sum, sum of
+    squares, min and max. Folding in a reading or a pre-aggregated batch is
+    O(1) per metric and day, and anything the summary needs from the
+    continuous series (daily totals, means, spread, zone shares) can be
+    read back without the raw readings. Persisted as a CSV file.
+    """
+
+    FIELDS = ('count', 'sum', 'sumsq', 'min', 'max')
+
+    def __init__(self, path=None):
+        self.path = path
+        self._days = {}
+
+    def __len__(self):
+        return len(self._days)
+
+    def days(self):
+        return sorted(self._days)
+
+    def last_day(self):
+        return max(self._days) if self._days else None
+
+    def merge(self, day, metric, count, total, squares, low, high):
+        """Fold a batch of readings of one metric on one day, already reduced."""
+        metrics = self._days.setdefault(pd.Timestamp(day).normalize(), {})
+        stats = metrics.get(metric)
+        if stats is None:
+            metrics[metric] = [count, total, squares, low, high]
+        else:
+            stats[0] += count
+            stats[1] += total
+            stats[2] += squares
+            stats[3] = min(stats[3], low)
+            stats[4] = max(stats[4], high)
+
+    def add(self, day, metric, value):
+        """Fold a single reading."""
+        self.merge(day, metric, 1, value, value * value, value, value)
+
+    def add_series(self, dates, values, metric):
+        """Fold a dated series: reduced per day with reduceat, then one merge per day."""
+        dates = _as_datetime(pd.Series(dates).reset_index(drop=True))
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)
+        values = np.asarray(values, dtype=float)
+        keep = dates.notna().to_numpy() & ~np.isnan(values)
+        if not keep.any():
+            return
+        keys = dates.to_numpy()[keep].astype('datetime64[D]')
+        values = values[keep]
+        if not np.all(keys[1:] >= keys[:-1]):
+            order = np.argsort(keys, kind='stable')
+            keys, values = keys[order], values[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        reduced = zip(pd.to_datetime(keys[starts]), np.diff(np.r_[starts, len(keys)]).tolist(),
+                      np.add.reduceat(values, starts).tolist(),
+                      np.add.reduceat(values * values, starts).tolist(),
+                      np.minimum.reduceat(values, starts).tolist(),
+                      np.maximum.reduceat(values, starts).tolist())
+        for day, *stats in reduced:
+            self.merge(day, metric, *stats)
+
+    def drop_from(self, day):
+        """Forget every day from day on (e.g. a partial last day about to be re-read)."""
+        day = pd.Timestamp(day).normalize()
+        for d in [d for d in self._days if d >= day]:
+            del self._days[d]
+
+    def table(self, metric, stat='mean'):
+        """One stat (a FIELDS entry, 'mean' or 'std') of metric, indexed by day."""
+        rows = {d: m[metric] for d, m in self._days.items() if metric in m}
+        if not rows:
+            return pd.Series(dtype=float, name=metric)
+        df = pd.DataFrame.from_dict(rows, orient='index', columns=list(self.FIELDS)).sort_index()
+        if stat == 'mean':
+            out = df['sum'] / df['count']
+        elif stat == 'std':
+            mean = df['sum'] / df['count']
+            out = np.sqrt(((df['sumsq'] - df['count'] * mean ** 2) / (df['count'] - 1)).clip(lower=0))
+        else:
+            out = df[stat]
+        return out.rename(metric).rename_axis('date')
+
+    def daily_metrics(self):
+        """The build_daily_metrics table, from the stored statistics."""
+        series = {name: self.table(name, 'sum' if name in DAILY_TOTAL_METRICS else 'mean')
+                  for name in DAILY_METRICS}
+        daily = pd.DataFrame({k: v for k, v in series.items() if not v.empty},
+                             columns=list(DAILY_METRICS), dtype=float).sort_index()
+        daily.index.name = 'date'
+        return daily
+
+    def save(self, path=None):
+        """Write the store as CSV (atomically: temp file, then rename)."""
+        path = path or self.path
+        rows = [(d.strftime('%Y-%m-%d'), metric, *stats)
+                for d, metrics in sorted(self._days.items()) for metric, stats in metrics.items()]
+        df = pd.DataFrame(rows, columns=['date', 'metric', *self.FIELDS])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The store saved at path, or an empty one if there is none yet."""
+        store = cls(path)
+        if os.path.exists(path):
+            df = pd.read_csv(path, parse_dates=['date'])
+            for r in df.itertuples(index=False):
+                store.merge(r.date, r.metric, r.count, r.sum, r.sumsq, r.min, r.max)
+        return store
+
+
+def update_daily_aggregates(store, data, rollups=None):
+    """
+    Fold the days of a parse_takeout dataset that store does not have yet
+    into it. The last stored day is re-read, since it may have been partial.
+    Only rows from that day on are read from each table, so adding a day
+    costs O(new readings) plus O(1) per metric to merge. Returns store.
+    """
+    since = store.last_day()
+    if since is not None:
+        store.drop_from(since)
+
+    def recent(dates, *columns):
+        dates = _as_datetime(dates)
+        if since is None:
+            return (dates, *columns)
+        if dates.dt.tz is not None:
+            mask = dates.dt.tz_localize(None) >= since
+        elif dates.is_monotonic_increasing:
+            mask = slice(dates.searchsorted(since), None)
+            return (dates.iloc[mask], *(c.iloc[mask] for c in columns))
+        else:
+            mask = dates >= since
+        return (dates[mask], *(c[mask] for c in columns))
+
+    for name, dates, values in _daily_metric_sources(
+            data['hr_summary_df'], data['hrv_df'], data['sleep_df'], data['sleep_score_df'],
+            data['spo2_df'], data['stress_df'], data.get('azm_df'), data.get('temp_df')):
+        store.add_series(*recent(dates, values), name)
+
+    for name, df in (('steps', data['detailed_steps_df']), ('calories', data['detailed_cals_df'])):
+        totals = (rollups or {}).get(name)
+        if totals is not None and not totals.empty:
+            store.add_series(*recent(totals['date'], totals[name]), name)
+        elif not df.empty and name in df.columns:
+            store.add_series(*recent(df['timestamp'], df[name]), name)
+
+    hr_df = data['detailed_hr_df']
+    if not hr_df.empty and 'bpm' in hr_df.columns:
+        ts, bpm = recent(hr_df['timestamp'], hr_df['bpm'])
+        store.add_series(ts, bpm, 'bpm')
+        max_hr = estimate_max_hr(data.get('profile'))
+        for name, (low, high) in HR_ZONE_METRICS.items():
+            in_zone = bpm >= max_hr * low
+            if high is not None:
+                in_zone &= bpm < max_hr * high
+            store.add_series(ts, in_zone.astype(float), name)
+    return store
+
+
+# ==============================================================================
+# HEALTH SUMMARY FOR GEMINI
+# ==============================================================================
+
+# Default prompt budget for the summary. Per-day tables are compressed, in
+# this order, until the summary fits: day-to-day deltas, weekly means; past
+# that each table gets an equal share of the budget and the lightest encoding
+# that fits it, down to change points only.
+SUMMARY_TOKEN_BUDGET = 3000
+SUMMARY_ENCODINGS = ("daily", "delta", "weekly", "changes")
+
+
+def estimate_tokens(text):
+    """
+    Rough token count for a Gemini prompt: one token per digit or symbol,
+    about four letters per token for words. Good enough to size a budget.
+    """
+    words = re.findall(r'[A-Za-z]+', text)
+    return sum((len(w) + 3) // 4 for w in words) + len(re.findall(r'[^\sA-Za-z]', text))
+
+
+def _fmt_values(spec, values):
+    """%-format a numeric column in one vectorised call."""
+    return np.char.mod(spec, np.asarray(values, dtype=float)).astype(object)
+
+
+def _fmt_optional(spec, values, index):
+    """Like _fmt_values, but '' where values is None (column absent) or NaN."""
+    out = pd.Series('', index=index, dtype=object)
+    if values is not None:
+        present = values.notna().to_numpy()
+        out[present] = _fmt_values(spec, values[present])
+    return out
+
+
+class _DailyTable:
+    """
+    One per-day table of the summary, kept as data until the encoding is
+    chosen. values is the table's primary metric, printed with spec in the
+    daily encoding; entries, when given, are richer per-day strings used
+    there instead.
+    """
+
+    def __init__(self, title, unit, dates, values, decimals=0, spec=None, entries=None,
+                 header=None):
+        keep = pd.notna(values)
+        self.title = title
+        self.unit = unit
+        self.dates = pd.DatetimeIndex(dates)[keep].normalize()
+        self.values = np.asarray(values, dtype=float)[keep]
+        self.decimals = decimals
+        self.spec = spec or f"%.{decimals}f"
+        self.entries = entries
+        self.header = header if header is not None else f"  {title} (mm-dd:{unit}): "
+
+    def _fmt(self, value, sign=''):
+        return f"{value:{sign}.{self.decimals}f}"
+
+    def render(self, encoding="daily", max_tokens=None):
+        if encoding == "daily":
+            entries = self.entries
+            if entries is None:
+                entries = self.dates.strftime('%m-%d') + ':' + _fmt_values(self.spec, self.values)
+            return self.header + ", ".join(entries)
+
+        if encoding == "delta":
+            # A new segment, with an explicit date, after every gap in the days
+            values = np.round(self.values, self.decimals)
+            parts = []
+            for i, (d, v) in enumerate(zip(self.dates, values)):
+                if i and (d - self.dates[i - 1]).days == 1:
+                    parts.append(self._fmt(v - values[i - 1], '+'))
+                else:
+                    parts.append(("| " if i else "") + f"{d:%m-%d}:{self._fmt(v)}")
+            return (f"  {self.title}, delta-encoded (mm-dd:{self.unit}, then change vs "
+                    f"previous day): " + ",".join(parts).replace(",| ", " | "))
+
+        weekly = (pd.Series(self.values, index=self.dates)
+                  .groupby(self.dates.to_period('W').start_time)
+                  .agg(['mean', 'min', 'max']))
+        if encoding == "weekly":
+            spec = f"%.{self.decimals}f"
+            entries = (weekly.index.strftime('%m-%d') + ':' + _fmt_values(spec, weekly['mean'])
+                       + '[' + _fmt_values(spec, weekly['min']) + '-'
+                       + _fmt_values(spec, weekly['max']) + ']')
+            return (f"  {self.title}, weekly (week of mm-dd:mean {self.unit} [min-max]): "
+                    + ", ".join(entries))
+
+        # Change points of the weekly means (day-to-day noise would dominate
+        # otherwise): a week is kept when its mean moved more than the
+        # tolerance from the last kept week; the tolerance grows until the
+        # line fits
+        means = weekly['mean'].to_numpy()
+        tolerance = 10.0 ** -self.decimals
+        while True:
+            kept = self._change_points(means, tolerance)
+            line = (f"  {self.title}, weekly means at change points only (week of mm-dd:"
+                    f"{self.unit}; weeks in between stay within ±{self._fmt(tolerance)}): "
+                    + ", ".join(f"{weekly.index[i]:%m-%d}:{self._fmt(means[i])}" for i in kept))
+            if max_tokens is None or len(kept) <= 2 or estimate_tokens(line) <= max_tokens:
+                return line
+            tolerance *= 1.5
+
+    @staticmethod
+    def _change_points(values, tolerance):
+        if len(values) == 0:
+            return []
+        kept = [0]
+        for i in range(1, len(values)):
+            if abs(values[i] - values[kept[-1]]) > tolerance:
+                kept.append(i)
+        if kept[-1] != len(values) - 1:
+            kept.append(len(values) - 1)
+        return kept
+
+
+def _daily_sum_table(df, column, aggregates=None):
+    """(date, column) daily totals, from aggregates when given, else from df."""
+    if aggregates is not None:
+        return aggregates.table(column, 'sum').rename_axis('date').reset_index()
+    return _daily_totals(df, column)
+
+
+def _render_summary(lines, token_budget):
+    """Join summary lines, choosing the lightest table encoding that fits."""
+    tables = [x for x in lines if isinstance(x, _DailyTable)]
+
+    def render(encoding, max_tokens=None):
+        return "\n".join(x.render(encoding, max_tokens) if isinstance(x, _DailyTable) else x
+                         for x in lines)
+
+    for encoding in SUMMARY_ENCODINGS[:-1]:
+        text = render(encoding)
+        if token_budget is None or not tables or estimate_tokens(text) <= token_budget:
+            return text
+
+    # Whatever is left after the fixed text, shared equally between tables
+    fixed = estimate_tokens("\n".join(x for x in lines if not isinstance(x, _DailyTable)))
+    share = max(0, token_budget - fixed) // len(tables)
+
+    def fit(table):
+        for encoding in SUMMARY_ENCODINGS[1:-1]:
+            line = table.render(encoding)
+            if estimate_tokens(line) <= share:
+                return line
+        return table.render("changes", share)
+
+    return "\n".join(fit(x) if isinstance(x, _DailyTable) else x for x in lines)
+
+
+# Section header prefix -> topic tags, the first being the section's own
+# topic; used to pick the sections relevant to a goal or question
+SUMMARY_SECTION_TAGS = {
+    'USER PROFILE': ('profile',),
+    'ANALYSIS PERIOD': ('period',),
+    'TRENDS': ('trends', 'cardio', 'sleep', 'activity'),
+    'CARDIOVASCULAR HEALTH': ('cardio',),
+    'HEART RATE ZONE': ('zones', 'cardio', 'exercise'),
+    'SLEEP QUALITY': ('sleep',),
+    'DAILY ACTIVITY': ('activity',),
+    'OXYGEN SATURATION': ('oxygen', 'cardio', 'sleep'),
+    'STRESS & RECOVERY': ('stress', 'sleep'),
+    'WRIST SKIN TEMPERATURE': ('temperature',),
+    'EXERCISE HISTORY': ('exercise',),
+}
+
+
+def split_summary(summary):
+    """
+    The sections of a create_health_summary text, in order, as dicts with
+    title, tags (from SUMMARY_SECTION_TAGS; empty for an unknown header) and
+    text (header line included). Joined with blank lines, the texts give
+    the summary back.
+    """
+    sections = []
+    for block in re.split(r'\n+(?==== )', summary.strip('\n')):
+        title = block.split('\n', 1)[0].strip('= ')
+        tags = next((tags for prefix, tags in SUMMARY_SECTION_TAGS.items()
+                     if title.startswith(prefix)), ())
+        sections.append({'title': title, 'tags': tags, 'text': block})
+    return sections
+
+
+def create_health_summary(profile, hr_summary_df, sleep_df, sleep_score_df,
+                          hrv_df, spo2_df, stress_df,
+                          detailed_steps_df, detailed_cals_df,
+                          exercise_df, detailed_hr_df=None,
+                          azm_df=None, temp_df=None, data_period=30,
+                          token_budget=SUMMARY_TOKEN_BUDGET, daily_metrics=None,
+                          trend_windows=SUMMARY_WINDOWS, aggregates=None):
+    """
+    Build a concise, structured text summary of the user's Fitbit health data
+    to include in the Gemini prompt. Raw data is never sent -- only aggregates.
+    Per-day tables are compressed when the summary would exceed token_budget
+    (estimate_tokens); None keeps every table at one entry per day.
+    A trends section gives daily means over each of trend_windows, from
+    daily_metrics (build_daily_metrics; built here when not given).
+    With aggregates (DailyAggregates), the step, calorie, HR-zone and trend
+    figures come from the stored daily statistics and the continuous
+    detailed_* series are not read.
+    """
+    lines = []
+    now = datetime.now()
+    cutoff = pd.Timestamp(now - timedelta(days=data_period))
+
+    # -- Profile ---------------------------------------------------------------
+    lines.append("=== USER PROFILE ===")
+    if profile:
+        if 'date_of_birth' in profile:
+            try:
+                dob = datetime.strptime(str(profile['date_of_birth']), '%Y-%m-%d')
+                age = int((now - dob).days / 365.25)
+                lines.append(f"Age: {age} years")
+            except Exception:
+                pass
+        gender = profile.get('gender', profile.get('sex', ''))
+        if gender:
+            lines.append(f"Gender: {gender}")
+        height = profile.get('height', 0)
+        weight = profile.get('weight', 0)
+        try:
+            h = float(str(height).replace(',', '.'))
+            w = float(str(weight).replace(',', '.'))
+            if h > 0 and w > 0:
+                bmi = round(w / (h / 100) ** 2, 1)
+                lines.append(f"Height: {h:.0f} cm | Weight: {w:.0f} kg | BMI: {bmi}")
+        except Exception:
+            pass
+    else:
+        lines.append("Profile: not available")
+
+    lines.append(f"\n=== ANALYSIS PERIOD: last {data_period} days ===")
+    lines.append(f"From {cutoff.strftime('%Y-%m-%d')} to {now.strftime('%Y-%m-%d')}")
+
+    # -- Short- vs long-term trends -------------------------------------------
+    if trend_windows:
+        try:
+            if daily_metrics is None and aggregates is not None:
+                daily_metrics = aggregates.daily_metrics()
+            elif daily_metrics is None:
+                rollups = {'steps': _daily_totals(detailed_steps_df, 'steps'),
+                           'calories': _daily_totals(detailed_cals_df, 'calories')}
+                daily_metrics = build_daily_metrics(
+                    hr_summary_df, hrv_df, sleep_df, sleep_score_df, spo2_df, stress_df,
+                    azm_df, temp_df, rollups)
+            lines.extend(_trend_lines(daily_metrics, trend_windows, now))
+        except Exception:
+            pass
+
+    # -- Cardiovascular --------------------------------------------------------
+    lines.append("\n=== CARDIOVASCULAR HEALTH ===")
+    if not hr_summary_df.empty and 'resting_hr' in hr_summary_df.columns:
+        try:
+            rhr = hr_summary_df
+            if 'date' in rhr.columns:
+                rhr = rhr.assign(date=_as_datetime(rhr['date']))
+                rhr = rhr[rhr['date'] >= cutoff].sort_values('date')
+            if not rhr.empty:
+                avg_rhr = rhr['resting_hr'].mean()
+                trend = (rhr['resting_hr'].iloc[-5:].mean() - rhr['resting_hr'].iloc[:5].mean()
+                         if len(rhr) >= 10 else 0)
+                lines.append(f"Resting Heart Rate: avg {avg_rhr:.0f} bpm "
+                              f"(range {rhr['resting_hr'].min():.0f}-{rhr['resting_hr'].max():.0f})")
+                if abs(trend) > 2:
+                    direction = "decreasing (improving)" if trend < 0 else "increasing (worsening)"
+                    lines.append(f"  RHR trend: {direction} by {abs(trend):.1f} bpm over period")
+                # Recent 7-day vs overall
+                recent_7 = rhr[rhr['date'] >= pd.Timestamp(now - timedelta(days=7))]
+                if not recent_7.empty and len(rhr) > 7:
+                    lines.append(f"  RHR last 7 days avg: {recent_7['resting_hr'].mean():.0f} bpm "
+                                 f"(vs {avg_rhr:.0f} bpm overall)")
+                # Per-day compact table
+                rhr_rows = rhr[['date', 'resting_hr']].dropna()
+                if not rhr_rows.empty:
+                    lines.append(_DailyTable("Daily RHR", "bpm", rhr_rows['date'],
+                                             rhr_rows['resting_hr'], spec='%d'))
+        except Exception:
+            pass
+    else:
+        lines.append("Resting Heart Rate: data not available")
+
+    if not hrv_df.empty and 'rmssd' in hrv_df.columns:
+        try:
+            hrv = hrv_df
+            if 'timestamp' in hrv.columns:
+                hrv = hrv.assign(timestamp=_as_datetime(hrv['timestamp']))
+                hrv = hrv[hrv['timestamp'] >= cutoff]
+            if not hrv.empty:
+                avg_hrv = hrv['rmssd'].mean()
+                lines.append(f"HRV (RMSSD): avg {avg_hrv:.1f} ms")
+                if avg_hrv < 20:
+                    lines.append("  -> Low HRV: high stress or poor recovery")
+                elif avg_hrv > 50:
+                    lines.append("  -> Good HRV: healthy autonomic function")
+                # HRV trend
+                hrv_sorted = hrv.sort_values('timestamp')
+                if len(hrv_sorted) >= 10:
+                    mid = len(hrv_sorted) // 2
+                    first_avg = hrv_sorted.head(mid)['rmssd'].mean()
+                    second_avg = hrv_sorted.tail(mid)['rmssd'].mean()
+                    delta = second_avg - first_avg
+                    direction = "improving" if delta > 2 else "declining" if delta < -2 else "stable"
+                    lines.append(f"  HRV trend: {direction} ({delta:+.1f} ms over {data_period} days)")
+                if len(hrv_sorted) >= 7:
+                    recent_7d_hrv = hrv_sorted.tail(7)['rmssd'].mean()
+                    lines.append(f"  HRV last 7 days: {recent_7d_hrv:.1f} ms")
+                # Per-day compact table
+                hrv_rows = hrv_sorted[['timestamp', 'rmssd']].dropna()
+                if not hrv_rows.empty:
+                    lines.append(_DailyTable("Daily HRV RMSSD", "ms", hrv_rows['timestamp'],
+                                             hrv_rows['rmssd']))
+        except Exception:
+            pass
+
+    # HR zone distribution — prefer AZM (actual minutes), fall back to continuous HR %
+    lines.append(f"\n=== HEART RATE ZONE DISTRIBUTION (last {data_period} days) ===")
+    azm_used = False
+    if azm_df is not None and not azm_df.empty:
+        try:
+            az = azm_df[azm_df['date'] >= cutoff]
+            if not az.empty:
+                # Total minutes per zone over the period
+                zone_totals = az.groupby('zone')['minutes'].sum()
+                total_active = zone_totals.sum()
+                days_in_period = (az['date'].max() - az['date'].min()).days + 1
+                lines.append(f"Active Zone Minutes over {days_in_period} days (Fitbit-logged):")
+                zone_order = ['FAT_BURN', 'CARDIO', 'PEAK']
+                zone_labels = {'FAT_BURN': 'Fat-burn', 'CARDIO': 'Cardio', 'PEAK': 'Peak'}
+                for z in zone_order:
+                    if z in zone_totals.index:
+                        total = int(zone_totals[z])
+                        avg_per_day = total / max(days_in_period, 1)
+                        lines.append(f"  {zone_labels.get(z, z)}: {total} min total, "
+                                     f"{avg_per_day:.0f} min/day avg")
+                # Daily AZM totals for recent period
+                daily_azm = az[az['zone'].isin(zone_order)].groupby('date')['minutes'].sum().reset_index()
+                daily_azm = daily_azm.sort_values('date')
+                if not daily_azm.empty:
+                    lines.append(_DailyTable("Daily active zone minutes", "min",
+                                             daily_azm['date'], daily_azm['minutes']))
+                azm_used = True
+        except Exception:
+            pass
+    has_hr = (aggregates is not None or detailed_hr_df is not None
+              and not detailed_hr_df.empty and 'bpm' in detailed_hr_df.columns)
+    if not azm_used and has_hr:
+        try:
+            age_for_zones = 30
+            if profile and 'date_of_birth' in profile:
+                try:
+                    dob_z = datetime.strptime(str(profile['date_of_birth']), '%Y-%m-%d')
+                    age_for_zones = int((now - dob_z).days / 365.25)
+                except Exception:
+                    pass
+            max_hr_est = 220 - age_for_zones
+            if aggregates is not None:
+                # Stored per-day reading counts (zones use the same 220-minus-age max HR)
+                in_period = lambda t: t[t.index >= cutoff].sum()
+                total_pts = in_period(aggregates.table('bpm', 'count'))
+                fat_burn, cardio_z, peak_z = (in_period(aggregates.table(name, 'sum'))
+                                              for name in HR_ZONE_METRICS)
+            else:
+                hz = detailed_hr_df[_as_datetime(detailed_hr_df['timestamp']) >= cutoff]
+                total_pts = len(hz)
+                fat_burn = ((hz['bpm'] >= max_hr_est * 0.50) & (hz['bpm'] < max_hr_est * 0.70)).sum()
+                cardio_z = ((hz['bpm'] >= max_hr_est * 0.70) & (hz['bpm'] < max_hr_est * 0.85)).sum()
+                peak_z = (hz['bpm'] >= max_hr_est * 0.85).sum()
+            if total_pts:
+                lines.append(f"Estimated max HR: {max_hr_est} bpm (220 minus age {age_for_zones})")
+                lines.append(f"Fat-burn zone (50-69% max HR): {fat_burn/total_pts*100:.0f}% of HR readings")
+                lines.append(f"Cardio zone (70-84% max HR): {cardio_z/total_pts*100:.0f}% of HR readings")
+                lines.append(f"Peak zone (>=85% max HR): {peak_z/total_pts*100:.0f}% of HR readings")
+        except Exception:
+            pass
+
+    # -- Sleep -----------------------------------------------------------------
+    lines.append("\n=== SLEEP QUALITY ===")
+    if not sleep_df.empty:
+        try:
+            sl = sleep_df
+            if 'main_sleep' in sl.columns:
+                sl = sl[sl['main_sleep'] == True]
+            if 'date' in sl.columns:
+                sl = sl.assign(date=_as_datetime(sl['date']))
+                sl = sl[sl['date'] >= cutoff]
+            if not sl.empty:
+                if 'duration_minutes' in sl.columns:
+                    avg_dur = sl['duration_minutes'].mean()
+                    lines.append(f"Average sleep duration: {avg_dur/60:.1f} h ({avg_dur:.0f} min)")
+                if 'efficiency' in sl.columns:
+                    avg_eff = sl['efficiency'].mean()
+                    lines.append(f"Sleep efficiency: {avg_eff:.0f}%")
+                if 'deep_minutes' in sl.columns:
+                    avg_deep = sl['deep_minutes'].mean()
+                    avg_light = sl.get('light_minutes', pd.Series([0])).mean() if 'light_minutes' in sl.columns else 0
+                    avg_rem = sl.get('rem_minutes', pd.Series([0])).mean() if 'rem_minutes' in sl.columns else 0
+                    avg_wake = sl.get('wake_minutes', pd.Series([0])).mean() if 'wake_minutes' in sl.columns else 0
+                    lines.append(f"Sleep stages (avg/night): Deep {avg_deep:.0f} min | "
+                                 f"Light {avg_light:.0f} min | REM {avg_rem:.0f} min | Awake {avg_wake:.0f} min")
+        except Exception:
+            pass
+    else:
+        lines.append("Sleep: data not available")
+
+    if not sleep_score_df.empty and 'overall_score' in sleep_score_df.columns:
+        try:
+            avg_score = sleep_score_df['overall_score'].mean()
+            min_score = sleep_score_df['overall_score'].min()
+            max_score = sleep_score_df['overall_score'].max()
+            lines.append(f"Sleep score: avg {avg_score:.0f}/100 (range {min_score:.0f}-{max_score:.0f})")
+            # Sub-scores if available
+            for col, label in [('composition_score', 'composition'),
+                                ('revitalization_score', 'revitalization'),
+                                ('duration_score', 'duration'),
+                                ('deep_sleep_in_minutes', 'deep sleep min')]:
+                if col in sleep_score_df.columns:
+                    val = sleep_score_df[col].mean()
+                    lines.append(f"  Sleep {label}: avg {val:.0f}")
+        except Exception:
+            pass
+    # Sleep variability + per-night log
+    if not sleep_df.empty:
+        try:
+            sl_var = sleep_df
+            if 'main_sleep' in sl_var.columns:
+                sl_var = sl_var[sl_var['main_sleep'] == True]
+            if 'date' in sl_var.columns:
+                sl_var = sl_var.assign(date=_as_datetime(sl_var['date']))
+                sl_var = sl_var[sl_var['date'] >= cutoff].sort_values('date')
+            if not sl_var.empty and 'duration_minutes' in sl_var.columns and len(sl_var) > 2:
+                sleep_std = sl_var['duration_minutes'].std()
+                sleep_min = sl_var['duration_minutes'].min()
+                sleep_max = sl_var['duration_minutes'].max()
+                lines.append(f"Sleep duration range: {sleep_min/60:.1f}h - {sleep_max/60:.1f}h "
+                             f"(variability ±{sleep_std/60:.1f}h std dev)")
+                if sleep_std > 60:
+                    lines.append("  -> High sleep variability: inconsistent schedule")
+            # Per-night compact log
+            if not sl_var.empty:
+                idx = sl_var.index
+                duration = sl_var.get('duration_minutes')
+                night_parts = (
+                    sl_var['date'].dt.strftime('%m-%d') + ':'
+                    + _fmt_optional('%.1fh', None if duration is None else duration / 60, idx) + '/'
+                    + _fmt_optional('%d%%', sl_var.get('efficiency'), idx) + '/'
+                    + _fmt_optional('D%dm', sl_var.get('deep_minutes'), idx) + '/'
+                    + _fmt_optional('R%dm', sl_var.get('rem_minutes'), idx)
+                ).str.rstrip('/')
+                lines.append(_DailyTable(
+                    "Per-night sleep", "hours", sl_var['date'],
+                    duration / 60 if duration is not None else pd.Series(np.nan, index=idx),
+                    decimals=1, entries=night_parts,
+                    header="Per-night log (date:hours/efficiency/deep/REM):\n  "))
+            # Merge sleep scores into per-night log if available
+            if not sleep_score_df.empty and 'overall_score' in sleep_score_df.columns:
+                try:
+                    date_col = 'timestamp' if 'timestamp' in sleep_score_df.columns else 'date'
+                    nights = _as_datetime(sleep_score_df[date_col])
+                    if nights.dt.tz is not None:
+                        nights = nights.dt.tz_localize(None)
+                    sc = sleep_score_df.assign(date=nights.dt.normalize()).dropna(subset=['date'])
+                    sc = sc[sc['date'] >= cutoff].sort_values('date')
+                    if not sc.empty:
+                        lines.append(_DailyTable("Nightly sleep scores", "score", sc['date'],
+                                                 sc['overall_score'], spec='%d'))
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+    # -- Daily Activity --------------------------------------------------------
+    lines.append("\n=== DAILY ACTIVITY ===")
+    daily = _daily_sum_table(detailed_steps_df, 'steps', aggregates)
+    if not daily.empty:
+        try:
+            recent = daily[daily['date'] >= cutoff]
+            if not recent.empty:
+                avg_steps = recent['steps'].mean()
+                max_steps = recent['steps'].max()
+                min_steps = recent['steps'].min()
+                lines.append(f"Average daily steps: {avg_steps:,.0f} (peak {max_steps:,.0f}, low {min_steps:,.0f})")
+                days_over_10k = (recent['steps'] >= 10000).sum()
+                days_under_5k = (recent['steps'] < 5000).sum()
+                lines.append(f"Days >=10,000 steps: {days_over_10k} | Days <5,000 steps: {days_under_5k}")
+                if avg_steps < 5000:
+                    lines.append("  -> Below recommended level (<5,000 steps/day)")
+                elif avg_steps >= 10000:
+                    lines.append("  -> Excellent activity level (>=10,000 steps/day)")
+                # Weekly breakdown (last 4 weeks)
+                lines.append("Weekly step totals (most recent week last):")
+                for w in range(3, -1, -1):
+                    wk_start = pd.Timestamp(now - timedelta(days=(w + 1) * 7))
+                    wk_end = pd.Timestamp(now - timedelta(days=w * 7))
+                    wk_data = daily[(daily['date'] >= wk_start) & (daily['date'] < wk_end)]
+                    if not wk_data.empty:
+                        label = "most recent" if w == 0 else f"{w}w ago"
+                        lines.append(f"  {label}: avg {wk_data['steps'].mean():,.0f}/day, "
+                                     f"total {wk_data['steps'].sum():,.0f}")
+        except Exception:
+            pass
+    else:
+        lines.append("Steps: data not available")
+
+    daily_cal = _daily_sum_table(detailed_cals_df, 'calories', aggregates)
+    if not daily_cal.empty:
+        try:
+            recent_cal = daily_cal[daily_cal['date'] >= cutoff]
+            if not recent_cal.empty:
+                avg_cals = recent_cal['calories'].mean()
+                peak_cals = recent_cal['calories'].max()
+                min_cals = recent_cal['calories'].min()
+                lines.append(f"Daily calories burned: avg {avg_cals:,.0f} kcal | peak {peak_cals:,.0f} | low {min_cals:,.0f}")
+        except Exception:
+            pass
+
+    # -- SpO2 ------------------------------------------------------------------
+    if not spo2_df.empty and 'average_value' in spo2_df.columns:
+        lines.append("\n=== OXYGEN SATURATION (SpO2) ===")
+        try:
+            spo2_r = spo2_df
+            if 'timestamp' in spo2_r.columns:
+                spo2_r = spo2_r.assign(date=_as_datetime(spo2_r['timestamp']))
+            elif 'date' in spo2_r.columns:
+                spo2_r = spo2_r.assign(date=_as_datetime(spo2_r['date']))
+            spo2_r = spo2_r[spo2_r['date'] >= cutoff].sort_values('date')
+            avg_spo2 = spo2_r['average_value'].mean() if not spo2_r.empty else spo2_df['average_value'].mean()
+            min_spo2 = (spo2_r['lower_bound'].min()
+                        if 'lower_bound' in spo2_r.columns and not spo2_r.empty
+                        else spo2_r['average_value'].min() if not spo2_r.empty
+                        else spo2_df['average_value'].min())
+            lines.append(f"Average SpO2: {avg_spo2:.1f}% | Period minimum: {min_spo2:.1f}%")
+            if min_spo2 < 90:
+                lines.append("  -> SpO2 dropped below 90% -- notable dip during sleep")
+            # Per-night compact log
+            if not spo2_r.empty:
+                idx = spo2_r.index
+                night_spo2 = (spo2_r['date'].dt.strftime('%m-%d') + ':'
+                              + _fmt_optional('%.1f', spo2_r['average_value'], idx)
+                              + _fmt_optional('(min %.1f)', spo2_r.get('lower_bound'), idx))
+                lines.append(_DailyTable("Nightly SpO2 avg", "%", spo2_r['date'],
+                                         spo2_r['average_value'], decimals=1, entries=night_spo2,
+                                         header="  Nightly SpO2 avg(min) (mm-dd): "))
+        except Exception:
+            pass
+
+    # -- Stress ----------------------------------------------------------------
+    if not stress_df.empty and 'STRESS_SCORE' in stress_df.columns:
+        lines.append("\n=== STRESS & RECOVERY ===")
+        try:
+            st_df = stress_df
+            # Parse date from stress_df
+            date_col = None
+            for c in ['DATE', 'date', 'Date', 'UPDATED_AT', 'updated_at']:
+                if c in st_df.columns:
+                    date_col = c
+                    break
+            if date_col:
+                st_df = st_df.assign(_date=_as_datetime(st_df[date_col]))
+                st_df = st_df[st_df['_date'] >= cutoff].sort_values('_date')
+            valid = st_df[st_df['STRESS_SCORE'] > 0]
+            if not valid.empty:
+                avg_s = valid['STRESS_SCORE'].mean()
+                lines.append(f"Average Stress/Recovery Score: {avg_s:.0f}/100 (higher = better recovery)")
+                if avg_s < 40:
+                    lines.append("  -> Consistently elevated stress / low recovery")
+                elif avg_s > 70:
+                    lines.append("  -> Good stress management and recovery")
+                # Recent 7-day vs overall
+                if date_col and len(valid) > 7:
+                    recent_7_stress = valid[valid['_date'] >= pd.Timestamp(now - timedelta(days=7))]
+                    if not recent_7_stress.empty:
+                        r7 = recent_7_stress['STRESS_SCORE'].mean()
+                        lines.append(f"  Stress score last 7 days: {r7:.0f} (vs {avg_s:.0f} overall)")
+                # Trend: first half vs second half
+                if len(valid) >= 10:
+                    mid = len(valid) // 2
+                    first_half = valid.head(mid)['STRESS_SCORE'].mean()
+                    second_half = valid.tail(mid)['STRESS_SCORE'].mean()
+                    delta = second_half - first_half
+                    direction = "improving" if delta > 3 else "declining" if delta < -3 else "stable"
+                    lines.append(f"  Stress score trend: {direction} ({delta:+.0f} points over period)")
+                # Per-day compact table
+                if date_col:
+                    lines.append(_DailyTable("Daily stress scores", "score", valid['_date'],
+                                             valid['STRESS_SCORE'], spec='%d'))
+        except Exception:
+            pass
+
+    # -- Wrist Temperature -----------------------------------------------------
+    if temp_df is not None and not temp_df.empty and 'temp_c' in temp_df.columns:
+        lines.append("\n=== WRIST SKIN TEMPERATURE (nightly) ===")
+        try:
+            tmp = temp_df[temp_df['date'] >= cutoff].sort_values('date')
+            if not tmp.empty:
+                avg_temp = tmp['temp_c'].mean()
+                lines.append(f"Average nightly wrist temp: {avg_temp:.2f}°C "
+                             f"(range {tmp['temp_c'].min():.2f} - {tmp['temp_c'].max():.2f}°C)")
+                if 'deviation' in tmp.columns:
+                    avg_dev = tmp['deviation'].mean()
+                    max_dev = tmp['deviation'].abs().max()
+                    lines.append(f"Avg nightly deviation from baseline: {avg_dev:.3f} "
+                                 f"(max deviation: {max_dev:.3f})")
+                    if max_dev > 1.0:
+                        lines.append("  -> Large temp deviation detected: possible illness or high training load")
+                # Per-night compact log
+                lines.append(_DailyTable("Nightly wrist temp", "°C", tmp['date'],
+                                         tmp['temp_c'], decimals=2))
+        except Exception:
+            pass
+
+    # -- Exercise History ------------------------------------------------------
+    lines.append("\n=== EXERCISE HISTORY ===")
+    if not exercise_df.empty:
+        try:
+            lines.append(f"Total logged sessions: {len(exercise_df)}")
+            top_activities = exercise_df['activity_name'].value_counts().head(5)
+            lines.append("Most frequent activities: " +
+                         ", ".join([f"{n} ({c}x)" for n, c in top_activities.items()]))
+            # Per-activity-type stats
+            lines.append("Stats by activity type:")
+            for act_name, grp in exercise_df.groupby('activity_name'):
+                avg_d = grp['duration_minutes'].mean()
+                avg_c = grp['calories'].mean()
+                hr_grp = grp[grp['avg_heart_rate'] > 0]['avg_heart_rate']
+                avg_h = hr_grp.mean() if not hr_grp.empty else 0
+                dist_grp = grp[grp['distance_km'] > 0]['distance_km']
+                avg_dist = dist_grp.mean() if not dist_grp.empty else 0
+                stat_parts = [f"{len(grp)}x", f"{avg_d:.0f}min avg", f"{avg_c:.0f}kcal avg"]
+                if avg_h > 0:
+                    stat_parts.append(f"{avg_h:.0f}bpm avg HR")
+                if avg_dist > 0:
+                    stat_parts.append(f"{avg_dist:.1f}km avg dist")
+                lines.append(f"  {act_name}: {', '.join(stat_parts)}")
+            # Weekly frequency
+            ex_dates = _as_datetime(exercise_df['date'])
+            weekly_freq = exercise_df.groupby(ex_dates.dt.to_period('W')).size().mean()
+            lines.append(f"Average sessions per week (all time): {weekly_freq:.1f}")
+            # Last 20 sessions
+            # Weekly exercise frequency (last 4 weeks)
+            lines.append("Exercise frequency (last 4 weeks, most recent last):")
+            for w in range(3, -1, -1):
+                wk_start = pd.Timestamp(now - timedelta(days=(w + 1) * 7))
+                wk_end = pd.Timestamp(now - timedelta(days=w * 7))
+                wk_ex = exercise_df[(ex_dates >= wk_start) & (ex_dates < wk_end)]
+                label = "most recent" if w == 0 else f"{w}w ago"
+                if not wk_ex.empty:
+                    total_min = wk_ex['duration_minutes'].sum()
+                    lines.append(f"  {label}: {len(wk_ex)} sessions, {total_min:.0f} min total")
+                else:
+                    lines.append(f"  {label}: 0 sessions")
+
+            # Average session stats
+            avg_dur = exercise_df['duration_minutes'].mean()
+            avg_cal_ex = exercise_df['calories'].mean()
+            avg_hr_ex = exercise_df[exercise_df['avg_heart_rate'] > 0]['avg_heart_rate'].mean() if (exercise_df['avg_heart_rate'] > 0).any() else 0
+            lines.append(f"Average session: {avg_dur:.0f} min, {avg_cal_ex:.0f} kcal"
+                        + (f", {avg_hr_ex:.0f} bpm avg HR" if avg_hr_ex > 0 else ""))
+
+            lines.append("Recent sessions (most recent first):")
+            recent_ex = exercise_df.head(20)
+            idx = recent_ex.index
+            positive = lambda col: recent_ex[col].where(recent_ex[col] > 0)
+            sessions = (
+                "  - " + recent_ex['date'].dt.strftime('%Y-%m-%d').fillna('N/A') + ": "
+                + recent_ex['activity_name'].astype(str) + " -- "
+                + _fmt_values('%.0f min, ', recent_ex['duration_minutes'])
+                + _fmt_values('%.0f kcal', recent_ex['calories'])
+                + _fmt_optional(', Avg HR %d bpm', positive('avg_heart_rate'), idx)
+                + _fmt_optional(', %.1f km', positive('distance_km'), idx)
+                + positive('steps').map(lambda n: f", {int(n):,} steps", na_action='ignore').fillna('')
+            )
+            lines.extend(sessions)
+        except Exception:
+            pass
+    else:
+        lines.append("No exercise session data found.")
+
+    return _render_summary(lines, token_budget)
+
+
+# ==============================================================================
+# HEALTH ANALYSIS
+# ==============================================================================
+
+def analyze_health(hr_summary, sleep_df, hrv_df, spo2_df, stress_df):
+    """Simplified health analysis without medical recommendations."""
+    alerts = []
+    warnings = []
+    info = []
+
+    # HR analysis
+    if not hr_summary.empty and 'resting_hr' in hr_summary.columns:
+        recent_hr = hr_summary['resting_hr'].dropna()
+        if len(recent_hr) > 0:
+            latest_hr = recent_hr.iloc[-1]
+            avg_hr = recent_hr.mean()
+
+            if latest_hr > 100:
+                alerts.append(f"Elevated resting heart rate: {latest_hr:.1f} bpm (Normal: 60-100)")
+            elif latest_hr < 50:
+                warnings.append(f"Low resting heart rate: {latest_hr:.1f} bpm")
+            else:
+                info.append(f"Resting heart rate: {latest_hr:.1f} bpm (avg {avg_hr:.1f})")
+
+    # SpO2 analysis
+    if not spo2_df.empty and 'average_value' in spo2_df.columns:
+        avg_spo2 = spo2_df['average_value'].mean()
+        min_spo2 = spo2_df['lower_bound'].min() if 'lower_bound' in spo2_df.columns else spo2_df['average_value'].min()
+
+        if min_spo2 < 90:
+            alerts.append(f"Low oxygen saturation detected: {min_spo2:.1f}%")
+        elif avg_spo2 < 94:
+            warnings.append(f"Below-average SpO2: {avg_spo2:.1f}%")
+        else:
+            info.append(f"Oxygen saturation normal: {avg_spo2:.1f}%")
+
+    # Sleep analysis
+    if not sleep_df.empty and 'minutes_asleep' in sleep_df.columns:
+        main_sleep = sleep_df[sleep_df['main_sleep'] == True]
+        if not main_sleep.empty:
+            avg_sleep = main_sleep['minutes_asleep'].mean() / 60
+
+            if avg_sleep < 5:
+                alerts.append(f"Insufficient sleep: {avg_sleep:.1f} h")
+            elif avg_sleep < 6:
+                warnings.append(f"Short sleep duration: {avg_sleep:.1f} h (recommended: 7-9 h)")
+            elif avg_sleep > 10:
+                warnings.append(f"Unusually long sleep: {avg_sleep:.1f} h")
+            else:
+                info.append(f"Sleep duration looks good: {avg_sleep:.1f} h")
+
+    # HRV analysis
+    if not hrv_df.empty and 'rmssd' in hrv_df.columns:
+        avg_hrv = hrv_df['rmssd'].mean()
+        if avg_hrv < 20:
+            warnings.append(f"Low HRV: {avg_hrv:.1f} ms")
+        else:
+            info.append(f"HRV: {avg_hrv:.1f} ms")
+
+    # Stress analysis
+    if not stress_df.empty and 'STRESS_SCORE' in stress_df.columns:
+        stress_data = stress_df[stress_df['STRESS_SCORE'] > 0]['STRESS_SCORE']
+        if len(stress_data) > 0:
+            avg_stress = stress_data.mean()
+            if avg_stress < 30:
+                warnings.append(f"Stress score low ({avg_stress:.0f}/100) -- body may need more recovery time")
+            else:
+                info.append(f"Stress score: {avg_stress:.0f}/100 (higher = better recovery)")
+
+    return alerts, warnings, info
+
+# ==============================================================================
+# TAKEOUT DATASET
+# ==============================================================================
+
+def parse_takeout(base_path):
+    """Parse every data source of one Fitbit export into a dict of tables."""
+    return {
+        'profile':           parse_profile(base_path),
+        'detailed_hr_df':    parse_detailed_heart_rate(base_path),
+        'detailed_steps_df': parse_detailed_steps(base_path),
+        'detailed_cals_df':  parse_detailed_calories(base_path),
+        'hr_summary_df':     parse_heart_rate_summary(base_path),
+        'sleep_df':          parse_sleep_data(base_path),
+        'sleep_score_df':    parse_sleep_score(base_path),
+        'hrv_df':            parse_hrv(base_path),
+        'spo2_df':           parse_spo2(base_path),
+        'stress_df':         parse_stress_score(base_path),
+        'exercise_df':       parse_exercise_data(base_path),
+        'azm_df':            parse_azm(base_path),
+        'temp_df':           parse_temperature(base_path),
+    }
@@ -0,0 +1,505 @@
+"""
+================================================================================
+Fitbit AI Health Coach - Questions about the data
+================================================================================
+Answers numeric questions ("average heart rate during runs last month",
+"how many steps yesterday", "how many nights did I sleep over 8 hours") on
+the spot, without a Gemini round trip. A question is parsed with a small
+keyword grammar into a query -- metric, aggregation, window and filters --
+and run against the daily aggregates and the continuous frames. Questions
+the grammar does not cover (why, should, advice) go to Gemini with the
+health summary. Does not import Streamlit.
+"""
+
+import calendar
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from health_coach import ask_coach, clean_ai_response
+from health_data import (
+    DAILY_METRICS, DAILY_TOTAL_METRICS, DailyAggregates, update_daily_aggregates,
+)
+
+# ==============================================================================
+# QUESTION GRAMMAR
+# ==============================================================================
+
+# Daily metrics come from DAILY_METRICS; these read the continuous HR frame
+# or the exercise log. name -> (label, unit, decimals)
+QUERY_METRICS = {
+    'hr': ("Heart rate", "bpm", 0),
+    **DAILY_METRICS,
+    'sessions': ("Sessions", "", 0),
+    'exercise_minutes': ("Exercise time", "min", 0),
+    'distance': ("Distance", "km", 1),
+}
+
+# Phrases naming each metric; the longest phrase found in a question wins
+METRIC_PHRASES = {
+    'hr': ("heart rate", "hr", "bpm", "pulse"),
+    'resting_hr': ("resting heart rate", "resting hr", "rhr", "resting pulse"),
+    'hrv_rmssd': ("hrv", "heart rate variability", "rmssd"),
+    'sleep_hours': ("sleep", "slept", "hours of sleep", "sleep duration"),
+    'sleep_efficiency': ("sleep efficiency",),
+    'sleep_score': ("sleep score",),
+    'spo2': ("spo2", "oxygen", "blood oxygen", "oxygen saturation"),
+    'stress_score': ("stress", "stress score"),
+    'azm_minutes': ("active zone minutes", "zone minutes", "azm"),
+    'wrist_temp': ("temperature", "skin temperature", "wrist temperature"),
+    'steps': ("steps", "step count"),
+    'calories': ("calories", "kcal", "energy burned"),
+    'exercise_minutes': ("exercise time", "training time", "minutes of exercise"),
+    'distance': ("distance", "km", "kilometres", "kilometers"),
+}
+
+# activity -> (question pattern, activity_name pattern, plural label)
+ACTIVITIES = {
+    'run': (r"runs?|running|ran|jogs?|jogging", r"run|jog", "runs"),
+    'walk': (r"walks?|walking|hikes?|hiking", r"walk|hike", "walks"),
+    'ride': (r"rides?|cycling|bike|biking|bike rides?", r"bike|cycl|ride", "rides"),
+    'swim': (r"swims?|swimming", r"swim", "swims"),
+    'yoga': (r"yoga", r"yoga", "yoga sessions"),
+    'hiit': (r"hiit", r"hiit", "HIIT sessions"),
+    'strength': (r"strength|weights|weight training|lifting|gym", r"weight|strength|gym",
+                 "strength sessions"),
+    'workout': (r"workouts?|exercises?|exercising|sessions?|training|activities", r".",
+                "workouts"),
+}
+
+# Checked in order; the first that matches sets the aggregation, except
+# that an explicit count ("how many days ... longest") beats max / min
+AGGREGATIONS = (
+    ('median', r"median"),
+    ('max', r"max|maximum|highest|peak|most|best|longest|biggest|furthest|farthest"),
+    ('min', r"min|minimum|lowest|least|worst|shortest|fewest"),
+    ('mean', r"average|avg|mean|typical|typically|usually|per day|daily|on average"),
+    ('sum', r"total|sum|altogether|in all"),
+    ('count', r"how many|how often|number of|(?:days|nights)\s+(?:with|when|where)"),
+)
+
+AGGREGATION_LABELS = {'mean': "Average", 'median': "Median", 'max': "Highest",
+                      'min': "Lowest", 'sum': "Total"}
+
+# Why/should/advice questions need the coach, whatever metric they mention
+OPEN_ENDED = re.compile(
+    r"\b(why|should|could|would|explain|advice|advise|recommend|improve|better|worse|"
+    r"normal|healthy|good|bad|compare|correlat\w*|trend\w*|plan|how (?:can|do|to))\b")
+
+# "over 2 weeks" is a window, not a threshold
+THRESHOLD = re.compile(
+    r"\b(over|above|more than|greater than|at least|under|below|less than|fewer than|at most)"
+    r"\s+(\d[\d,]*(?:\.\d+)?)(?!\d|\.\d)\s*(k\b)?(?!\s*(?:day|week|month|year)s?\b)")
+
+# "How many" of these is an amount, not a number of days or sessions
+QUANTITY_METRICS = ('sleep_hours', 'exercise_minutes', 'distance')
+QUANTITY_UNITS = r"hours?|hrs?|minutes?|mins?|km|kilomet(?:re|er)s?|miles?|steps?|calories|kcal"
+
+UNIT_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+
+
+def _find(pattern, text):
+    return re.search(rf"\b(?:{pattern})\b", text)
+
+
+def _metric(text):
+    """The metric whose phrase in text is the longest, or None."""
+    found = [(len(phrase), name) for name, phrases in METRIC_PHRASES.items()
+             for phrase in phrases if _find(re.escape(phrase), text)]
+    return max(found)[1] if found else None
+
+
+def _window(text, today):
+    """(first day, last day, label) named in text; None for all data."""
+    day = pd.Timedelta(days=1)
+    if _find("today", text):
+        return today, today, "today"
+    if _find("last night|tonight", text):
+        # Sleep is dated by the morning it ends
+        return today, today, "last night"
+    if _find("yesterday", text):
+        return today - day, today - day, "yesterday"
+
+    m = _find(r"(?:last|past|previous|over)\s+(?:(\d+)\s+)?(day|week|month|year)s?", text)
+    if m:
+        days = int(m.group(1) or 1) * UNIT_DAYS[m.group(2)]
+        return today - (days - 1) * day, today, f"over the last {days} days"
+
+    m = _find(r"this\s+(week|month|year)", text)
+    if m:
+        unit = m.group(1)
+        start = {'week': today - today.dayofweek * day, 'month': today.replace(day=1),
+                 'year': today.replace(month=1, day=1)}[unit]
+        return start, today, f"this {unit}"
+
+    m = _find(rf"(?:in|during)\s+({'|'.join(MONTHS)})(?:\s+(\d{{4}}))?", text)
+    if m:
+        month = MONTHS[m.group(1)]
+        year = int(m.group(2)) if m.group(2) else today.year - (month > today.month)
+        start = pd.Timestamp(year=year, month=month, day=1)
+        return start, start + pd.offsets.MonthEnd(0), f"in {start:%B %Y}"
+
+    m = _find(r"since\s+(\d{4}-\d{2}-\d{2})", text)
+    if m:
+        return pd.Timestamp(m.group(1)), today, f"since {pd.Timestamp(m.group(1)):%d %b %Y}"
+    m = _find(r"on\s+(\d{4}-\d{2}-\d{2})", text)
+    if m:
+        day_ = pd.Timestamp(m.group(1))
+        return day_, day_, f"on {day_:%d %b %Y}"
+    return None
+
+
+def parse_question(question, today):
+    """
+    The query a question asks for, or None when it is open-ended or names
+    no metric or activity (those go to Gemini).
+
+    today anchors relative windows ("yesterday", "last 2 weeks"). Returns a
+    dict: metric, agg, window (first day, last day, label) or None for all
+    data, activity, days ('weekend' / 'weekday') or None, asleep (bool) and
+    threshold (op, value) or None.
+    """
+    text = question.lower().replace("’", "'")
+    if OPEN_ENDED.search(text):
+        return None
+    today = pd.Timestamp(today).normalize()
+
+    activity = next((name for name, (pattern, _, _) in ACTIVITIES.items()
+                     if _find(pattern, text)), None)
+    metric = _metric(text)
+    if metric is None:
+        if activity is None:
+            return None
+        # "How long / how far did I run": the exercise log
+        metric = ('exercise_minutes' if _find("how long|minutes|hours|longest|shortest", text)
+                  else 'distance' if _find("how far", text) else 'sessions')
+
+    threshold = None
+    agg_text = text
+    m = THRESHOLD.search(text)
+    if m:
+        value = float(m.group(2).replace(',', '')) * (1000 if m.group(3) else 1)
+        op = '>' if m.group(1) in ('over', 'above', 'more than', 'greater than', 'at least') else '<'
+        threshold = (op + ('=' if m.group(1) in ('at least', 'at most') else ''), value)
+        # "at least" / "at most" name the filter, not the aggregation;
+        # "nights over 8 hours" reads as "nights with ... hours"
+        agg_text = text[:m.start()] + " with " + text[m.end():]
+
+    counting = _find(dict(AGGREGATIONS)['count'], agg_text) is not None
+    agg = next((name for name, pattern in AGGREGATIONS if _find(pattern, agg_text)
+                and not (counting and name in ('max', 'min'))), None)
+    if agg is None:
+        agg = 'count' if metric == 'sessions' else (
+            'sum' if metric in ('exercise_minutes', 'distance') else 'mean')
+
+    window = _window(text, today)
+    if agg == 'count' and threshold is None and (
+            metric in QUANTITY_METRICS or _find(rf"how many\s+(?:{QUANTITY_UNITS})", text)):
+        # "How many hours did I sleep": the amount on one day, the total over several
+        agg = 'mean' if window is not None and window[0] == window[1] else 'sum'
+
+    days = ('weekend' if _find("weekends?", text)
+            else 'weekday' if _find("weekdays?|workdays?|work days?", text) else None)
+    asleep = metric == 'hr' and bool(
+        _find(r"(?:during|while|in)\s+(?:my\s+)?(?:sleep|asleep)|asleep|at night|overnight", text))
+
+    return {'metric': metric, 'agg': agg, 'window': window,
+            'activity': activity, 'days': days, 'asleep': asleep, 'threshold': threshold}
+
+
+# ==============================================================================
+# QUERY EXECUTION
+# ==============================================================================
+
+def _query_tables(data):
+    """
+    The daily aggregates and daily metrics table of a dataset; built once
+    and kept on data when the dashboard has not already done so.
+    """
+    if 'aggregates' not in data:
+        data['aggregates'] = update_daily_aggregates(DailyAggregates(), data, data.get('rollups'))
+    if 'daily_metrics' not in data:
+        data['daily_metrics'] = data['aggregates'].daily_metrics()
+    return data['aggregates'], data['daily_metrics']
+
+
+def data_end(data):
+    """The last day with data: 'today' for relative windows on an old export."""
+    _, daily = _query_tables(data)
+    if not daily.empty:
+        return daily.index.max()
+    hr_df = data.get('detailed_hr_df')
+    if hr_df is not None and not hr_df.empty:
+        return pd.Timestamp(hr_df['timestamp'].max()).tz_localize(None).normalize()
+    return pd.Timestamp.now().normalize()
+
+
+def _day_filter(index, query):
+    """Boolean mask of a DatetimeIndex for the window and weekday filters."""
+    keep = np.ones(len(index), dtype=bool)
+    if query['window'] is not None:
+        first, last, _ = query['window']
+        keep &= (index >= first) & (index < last + pd.Timedelta(days=1))
+    if query['days'] is not None:
+        keep &= (index.dayofweek >= 5) == (query['days'] == 'weekend')
+    return keep
+
+
+def _sessions(data, query):
+    """Exercise sessions in the window matching the activity filter."""
+    ex = data.get('exercise_df')
+    if ex is None or ex.empty or 'start_time' not in ex.columns:
+        return pd.DataFrame()
+    ex = ex[_day_filter(pd.DatetimeIndex(ex['start_time']).normalize(), query)]
+    if query['activity'] is not None:
+        ex = ex[ex['activity_name'].str.contains(ACTIVITIES[query['activity']][1],
+                                                 case=False, regex=True, na=False)]
+    return ex
+
+
+def _threshold_mask(values, threshold):
+    if threshold is None:
+        return np.ones(len(values), dtype=bool)
+    op, limit = threshold
+    return {'>': values > limit, '>=': values >= limit,
+            '<': values < limit, '<=': values <= limit}[op]
+
+
+def _hr_values(data, query):
+    """Continuous HR readings (timestamps, bpm) in the window and filters."""
+    hr_df = data['detailed_hr_df']
+    ts = pd.to_datetime(hr_df['timestamp']).to_numpy(dtype='datetime64[ns]')
+    bpm = hr_df['bpm'].to_numpy(dtype=float)
+    if query['window'] is not None:
+        first, last, _ = query['window']
+        lo, hi = np.searchsorted(ts, np.array([first, last + pd.Timedelta(days=1)],
+                                              dtype='datetime64[ns]'))
+        ts, bpm = ts[lo:hi], bpm[lo:hi]
+
+    # Activity or sleep: keep readings inside the intervals, found by searchsorted
+    intervals = None
+    if query['activity'] is not None:
+        intervals = _sessions(data, query)
+    elif query['asleep']:
+        intervals = data.get('sleep_df', pd.DataFrame())
+        if 'main_sleep' in intervals.columns:
+            intervals = intervals[intervals['main_sleep'] == True]  # noqa: E712
+    if intervals is not None:
+        if intervals.empty or 'start_time' not in intervals.columns:
+            return ts[:0], bpm[:0]
+        starts, ends = (pd.to_datetime(intervals[c], errors='coerce').to_numpy(dtype='datetime64[ns]')
+                        for c in ('start_time', 'end_time'))
+        valid = ~np.isnat(starts) & ~np.isnat(ends)
+        inside = np.zeros(len(ts) + 1, dtype=np.int64)
+        np.add.at(inside, np.searchsorted(ts, starts[valid]), 1)
+        np.add.at(inside, np.searchsorted(ts, ends[valid]), -1)
+        keep = np.cumsum(inside[:-1]) > 0
+        ts, bpm = ts[keep], bpm[keep]
+
+    if query['days'] is not None:
+        weekend = pd.DatetimeIndex(ts).dayofweek >= 5
+        keep = weekend == (query['days'] == 'weekend')
+        ts, bpm = ts[keep], bpm[keep]
+    return ts, bpm
+
+
+def _hr_from_aggregates(aggregates, query):
+    """(count, sum, min, max) of the stored per-day HR statistics in the window."""
+    counts = aggregates.table('bpm', 'count')
+    keep = _day_filter(pd.DatetimeIndex(counts.index), query)
+    return (counts[keep].sum(), aggregates.table('bpm', 'sum')[keep].sum(),
+            aggregates.table('bpm', 'min')[keep].min(), aggregates.table('bpm', 'max')[keep].max())
+
+
+def run_query(query, data):
+    """
+    Execute a parsed query against a parse_takeout dataset.
+
+    Returns a dict: value (None when there is no data), samples (days,
+    sessions or readings it was computed from), noun for those, and day
+    (the date of a max / min, when there is one).
+    """
+    aggregates, daily = _query_tables(data)
+    metric, agg, threshold = query['metric'], query['agg'], query['threshold']
+    result = {'value': None, 'samples': 0, 'noun': 'days', 'day': None}
+
+    if metric == 'hr':
+        result['noun'] = 'readings'
+        plain = (query['activity'] is None and not query['asleep'] and threshold is None
+                 and agg != 'median' and len(aggregates))
+        if plain:
+            # Indexed daily rollups: no pass over the raw readings
+            count, total, low, high = _hr_from_aggregates(aggregates, query)
+            if count:
+                result['samples'] = int(count)
+                result['value'] = {'min': low, 'max': high, 'count': count}.get(agg, total / count)
+            return result
+        hr_df = data.get('detailed_hr_df')
+        if hr_df is None or hr_df.empty:
+            return result
+        ts, bpm = _hr_values(data, query)
+        keep = _threshold_mask(bpm, threshold)
+        if agg == 'count':
+            result['samples'] = len(bpm)
+            result['value'] = int(keep.sum()) if len(bpm) else None
+            return result
+        ts, bpm = ts[keep], bpm[keep]
+        if len(bpm):
+            result['samples'] = len(bpm)
+            if agg in ('min', 'max'):
+                i = int(np.argmax(bpm) if agg == 'max' else np.argmin(bpm))
+                result['value'], result['day'] = bpm[i], pd.Timestamp(ts[i])
+            else:
+                result['value'] = np.median(bpm) if agg == 'median' else bpm.mean()
+        return result
+
+    if metric in ('sessions', 'exercise_minutes', 'distance'):
+        result['noun'] = ACTIVITIES[query['activity'] or 'workout'][2]
+        sessions = _sessions(data, query)
+        if sessions.empty:
+            result['value'] = 0 if agg == 'count' else None
+            return result
+        column = {'sessions': None, 'exercise_minutes': 'duration_minutes',
+                  'distance': 'distance_km'}[metric]
+        values = (np.ones(len(sessions)) if column is None
+                  else sessions[column].to_numpy(dtype=float))
+        keep = _threshold_mask(values, threshold)
+        sessions, values = sessions[keep], values[keep]
+        result['samples'] = len(values)
+        if agg == 'count' or metric == 'sessions':
+            result['value'] = len(values)
+        elif len(values):
+            if agg in ('min', 'max'):
+                i = int(np.argmax(values) if agg == 'max' else np.argmin(values))
+                result['value'] = values[i]
+                result['day'] = pd.Timestamp(sessions['start_time'].iloc[i])
+            else:
+                result['value'] = {'sum': np.sum, 'median': np.median}.get(agg, np.mean)(values)
+        return result
+
+    # Daily metrics, optionally only on days with a matching session
+    if metric not in daily.columns:
+        return result
+    series = daily[metric].dropna()
+    series = series[_day_filter(pd.DatetimeIndex(series.index), query)]
+    if query['activity'] is not None:
+        active_days = pd.DatetimeIndex(_sessions(data, query)['start_time']).normalize()
+        series = series[series.index.isin(active_days)]
+    counted = len(series)
+    series = series[_threshold_mask(series.to_numpy(), threshold)]
+    if agg == 'count' and (threshold is not None or metric not in DAILY_TOTAL_METRICS):
+        result['samples'] = counted
+        result['value'] = len(series) if counted else None
+        return result
+    if series.empty:
+        return result
+    result['samples'] = len(series)
+    if agg in ('min', 'max'):
+        day = series.idxmax() if agg == 'max' else series.idxmin()
+        result['value'], result['day'] = series[day], day
+    else:
+        # "How many steps" over a window is the total
+        how = 'sum' if agg == 'count' else agg
+        result['value'] = getattr(series, how)()
+    return result
+
+
+# ==============================================================================
+# ANSWERS
+# ==============================================================================
+
+def _counted(n, noun):
+    """'1 day', '3 days', '1 yoga session'."""
+    return f"{n:,} {noun[:-1] if n == 1 else noun}"
+
+
+def _lower(label):
+    """Lower-case a label's first letter unless it starts with an acronym."""
+    word = label.split()[0]
+    return label if word[1:] != word[1:].lower() else label[0].lower() + label[1:]
+
+
+def describe_answer(query, result):
+    """One sentence stating the answer and what it was computed from."""
+    metric, agg, threshold = query['metric'], query['agg'], query['threshold']
+    label, unit, decimals = QUERY_METRICS[metric]
+    noun, value = result['noun'], result['value']
+    suffix = unit if unit[:1] in ('', '/', '%') else f" {unit}"
+
+    where = []
+    if query['activity'] is not None and metric in ('hr', *DAILY_METRICS):
+        activity_noun = ACTIVITIES[query['activity']][2]
+        where.append(f"during {activity_noun}" if metric == 'hr' else f"on days with {activity_noun}")
+    if query['asleep']:
+        where.append("during sleep")
+    if query['days'] is not None:
+        where.append(f"on {query['days']}s")
+    if threshold is not None:
+        words = {'>': "over", '>=': "at least", '<': "under", '<=': "at most"}[threshold[0]]
+        where.append(f"with {_lower(label)} {words} {threshold[1]:,g}{suffix}")
+    where.append(query['window'][2] if query['window'] is not None else "across all the data")
+    scope = " ".join(where)
+
+    if value is None:
+        return f"No {_lower(label)} data {scope}."
+
+    # Counts: sessions, days or readings passing the filters
+    if metric in ('sessions', 'exercise_minutes', 'distance') and (agg == 'count' or metric == 'sessions'):
+        return f"{noun.capitalize()} {scope}: {int(value)}."
+    if agg == 'count' and (threshold is not None or metric not in DAILY_TOTAL_METRICS):
+        subject = "Heart rate readings" if metric == 'hr' else f"Days with {_lower(label)} data"
+        if threshold is not None:
+            subject = "Readings" if metric == 'hr' else "Days"
+            return f"{subject} {scope}: {int(value):,} of {result['samples']:,}."
+        return f"{subject} {scope}: {int(value):,}."
+
+    how = 'sum' if agg == 'count' else agg
+    if metric == 'hr' and how == 'sum':
+        how = 'mean'
+    text = f"{value:,.{decimals}f}{suffix}"
+    if result['day'] is not None:
+        timed = metric in ('hr', 'exercise_minutes', 'distance')
+        when = result['day'].strftime('%a %d %b %Y, %H:%M' if timed else '%a %d %b %Y')
+        return f"{AGGREGATION_LABELS[how]} {_lower(label)} {scope}: {text} ({when})."
+    if result['samples'] == 1:
+        return f"{label} {scope}: {text}."
+    return (f"{AGGREGATION_LABELS[how]} {_lower(label)} {scope}: {text} "
+            f"({_counted(result['samples'], noun)}).")
+
+
+def answer_question(question, data, api_key=None, health_summary=None, today=None,
+                    **coach_options):
+    """
+    Answer a question about a parse_takeout dataset.
+
+    Numeric questions are answered locally in milliseconds; open-ended ones
+    go to Gemini (ask_coach, with coach_options) when api_key and
+    health_summary are given. today anchors relative windows and defaults
+    to the last day with data. Returns a dict: text, source ('local',
+    'gemini' or None when unanswered), query, value, model, cached and
+    seconds.
+    """
+    started = time.perf_counter()
+    today = pd.Timestamp(today) if today is not None else data_end(data)
+    query = parse_question(question, today)
+    if query is not None:
+        result = run_query(query, data)
+        return {'text': describe_answer(query, result), 'source': 'local', 'query': query,
+                'value': result['value'], 'model': None, 'cached': False,
+                'seconds': time.perf_counter() - started}
+
+    if not api_key or not health_summary:
+        return {'text': "That needs the AI coach. Without a Gemini API key, ask about a "
+                        "metric (heart rate, sleep, steps, HRV...), optionally with how, "
+                        "when and during what: \"average heart rate during runs last month\".",
+                'source': None, 'query': None, 'value': None, 'model': None,
+                'cached': False, 'seconds': time.perf_counter() - started}
+    reply = ask_coach(question, health_summary, api_key, **coach_options)
+    return {'text': clean_ai_response(reply['text']), 'source': 'gemini', 'query': None,
+            'value': None, 'model': reply['model'], 'cached': reply['cached'],
+            'seconds': time.perf_counter() - started}
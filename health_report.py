@@ -0,0 +1,1486 @@
+"""
+================================================================================
+Fitbit AI Health Coach - Charts and printable report
+================================================================================
+Plotly chart builders, static chart export and the HTML / PDF report.
+Does not import Streamlit, so reports can be built outside the dashboard.
+"""
+
+import base64
+import functools
+import json
+import re
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
+
+from health_data import HR_ZONES, analyze_health
+
+# ==============================================================================
+# STATIC CHART EXPORT
+# ==============================================================================
+
+# Render several figures at once for the PDF report
+def render_chart_images(figs, width=700, height=350, scale=2, on_chart=None, image_format="png"):
+    """
+    Export a batch of plotly figures to PNG (or SVG) concurrently.
+
+    figs maps chart name -> figure. With Kaleido 1.x a single browser is
+    started with one tab per chart and all renders are awaited together;
+    older Kaleido falls back to a thread pool over pio.to_image.
+    Returns (images, timings, errors), each keyed by chart name: image bytes,
+    render seconds per chart, and messages for charts that failed.
+    on_chart(name), if given, is called as each chart finishes.
+    """
+    import asyncio
+    opts = {"format": image_format, "width": width, "height": height, "scale": scale}
+    images, timings, errors = {}, {}, {}
+    if not figs:
+        return images, timings, errors
+
+    def _store(name, img_bytes, started):
+        timings[name] = time.perf_counter() - started
+        images[name] = img_bytes
+
+    def _finished(name):
+        if on_chart is not None:
+            on_chart(name)
+
+    try:
+        import kaleido
+        Kaleido = kaleido.Kaleido
+    except (ImportError, AttributeError):
+        Kaleido = None
+
+    if Kaleido is not None:
+        async def _render_one(k, name, fig):
+            started = time.perf_counter()
+            try:
+                _store(name, await k.calc_fig(fig, opts=opts), started)
+            except Exception as e:
+                timings[name] = time.perf_counter() - started
+                errors[name] = str(e)
+            _finished(name)
+
+        async def _render_all():
+            async with Kaleido(n=len(figs)) as k:
+                await asyncio.gather(*(_render_one(k, name, fig) for name, fig in figs.items()))
+
+        asyncio.run(_render_all())
+        return images, timings, errors
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def _to_image(name, fig):
+        started = time.perf_counter()
+        try:
+            _store(name, pio.to_image(fig, **opts), started)
+        except Exception as e:
+            timings[name] = time.perf_counter() - started
+            errors[name] = str(e)
+        _finished(name)
+
+    with ThreadPoolExecutor(max_workers=len(figs)) as pool:
+        list(pool.map(lambda item: _to_image(*item), figs.items()))
+    return images, timings, errors
+
+# URL scheme the report HTML uses to reference chart images
+CHART_URL_SCHEME = "chart:"
+
+def _image_mime(data):
+    """MIME type of exported chart bytes (Kaleido writes PNG or SVG)."""
+    head = data[:100].lstrip()
+    return 'image/svg+xml' if head.startswith((b'<svg', b'<?xml')) else 'image/png'
+
+def _chart_url_fetcher(images):
+    """
+    WeasyPrint URL fetcher serving chart:<name> from in-memory image bytes.
+
+    Other URLs go to WeasyPrint's own fetcher. WeasyPrint 66+ expects a
+    URLFetcher subclass, older releases a function returning a dict.
+    """
+    try:
+        from weasyprint.urls import URLFetcher, URLFetcherResponse
+    except ImportError:
+        from weasyprint import default_url_fetcher
+
+        def fetcher(url, *args, **kwargs):
+            if url.startswith(CHART_URL_SCHEME):
+                image = images[url[len(CHART_URL_SCHEME):]]
+                return {'string': image, 'mime_type': _image_mime(image)}
+            return default_url_fetcher(url, *args, **kwargs)
+        return fetcher
+
+    class ChartURLFetcher(URLFetcher):
+        def fetch(self, url, headers=None):
+            if url.startswith(CHART_URL_SCHEME):
+                image = images[url[len(CHART_URL_SCHEME):]]
+                return URLFetcherResponse(url, body=image, headers={'Content-Type': _image_mime(image)})
+            return super().fetch(url, headers)
+    return ChartURLFetcher()
+
+# Generate PDF from HTML using weasyprint
+def generate_pdf_from_html(html_content, images=None):
+    """
+    Convert HTML to PDF bytes in memory using weasyprint (requires packages.txt
+    for system deps). images maps chart name -> PNG/SVG bytes for chart: URLs.
+    Raises if WeasyPrint or its system libraries are unavailable.
+    """
+    from weasyprint import HTML
+
+    return HTML(string=html_content, url_fetcher=_chart_url_fetcher(images or {})).write_pdf()
+
+# ==============================================================================
+# CHART BUILDERS
+# ==============================================================================
+
+# Traces shorter than this are left as plain JSON lists
+TYPED_ARRAY_MIN_POINTS = 256
+
+
+def pack_figure_arrays(fig):
+    """
+    Switch a figure's large trace arrays to binary typed-array transport.
+
+    Plotly serialises numpy arrays as base64 typed arrays, but datetimes are
+    still sent as ISO strings (~24 bytes per point). Datetime x values are
+    replaced with float64 epoch milliseconds on a 'date' axis, which plotly.js
+    renders identically, and float y values are narrowed to float32.
+    Modifies and returns fig.
+    """
+    for trace in fig.data:
+        for attr in ('x', 'y'):
+            values = getattr(trace, attr, None)
+            if values is None or len(values) < TYPED_ARRAY_MIN_POINTS:
+                continue
+            arr = np.asarray(values)
+            if arr.dtype == object:
+                try:
+                    arr = pd.to_datetime(arr).to_numpy()
+                except (TypeError, ValueError):
+                    continue
+            if np.issubdtype(arr.dtype, np.datetime64):
+                epoch_ms = arr.astype('datetime64[ms]').view('i8').astype('f8')
+                epoch_ms[np.isnat(arr)] = np.nan
+                setattr(trace, attr, epoch_ms)
+                axis_ref = getattr(trace, f'{attr}axis', None) or attr
+                axis_name = f'{attr}axis{axis_ref[1:]}'
+                fig.layout[axis_name].type = 'date'
+            elif np.issubdtype(arr.dtype, np.floating) and arr.dtype.itemsize > 4:
+                setattr(trace, attr, arr.astype('f4'))
+    return fig
+
+
+def minmax_envelope(timestamps, values, columns, max_only=False):
+    """
+    Row positions that keep a series' per-pixel-column min/max envelope.
+
+    The time span is cut into `columns` equal slices (one per output pixel
+    column). Each slice keeps the rows holding its min and max, in time
+    order, so a rasterised line looks the same as with every point drawn.
+    With max_only (bar charts drawn up from zero) only the max is kept.
+    Returns sorted integer positions into the input.
+    """
+    ts = pd.to_datetime(timestamps).to_numpy(dtype='datetime64[ns]').view('i8')
+    vals = np.asarray(values, dtype='f8')
+    pos = np.flatnonzero(np.isfinite(vals))
+    if len(pos) <= (1 if max_only else 2) * columns:
+        return pos
+    pos = pos[np.argsort(ts[pos], kind='stable')]
+    ts, vals = ts[pos], vals[pos]
+
+    span = max(int(ts[-1] - ts[0]), 1)
+    column = np.minimum(((ts - ts[0]) * (columns / span)).astype(np.int64), columns - 1)
+    starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    counts = np.diff(np.r_[starts, len(column)])
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    def _first_match(extreme):
+        hits = np.flatnonzero(vals == np.repeat(extreme, counts))
+        return hits[np.r_[True, group[hits[1:]] != group[hits[:-1]]]]
+
+    keep = _first_match(np.maximum.reduceat(vals, starts))
+    if not max_only:
+        keep = np.union1d(keep, _first_match(np.minimum.reduceat(vals, starts)))
+    return np.sort(pos[keep])
+
+
+def create_continuous_hr_chart(hr_df, print_columns=None):
+    """
+    Create a continuous heart rate chart with ALL data.
+
+    print_columns: pixel width of a static export; readings are reduced to
+    their min/max envelope per pixel column instead of the interactive
+    downsample.
+    """
+    if hr_df.empty:
+        return None
+
+    # Downsample if too many points for performance
+    n_points = len(hr_df)
+    if print_columns:
+        plot_df = hr_df.iloc[minmax_envelope(hr_df['timestamp'], hr_df['bpm'], print_columns)]
+    elif n_points > 50000:
+        step = n_points // 25000
+        plot_df = hr_df.iloc[::step].copy()
+    else:
+        plot_df = hr_df.copy()
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=plot_df['timestamp'],
+        y=plot_df['bpm'],
+        mode='lines',
+        name='Heart Rate',
+        line=dict(color='#e74c3c', width=1),
+        hovertemplate='<b>%{x|%Y-%m-%d %H:%M}</b><br>HR: %{y:.0f} bpm<extra></extra>'
+    ))
+
+    # Hourly moving average
+    if n_points > 1000:
+        hr_df_sorted = hr_df.sort_values('timestamp')
+        hr_df_sorted['hour'] = hr_df_sorted['timestamp'].dt.floor('H')
+        hourly_avg = hr_df_sorted.groupby('hour')['bpm'].mean().reset_index()
+
+        fig.add_trace(go.Scatter(
+            x=hourly_avg['hour'],
+            y=hourly_avg['bpm'],
+            mode='lines',
+            name='Hourly Average',
+            line=dict(color='#c0392b', width=3),
+            hovertemplate='<b>%{x|%Y-%m-%d %H:%M}</b><br>Avg: %{y:.1f} bpm<extra></extra>'
+        ))
+
+    # Heart rate zones
+    fig.add_hrect(y0=40, y1=60, line_width=0, fillcolor="green", opacity=0.05)
+    fig.add_hrect(y0=60, y1=100, line_width=0, fillcolor="green", opacity=0.05)
+    fig.add_hrect(y0=100, y1=140, line_width=0, fillcolor="yellow", opacity=0.05)
+    fig.add_hrect(y0=140, y1=200, line_width=0, fillcolor="red", opacity=0.05)
+
+    fig.add_hline(y=60, line_dash="dot", line_color="green", opacity=0.5)
+    fig.add_hline(y=100, line_dash="dot", line_color="orange", opacity=0.5)
+    fig.add_hline(y=140, line_dash="dot", line_color="red", opacity=0.5)
+
+    min_bpm = hr_df['bpm'].min()
+    max_bpm = hr_df['bpm'].max()
+    avg_bpm = hr_df['bpm'].mean()
+
+    fig.update_layout(
+        title=dict(
+            text=f"Continuous Heart Rate - {n_points:,} readings<br>" +
+                 f"<sub>Min: {min_bpm:.0f} bpm | Max: {max_bpm:.0f} bpm | Avg: {avg_bpm:.1f} bpm</sub>",
+            font=dict(size=16)
+        ),
+        xaxis_title="Date & Time",
+        yaxis_title="Heart Rate (bpm)",
+        yaxis=dict(range=[30, max(180, max_bpm + 10)]),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60),
+        showlegend=True,
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_hr_percentile_bands_chart(bands_df):
+    """Create a long-range heart rate chart from daily percentile bands."""
+    if bands_df is None or bands_df.empty:
+        return None
+
+    fig = go.Figure()
+
+    # Each band is an invisible upper edge followed by a lower edge filled up to it
+    bands = [
+        ('max', 'min', 'Min-Max', 'rgba(231, 76, 60, 0.10)'),
+        ('p95', 'p5', '5th-95th', 'rgba(231, 76, 60, 0.20)'),
+        ('p75', 'p25', '25th-75th', 'rgba(231, 76, 60, 0.35)'),
+    ]
+    for upper, lower, name, color in bands:
+        fig.add_trace(go.Scatter(
+            x=bands_df['date'],
+            y=bands_df[upper],
+            mode='lines',
+            line=dict(width=0),
+            showlegend=False,
+            hoverinfo='skip'
+        ))
+        fig.add_trace(go.Scatter(
+            x=bands_df['date'],
+            y=bands_df[lower],
+            mode='lines',
+            line=dict(width=0),
+            fill='tonexty',
+            fillcolor=color,
+            name=name,
+            hoverinfo='skip'
+        ))
+
+    fig.add_trace(go.Scatter(
+        x=bands_df['date'],
+        y=bands_df['p50'],
+        mode='lines',
+        name='Median',
+        line=dict(color='#e74c3c', width=2),
+        customdata=bands_df[['min', 'p5', 'p25', 'p75', 'p95', 'max']].to_numpy(),
+        hovertemplate='<b>%{x|%Y-%m-%d}</b><br>Median: %{y:.0f} bpm'
+                      '<br>25-75th: %{customdata[2]:.0f}-%{customdata[3]:.0f}'
+                      '<br>5-95th: %{customdata[1]:.0f}-%{customdata[4]:.0f}'
+                      '<br>Min/Max: %{customdata[0]:.0f}/%{customdata[5]:.0f}<extra></extra>'
+    ))
+
+    fig.add_hline(y=60, line_dash="dot", line_color="green", opacity=0.5)
+    fig.add_hline(y=100, line_dash="dot", line_color="orange", opacity=0.5)
+    fig.add_hline(y=140, line_dash="dot", line_color="red", opacity=0.5)
+
+    fig.update_layout(
+        title=dict(
+            text=f"Daily Heart Rate Bands - {len(bands_df):,} days<br>" +
+                 f"<sub>{int(bands_df['readings'].sum()):,} readings | "
+                 f"median of daily medians: {bands_df['p50'].median():.0f} bpm</sub>",
+            font=dict(size=16)
+        ),
+        xaxis_title="Date",
+        yaxis_title="Heart Rate (bpm)",
+        yaxis=dict(range=[30, max(180, bands_df['max'].max() + 10)]),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60),
+        showlegend=True,
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_continuous_activity_chart(steps_df, calories_df, print_columns=None):
+    """
+    Create a continuous activity chart with ALL data.
+
+    print_columns: pixel width of a static export; each bar series keeps only
+    its per-pixel-column maximum (the visible bar top).
+    """
+    if steps_df.empty:
+        return None
+
+    fig = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        subplot_titles=('Steps / Minute', 'Calories / Minute'),
+        vertical_spacing=0.1
+    )
+
+    # Downsample if needed
+    n_steps = len(steps_df)
+    if print_columns:
+        steps_plot = steps_df.iloc[minmax_envelope(
+            steps_df['timestamp'], steps_df['steps'], print_columns, max_only=True)]
+    elif n_steps > 50000:
+        step = n_steps // 25000
+        steps_plot = steps_df.iloc[::step].copy()
+    else:
+        steps_plot = steps_df.copy()
+
+    fig.add_trace(
+        go.Bar(
+            x=steps_plot['timestamp'],
+            y=steps_plot['steps'],
+            name='Steps',
+            marker_color='#1e8449',
+            marker_line_color='#145a32',
+            marker_line_width=0.5,
+            hovertemplate='<b>%{x|%Y-%m-%d %H:%M}</b><br>Steps: %{y}<extra></extra>'
+        ),
+        row=1, col=1
+    )
+
+    if not calories_df.empty:
+        n_cals = len(calories_df)
+        if print_columns:
+            cals_plot = calories_df.iloc[minmax_envelope(
+                calories_df['timestamp'], calories_df['calories'], print_columns, max_only=True)]
+        elif n_cals > 50000:
+            step = n_cals // 25000
+            cals_plot = calories_df.iloc[::step].copy()
+        else:
+            cals_plot = calories_df.copy()
+
+        fig.add_trace(
+            go.Bar(
+                x=cals_plot['timestamp'],
+                y=cals_plot['calories'],
+                name='Calories',
+                marker_color='#1e8449',
+                marker_line_color='#145a32',
+                marker_line_width=0.5,
+                hovertemplate='<b>%{x|%Y-%m-%d %H:%M}</b><br>Cal: %{y:.1f}<extra></extra>'
+            ),
+            row=2, col=1
+        )
+
+    total_steps = steps_df['steps'].sum()
+    total_cals = calories_df['calories'].sum() if not calories_df.empty else 0
+
+    fig.update_layout(
+        title=dict(
+            text=f"Daily Activity<br><sub>Total steps: {int(total_steps):,} | Total calories: {int(total_cals):,}</sub>",
+            font=dict(size=16)
+        ),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=600,
+        margin=dict(l=60, r=40, t=100, b=60),
+        showlegend=False,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_multi_metric_timeline(aligned):
+    """Create a stacked timeline of every metric on one shared x-axis."""
+    if aligned is None or aligned.empty:
+        return None
+
+    rows = [(key, title) for key, title in [
+        ('hr_mean', 'Heart Rate (bpm)'),
+        ('steps', 'Steps'),
+        ('calories', 'Calories'),
+        ('asleep', 'Asleep'),
+        ('exercise', 'Exercise'),
+    ] if key in aligned.columns]
+    row_of = {key: i + 1 for i, (key, _) in enumerate(rows)}
+
+    fig = make_subplots(
+        rows=len(rows), cols=1,
+        shared_xaxes=True,
+        subplot_titles=[title for _, title in rows],
+        row_heights=[2 if key == 'hr_mean' else 1 for key, _ in rows],
+        vertical_spacing=0.04
+    )
+    x = aligned['time']
+
+    if 'hr_mean' in row_of:
+        row = row_of['hr_mean']
+        fig.add_trace(go.Scatter(
+            x=x, y=aligned['hr_max'], mode='lines', line=dict(width=0),
+            showlegend=False, hoverinfo='skip'
+        ), row=row, col=1)
+        fig.add_trace(go.Scatter(
+            x=x, y=aligned['hr_min'], mode='lines', line=dict(width=0),
+            fill='tonexty', fillcolor='rgba(231, 76, 60, 0.2)', name='HR range',
+            hoverinfo='skip'
+        ), row=row, col=1)
+        fig.add_trace(go.Scatter(
+            x=x, y=aligned['hr_mean'], mode='lines', name='Heart Rate',
+            line=dict(color='#e74c3c', width=1),
+            hovertemplate='HR: %{y:.0f} bpm<extra></extra>'
+        ), row=row, col=1)
+
+    for key, name, color, fmt in [('steps', 'Steps', '#1e8449', '%{y:,.0f}'),
+                                  ('calories', 'Calories', '#F59E0B', '%{y:,.0f} kcal')]:
+        if key in row_of:
+            fig.add_trace(go.Bar(
+                x=x, y=aligned[key], name=name, marker_color=color, marker_line_width=0,
+                hovertemplate=f'{name}: {fmt}<extra></extra>'
+            ), row=row_of[key], col=1)
+
+    for key, name, color in [('asleep', 'Asleep', 'rgba(124, 58, 237, 0.6)'),
+                             ('exercise', 'Exercise', 'rgba(96, 165, 250, 0.6)')]:
+        if key in row_of:
+            fig.add_trace(go.Scatter(
+                x=x, y=aligned[key] * 100, mode='lines', name=name,
+                line=dict(width=0, shape='hv'), fill='tozeroy', fillcolor=color,
+                hovertemplate=f'{name}: %{{y:.0f}}% of bucket<extra></extra>'
+            ), row=row_of[key], col=1)
+            fig.update_yaxes(range=[0, 100], showticklabels=False, row=row_of[key], col=1)
+
+    width = aligned.attrs.get('bucket_width')
+    width_label = f" | {width} buckets" if width is not None else ""
+    fig.update_layout(
+        title=dict(
+            text=f"Combined Timeline<br><sub>{len(aligned):,} shared time buckets{width_label}</sub>",
+            font=dict(size=16)
+        ),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=180 * len(rows) + 140,
+        margin=dict(l=60, r=40, t=100, b=60),
+        showlegend=False,
+        bargap=0,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_sleep_chart(sleep_df):
+    """Create a sleep duration chart."""
+    if sleep_df.empty:
+        return None
+
+    main_sleep = sleep_df[sleep_df['main_sleep'] == True].copy()
+    if main_sleep.empty:
+        return None
+
+    fig = go.Figure()
+
+    if 'minutes_asleep' in main_sleep.columns:
+        fig.add_trace(go.Bar(
+            x=main_sleep['date'],
+            y=main_sleep['minutes_asleep'] / 60,
+            name='Sleep duration',
+            marker_color='#2D9966',
+            hovertemplate='<b>%{x|%Y-%m-%d}</b><br>Sleep: %{y:.1f} h<extra></extra>'
+        ))
+
+    fig.add_hrect(y0=7, y1=9, line_width=0, fillcolor="green", opacity=0.1,
+                  annotation_text="Recommended (7-9 h)", annotation_position="right")
+
+    fig.update_layout(
+        title=dict(text="Sleep Duration", font=dict(size=16)),
+        xaxis_title="Date",
+        yaxis_title="Sleep (hours)",
+        hovermode='x unified',
+        template='plotly_dark',
+        height=400,
+        margin=dict(l=60, r=40, t=60, b=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_sleep_stages_chart(sleep_df):
+    """Create a sleep stages chart."""
+    if sleep_df.empty:
+        return None
+
+    main_sleep = sleep_df[sleep_df['main_sleep'] == True].copy()
+    if main_sleep.empty:
+        return None
+
+    has_stages = 'deep_minutes' in main_sleep.columns and main_sleep['deep_minutes'].notna().any()
+    has_classic = 'restless_minutes' in main_sleep.columns and main_sleep['restless_minutes'].notna().any()
+
+    fig = go.Figure()
+
+    if has_stages:
+        stages = [
+            ('deep_minutes', 'Deep Sleep', '#4c1d95'),
+            ('light_minutes', 'Light Sleep', '#7c3aed'),
+            ('rem_minutes', 'REM Sleep', '#c084fc'),
+            ('wake_minutes', 'Awake', '#fca5a5')
+        ]
+
+        for col, name, color in stages:
+            if col in main_sleep.columns:
+                fig.add_trace(go.Bar(
+                    x=main_sleep['date'],
+                    y=main_sleep[col],
+                    name=name,
+                    marker_color=color,
+                    hovertemplate=f'<b>%{{x|%Y-%m-%d}}</b><br>{name}: %{{y:.0f}} min<extra></extra>'
+                ))
+
+        title = "Sleep Stages"
+
+    elif has_classic:
+        stages = [
+            ('asleep_minutes', 'Asleep', '#7c3aed'),
+            ('restless_minutes', 'Restless', '#fbbf24'),
+            ('awake_minutes', 'Awake', '#fca5a5')
+        ]
+
+        for col, name, color in stages:
+            if col in main_sleep.columns:
+                fig.add_trace(go.Bar(
+                    x=main_sleep['date'],
+                    y=main_sleep[col],
+                    name=name,
+                    marker_color=color,
+                    hovertemplate=f'<b>%{{x|%Y-%m-%d}}</b><br>{name}: %{{y:.0f}} min<extra></extra>'
+                ))
+
+        title = "Sleep Stages (classic mode)"
+    else:
+        return None
+
+    fig.update_layout(
+        title=dict(text=title, font=dict(size=16)),
+        xaxis_title="Date",
+        yaxis_title="Minutes",
+        barmode='stack',
+        hovermode='x unified',
+        template='plotly_dark',
+        height=450,
+        margin=dict(l=60, r=40, t=60, b=60),
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_hrv_chart(hrv_df):
+    """Create an HRV chart."""
+    if hrv_df.empty or 'rmssd' not in hrv_df.columns:
+        return None
+
+    fig = make_subplots(
+        rows=2 if 'nremhr' in hrv_df.columns and hrv_df['nremhr'].notna().any() else 1,
+        cols=1,
+        shared_xaxes=True,
+        subplot_titles=('HRV (RMSSD)', 'Sleep Heart Rate (NREM)') if 'nremhr' in hrv_df.columns else ('HRV (RMSSD)',),
+        vertical_spacing=0.12
+    )
+
+    fig.add_trace(
+        go.Scatter(
+            x=hrv_df['timestamp'],
+            y=hrv_df['rmssd'],
+            mode='lines+markers',
+            name='RMSSD',
+            line=dict(color='#9b59b6', width=2),
+            marker=dict(size=6),
+            hovertemplate='<b>%{x|%Y-%m-%d}</b><br>RMSSD: %{y:.1f} ms<extra></extra>'
+        ),
+        row=1, col=1
+    )
+
+    if 'nremhr' in hrv_df.columns:
+        valid_nrem = hrv_df[hrv_df['nremhr'] > 0]
+        if not valid_nrem.empty:
+            fig.add_trace(
+                go.Scatter(
+                    x=valid_nrem['timestamp'],
+                    y=valid_nrem['nremhr'],
+                    mode='lines+markers',
+                    name='NREM HR',
+                    line=dict(color='#e74c3c', width=2),
+                    marker=dict(size=6),
+                    hovertemplate='<b>%{x|%Y-%m-%d}</b><br>NREM HR: %{y:.1f} bpm<extra></extra>'
+                ),
+                row=2, col=1
+            )
+
+    fig.update_layout(
+        title=dict(text="Heart Rate Variability", font=dict(size=16)),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=500,
+        margin=dict(l=60, r=40, t=80, b=60),
+        showlegend=False,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_spo2_chart(spo2_df):
+    """Create a SpO2 chart."""
+    if spo2_df.empty or 'average_value' not in spo2_df.columns:
+        return None
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=spo2_df['timestamp'],
+        y=spo2_df['average_value'],
+        mode='lines+markers',
+        name='Avg SpO2',
+        line=dict(color='#3498db', width=2),
+        marker=dict(size=6),
+        hovertemplate='<b>%{x|%Y-%m-%d}</b><br>SpO2: %{y:.1f}%<extra></extra>'
+    ))
+
+    if 'lower_bound' in spo2_df.columns and 'upper_bound' in spo2_df.columns:
+        fig.add_trace(go.Scatter(
+            x=spo2_df['timestamp'],
+            y=spo2_df['upper_bound'],
+            mode='lines',
+            line=dict(width=0),
+            showlegend=False,
+            hoverinfo='skip'
+        ))
+        fig.add_trace(go.Scatter(
+            x=spo2_df['timestamp'],
+            y=spo2_df['lower_bound'],
+            mode='lines',
+            line=dict(width=0),
+            fill='tonexty',
+            fillcolor='rgba(52, 152, 219, 0.2)',
+            name='Range',
+            hovertemplate='<b>%{x|%Y-%m-%d}</b><br>Min: %{y:.1f}%<extra></extra>'
+        ))
+
+    fig.add_hline(y=95, line_dash="dash", line_color="green", annotation_text="Normal (95%)")
+    fig.add_hline(y=90, line_dash="dash", line_color="red", annotation_text="Low (90%)")
+
+    fig.update_layout(
+        title=dict(text="Oxygen Saturation (SpO2)", font=dict(size=16)),
+        xaxis_title="Date",
+        yaxis_title="SpO2 (%)",
+        yaxis=dict(range=[85, 100]),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=400,
+        margin=dict(l=60, r=40, t=60, b=60),
+        showlegend=True,
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_stress_chart(stress_df):
+    """Create a stress score chart."""
+    if stress_df.empty or 'STRESS_SCORE' not in stress_df.columns:
+        return None
+
+    valid_stress = stress_df[stress_df['STRESS_SCORE'] > 0]
+    if valid_stress.empty:
+        return None
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=valid_stress['DATE'],
+        y=valid_stress['STRESS_SCORE'],
+        mode='lines+markers',
+        name='Stress Score',
+        line=dict(color='#e67e22', width=2),
+        marker=dict(size=8),
+        hovertemplate='<b>%{x|%Y-%m-%d}</b><br>Stress: %{y:.0f}/100<extra></extra>'
+    ))
+
+    fig.add_hrect(y0=0, y1=25, line_width=0, fillcolor="red", opacity=0.1, annotation_text="High stress")
+    fig.add_hrect(y0=25, y1=50, line_width=0, fillcolor="orange", opacity=0.05)
+    fig.add_hrect(y0=50, y1=75, line_width=0, fillcolor="yellow", opacity=0.05)
+    fig.add_hrect(y0=75, y1=100, line_width=0, fillcolor="green", opacity=0.1, annotation_text="Well recovered")
+
+    fig.update_layout(
+        title=dict(text="Stress Score", font=dict(size=16)),
+        xaxis_title="Date",
+        yaxis_title="Score (0-100)",
+        yaxis=dict(range=[0, 100]),
+        hovermode='x unified',
+        template='plotly_dark',
+        height=400,
+        margin=dict(l=60, r=40, t=60, b=60),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_exercise_session_chart(hr_df, session, max_hr, recovery_minutes=3):
+    """Create a heart rate chart for one exercise session plus its recovery."""
+    if hr_df.empty or pd.isna(session.get('start_time')) or pd.isna(session.get('end_time')):
+        return None
+
+    start = session['start_time']
+    end = session['end_time']
+    ts = hr_df['timestamp'].to_numpy()
+    lo = np.searchsorted(ts, np.datetime64(start), side='left')
+    hi = np.searchsorted(ts, np.datetime64(end + timedelta(minutes=recovery_minutes)), side='left')
+    plot_df = hr_df.iloc[lo:hi]
+    if plot_df.empty:
+        return None
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=plot_df['timestamp'],
+        y=plot_df['bpm'],
+        mode='lines',
+        name='Heart Rate',
+        line=dict(color='#e74c3c', width=2),
+        hovertemplate='<b>%{x|%H:%M:%S}</b><br>HR: %{y:.0f} bpm<extra></extra>'
+    ))
+
+    zone_colors = {'fat_burn': 'yellow', 'cardio': 'orange', 'peak': 'red'}
+    zone_edges = [max_hr * frac for _, _, frac in HR_ZONES] + [max_hr * 1.05]
+    for (key, label, _), low, high in zip(HR_ZONES, zone_edges[:-1], zone_edges[1:]):
+        fig.add_hrect(y0=low, y1=high, line_width=0, fillcolor=zone_colors[key], opacity=0.06,
+                      annotation_text=label, annotation_position="left")
+
+    fig.add_vrect(x0=end, x1=end + timedelta(minutes=recovery_minutes), line_width=0,
+                  fillcolor="#60A5FA", opacity=0.08,
+                  annotation_text="Recovery", annotation_position="top left")
+
+    fig.update_layout(
+        title=dict(
+            text=f"{session.get('activity_name', 'Session')} - {start.strftime('%Y-%m-%d %H:%M')}<br>" +
+                 f"<sub>{session.get('duration_minutes', 0):.0f} min | "
+                 f"{len(plot_df):,} readings incl. {recovery_minutes} min recovery</sub>",
+            font=dict(size=16)
+        ),
+        xaxis_title="Time",
+        yaxis_title="Heart Rate (bpm)",
+        hovermode='x unified',
+        template='plotly_dark',
+        height=420,
+        margin=dict(l=60, r=40, t=80, b=60),
+        showlegend=False,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+def create_hr_histogram(hr_df):
+    """Create a heart rate distribution histogram."""
+    if hr_df.empty or 'bpm' not in hr_df.columns:
+        return None
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Histogram(
+        x=hr_df['bpm'],
+        nbinsx=50,
+        marker_color='#1A6B45',
+        opacity=0.7,
+        hovertemplate='<b>%{x:.0f} bpm</b><br>Occurrences: %{y}<extra></extra>'
+    ))
+
+    avg_hr = hr_df['bpm'].mean()
+    fig.add_vline(x=avg_hr, line_dash="dash", line_color="red",
+                  annotation_text=f"avg {avg_hr:.1f}")
+
+    fig.update_layout(
+        title=dict(text="Heart Rate Distribution", font=dict(size=16)),
+        xaxis_title="Heart Rate (bpm)",
+        yaxis_title="Occurrences",
+        template='plotly_dark',
+        height=350,
+        margin=dict(l=60, r=40, t=60, b=60),
+        bargap=0.1,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(26,29,39,1)',
+    )
+
+    return fig
+
+# ==============================================================================
+# HTML / PDF REPORT GENERATION
+# ==============================================================================
+
+# Printable A4 page; {{field}} slots are filled by render_report_html
+REPORT_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Fitbit Health Report - {{name}}</title>
+    <style>
+        /* Reset and base */
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
+            font-size: 11pt;
+            line-height: 1.5;
+            color: #333;
+            background: white;
+            padding: 15px;
+            max-width: 210mm;
+            margin: 0 auto;
+        }
+
+        /* A4 page */
+        @page {
+            size: A4 portrait;
+            margin: 15mm;
+        }
+
+        @media print {
+            body {
+                padding: 10px !important;
+                font-size: 9pt !important;
+            }
+            .no-print { display: none !important; }
+            .section {
+                margin-bottom: 15px !important;
+                page-break-inside: avoid !important;
+            }
+            .section-header {
+                font-size: 12pt !important;
+                padding: 10px 15px !important;
+                margin-bottom: 12px !important;
+            }
+            .metrics {
+                gap: 10px !important;
+                margin-bottom: 12px !important;
+            }
+            .metric {
+                padding: 10px 15px !important;
+                min-width: 120px !important;
+            }
+            .metric-value {
+                font-size: 14pt !important;
+            }
+            .chart-container {
+                margin: 15px 0 !important;
+                page-break-inside: avoid !important;
+            }
+            .chart-container img {
+                max-height: 280px !important;
+                width: 100% !important;
+            }
+            .footer {
+                margin-top: 30px !important;
+                padding: 20px !important;
+            }
+            .alert {
+                padding: 10px 15px !important;
+                margin: 8px 0 !important;
+            }
+        }
+
+        /* Header */
+        .header {
+            text-align: center;
+            border-bottom: 3px solid #1A6B45;
+            padding-bottom: 20px;
+            margin-bottom: 30px;
+        }
+
+        .header h1 {
+            color: #1A6B45;
+            font-size: 28pt;
+            margin-bottom: 5px;
+        }
+
+        .header .date {
+            color: #666;
+            font-size: 11pt;
+        }
+
+        /* Sections */
+        .section {
+            margin-bottom: 20px;
+            page-break-inside: avoid;
+        }
+
+        .section-header {
+            background: #1A6B45;
+            color: white;
+            padding: 12px 18px;
+            border-radius: 8px;
+            font-size: 14pt;
+            font-weight: 600;
+            margin-bottom: 15px;
+        }
+
+        /* Metrics */
+        .metrics {
+            display: flex;
+            flex-wrap: wrap;
+            gap: 15px;
+            margin-bottom: 15px;
+        }
+
+        .metric {
+            background: #f8f9fa;
+            border-left: 4px solid #1A6B45;
+            padding: 12px 18px;
+            border-radius: 6px;
+            min-width: 140px;
+            flex: 1;
+        }
+
+        .metric-label {
+            font-size: 9pt;
+            color: #666;
+            text-transform: uppercase;
+            letter-spacing: 0.5px;
+            margin-bottom: 4px;
+        }
+
+        .metric-value {
+            font-size: 16pt;
+            font-weight: 700;
+            color: #333;
+        }
+
+        /* Alerts */
+        .alert {
+            padding: 12px 16px;
+            border-radius: 6px;
+            margin: 10px 0;
+            font-size: 10pt;
+            border-left: 4px solid;
+        }
+
+        .alert-critical {
+            background: #ffebee;
+            border-color: #c62828;
+            color: #c62828;
+        }
+
+        .alert-warning {
+            background: #fff3e0;
+            border-color: #ef6c00;
+            color: #ef6c00;
+        }
+
+        .alert-good {
+            background: #e8f5e9;
+            border-color: #2e7d32;
+            color: #2e7d32;
+        }
+
+        /* Print button */
+        .print-btn {
+            position: fixed;
+            top: 20px;
+            right: 20px;
+            background: linear-gradient(135deg, #FF4B4B 0%, #e74c3c 100%);
+            color: white;
+            padding: 14px 28px;
+            border-radius: 8px;
+            font-weight: bold;
+            cursor: pointer;
+            border: none;
+            box-shadow: 0 4px 12px rgba(231, 76, 60, 0.4);
+            font-size: 14px;
+            z-index: 1000;
+        }
+
+        .print-btn:hover {
+            transform: translateY(-2px);
+            box-shadow: 0 6px 16px rgba(231, 76, 60, 0.5);
+        }
+
+        /* Footer */
+        .footer {
+            text-align: center;
+            margin-top: 50px;
+            padding: 25px;
+            color: #666;
+            border-top: 1px solid #E5E4E0;
+            font-size: 9pt;
+        }
+
+        .footer p {
+            margin: 5px 0;
+        }
+
+        /* Instructions */
+        .instructions {
+            background: #e3f2fd;
+            border-left: 4px solid #2196f3;
+            padding: 15px;
+            margin: 20px 0;
+            border-radius: 0 6px 6px 0;
+            font-size: 10pt;
+        }
+
+        .instructions strong {
+            color: #1565c0;
+        }
+
+        /* Chart containers */
+        .chart-container {
+            margin: 20px 0;
+            text-align: center;
+            page-break-inside: avoid;
+        }
+
+        .chart-title {
+            font-size: 10pt;
+            color: #666;
+            margin-bottom: 10px;
+            text-align: center;
+        }
+
+        .chart-container img {
+            max-width: 100%;
+            height: auto;
+            border: 1px solid #eee;
+            border-radius: 4px;
+        }
+    </style>
+</head>
+<body>
+    <button class="print-btn no-print" onclick="window.print()">
+        Print / Save as PDF
+    </button>
+
+    <div class="instructions no-print">
+        <strong>To save as PDF:</strong><br>
+        1. Click the red "Print / Save as PDF" button<br>
+        2. In the dialog, choose "Save as PDF"<br>
+        3. Select A4 format and default margins<br>
+        4. Click Save
+    </div>
+
+    <div class="header">
+        <h1>Fitbit AI Health Coach</h1>
+        <div class="date">Health Report -- {{gen_date}}</div>
+    </div>
+
+    <div class="section">
+        <div class="section-header">Profile</div>
+        <div class="metrics">
+            <div class="metric">
+                <div class="metric-label">Name</div>
+                <div class="metric-value">{{name}}</div>
+            </div>
+            <div class="metric">
+                <div class="metric-label">Age / Sex</div>
+                <div class="metric-value">{{age_gender}}</div>
+            </div>
+            <div class="metric">
+                <div class="metric-label">Height / Weight / BMI</div>
+                <div class="metric-value">{{height_weight_bmi}}</div>
+            </div>
+        </div>
+    </div>
+
+    <div class="section">
+        <div class="section-header">Health Analysis</div>
+        {{alerts}}
+    </div>
+
+    <div class="section">
+        <div class="section-header">Detailed Statistics</div>
+        {{sections}}
+    </div>
+
+    <div class="footer">
+        <p><strong>Fitbit AI Health Coach</strong></p>
+        <p>Generated on {{gen_date}}</p>
+        <p style="margin-top: 10px; font-size: 8pt;">
+            This report is generated from your personal Fitbit data.
+        </p>
+    </div>
+
+    <script>
+        // Auto preparation for printing
+        window.addEventListener('beforeprint', function() {
+            document.body.style.padding = '0';
+        });
+
+        // Hide button and instructions after printing
+        window.addEventListener('afterprint', function() {
+            document.body.style.padding = '20px';
+        });
+    </script>
+</body>
+</html>"""
+
+REPORT_SECTION_TEMPLATE = """
+        <div class="section">
+            <div class="section-header">{{header}}</div>
+            <div class="metrics">{{metrics}}
+            </div>
+            {{chart}}
+        </div>
+        """
+
+REPORT_METRIC_TEMPLATE = """
+                <div class="metric"><div class="metric-label">{{label}}</div><div class="metric-value">{{value}}</div></div>"""
+
+REPORT_CHART_TEMPLATE = """
+            <div class="chart-container">
+                <div class="chart-title">{{title}}</div>
+                <img src="{{src}}" alt="{{title}}" />
+            </div>
+            """
+
+REPORT_NO_ALERTS = '<p style="color: #666; padding: 10px;">No significant alerts detected.</p>'
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_template(template):
+    """Split a {{field}} template into static chunks and slot names (once per process)."""
+    parts = re.split(r'\{\{(\w+)\}\}', template)
+    return parts[0::2], parts[1::2]
+
+
+def _fill_template(template, **values):
+    chunks, fields = _compile_template(template)
+    out = [chunks[0]]
+    for field, chunk in zip(fields, chunks[1:]):
+        out.append(values[field])
+        out.append(chunk)
+    return ''.join(out)
+
+
+def compute_report_metrics(profile, hr_summary, sleep_df, hrv_df, spo2_df, stress_df,
+                           detailed_hr_df, detailed_steps_df):
+    """
+    Every figure the printable report shows, computed once per dataset.
+
+    Returns a dict of plain numbers and strings; sections without data are
+    None. render_report_html only formats it, so its cost does not depend
+    on how many readings there are.
+    """
+    from datetime import datetime
+
+    metrics = {'name': profile.get('display_name', 'N/A') if profile else 'N/A',
+               'age_gender': "N/A", 'height_weight_bmi': "N/A"}
+
+    if profile and 'date_of_birth' in profile:
+        try:
+            dob = datetime.strptime(profile['date_of_birth'], '%Y-%m-%d')
+            age = int((datetime.now() - dob).days / 365.25)
+            gender = profile.get('gender', '')
+            metrics['age_gender'] = f"{age} yrs / {gender}"
+        except:
+            pass
+
+    # Calculate BMI if height and weight available
+    if profile:
+        height = profile.get('height')
+        weight = profile.get('weight')
+        if isinstance(height, (int, float)) and isinstance(weight, (int, float)) and height > 0:
+            height_m = height / 100
+            bmi = weight / (height_m ** 2)
+            metrics['height_weight_bmi'] = f"{int(height)} cm / {int(weight)} kg / BMI {bmi:.1f}"
+
+    metrics['heart_rate'] = None
+    if not detailed_hr_df.empty:
+        bpm = detailed_hr_df['bpm'].to_numpy()
+        metrics['heart_rate'] = {'readings': len(bpm), 'mean': float(bpm.mean()),
+                                 'min': float(bpm.min()), 'max': float(bpm.max())}
+
+    metrics['sleep'] = None
+    if not sleep_df.empty:
+        main_sleep = sleep_df[sleep_df['main_sleep'] == True]
+        if not main_sleep.empty and 'minutes_asleep' in main_sleep.columns:
+            metrics['sleep'] = {'nights': len(main_sleep),
+                                'avg_hours': main_sleep['minutes_asleep'].mean() / 60}
+
+    metrics['spo2'] = None
+    if not spo2_df.empty:
+        min_spo2 = spo2_df['lower_bound'].min() if 'lower_bound' in spo2_df.columns else spo2_df['average_value'].min()
+        metrics['spo2'] = {'mean': spo2_df['average_value'].mean(), 'min': min_spo2}
+
+    metrics['hrv'] = None
+    if not hrv_df.empty and 'rmssd' in hrv_df.columns:
+        metrics['hrv'] = {'rmssd': hrv_df['rmssd'].mean()}
+
+    metrics['activity'] = None
+    if not detailed_steps_df.empty:
+        metrics['activity'] = {'total_steps': int(detailed_steps_df['steps'].sum())}
+
+    metrics['alerts'], metrics['warnings'], metrics['info'] = analyze_health(
+        hr_summary, sleep_df, hrv_df, spo2_df, stress_df)
+    return metrics
+
+
+def render_report_html(metrics, chart_images=None, inline_images=True):
+    """
+    Fill the precompiled report page from compute_report_metrics output.
+
+    chart_images maps chart name -> PNG or SVG bytes. They are embedded as data: URLs
+    unless inline_images is False, in which case the HTML references
+    chart:<name> for generate_pdf_from_html to serve from memory.
+    """
+    from datetime import datetime
+
+    gen_date = datetime.now().strftime('%Y-%m-%d')
+    chart_images = chart_images or {}
+
+    def chart_html(chart_name, title):
+        image = chart_images.get(chart_name)
+        if not image:
+            return ''
+        if inline_images:
+            src = f"data:{_image_mime(image)};base64," + base64.b64encode(image).decode('ascii')
+        else:
+            src = CHART_URL_SCHEME + chart_name
+        return _fill_template(REPORT_CHART_TEMPLATE, title=title, src=src)
+
+    def section_html(header, items, chart_name, chart_title):
+        return _fill_template(
+            REPORT_SECTION_TEMPLATE, header=header,
+            metrics=''.join(_fill_template(REPORT_METRIC_TEMPLATE, label=label, value=value)
+                            for label, value in items),
+            chart=chart_html(chart_name, chart_title))
+
+    sections = []
+    hr = metrics['heart_rate']
+    if hr:
+        sections.append(section_html('Heart Rate', [
+            ('Readings', f"{hr['readings']:,}"),
+            ('Average', f"{hr['mean']:.1f} bpm"),
+            ('Min/Max', f"{hr['min']:.0f}/{hr['max']:.0f}"),
+        ], 'heart_rate', 'Continuous Heart Rate'))
+    sleep = metrics['sleep']
+    if sleep:
+        sections.append(section_html('Sleep', [
+            ('Nights', f"{sleep['nights']}"),
+            ('Average', f"{sleep['avg_hours']:.1f}h"),
+        ], 'sleep', 'Sleep Analysis'))
+    spo2 = metrics['spo2']
+    if spo2:
+        sections.append(section_html('Oxygen Saturation', [
+            ('Average', f"{spo2['mean']:.1f}%"),
+            ('Minimum', f"{spo2['min']:.1f}%"),
+        ], 'spo2', 'Oxygen Saturation'))
+    hrv = metrics['hrv']
+    if hrv:
+        sections.append(section_html('HRV', [
+            ('RMSSD', f"{hrv['rmssd']:.1f} ms"),
+        ], 'hrv', 'Heart Rate Variability'))
+    activity = metrics['activity']
+    if activity:
+        sections.append(section_html('Activity', [
+            ('Total Steps', f"{activity['total_steps']:,}"),
+        ], 'activity', 'Daily Activity'))
+
+    alert_html = ''.join(
+        [f'<div class="alert alert-critical">{alert}</div>' for alert in metrics['alerts']]
+        + [f'<div class="alert alert-warning">{warning}</div>' for warning in metrics['warnings']]
+        + [f'<div class="alert alert-good">{i}</div>' for i in metrics['info']]
+    )
+
+    return _fill_template(
+        REPORT_PAGE_TEMPLATE,
+        name=metrics['name'], gen_date=gen_date, age_gender=metrics['age_gender'],
+        height_weight_bmi=metrics['height_weight_bmi'],
+        alerts=alert_html or REPORT_NO_ALERTS, sections=''.join(sections),
+    )
+
+
+def generate_printable_html(profile, hr_summary, sleep_df, hrv_df, spo2_df, stress_df,
+                            detailed_hr_df, detailed_steps_df, chart_images=None,
+                            inline_images=True):
+    """
+    Generate a standalone HTML optimised for A4 printing with chart images.
+
+    Convenience wrapper: computes the metrics and renders them in one go.
+    """
+    metrics = compute_report_metrics(profile, hr_summary, sleep_df, hrv_df, spo2_df, stress_df,
+                                     detailed_hr_df, detailed_steps_df)
+    return render_report_html(metrics, chart_images, inline_images)
+
+# ==============================================================================
+# REPORT BUILD
+# ==============================================================================
+
+# Chart export settings; part of the cache key for a finished report
+REPORT_OPTIONS = {'chart_width': 700, 'chart_height': 350, 'chart_scale': 2, 'chart_format': 'png'}
+
+# Report chart formats offered in the sidebar
+REPORT_CHART_FORMATS = {'png': "PNG (raster)", 'svg': "SVG (vector)"}
+
+# Dataset tables that feed the PDF
+REPORT_FRAMES = ('detailed_hr_df', 'detailed_steps_df', 'detailed_cals_df', 'hr_summary_df',
+                 'sleep_df', 'hrv_df', 'spo2_df', 'stress_df')
+
+
+def dataset_fingerprint(data):
+    """Content hash of the profile and the tables the report is built from."""
+    import hashlib
+    digest = hashlib.sha256(json.dumps(data['profile'], sort_keys=True, default=str).encode())
+    for name in REPORT_FRAMES:
+        df = data[name]
+        digest.update(name.encode())
+        digest.update(','.join(map(str, df.columns)).encode())
+        if not df.empty:
+            digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def report_metrics_for(data):
+    """compute_report_metrics over a parse_takeout / load_dataset dict."""
+    return compute_report_metrics(
+        data['profile'], data['hr_summary_df'], data['sleep_df'], data['hrv_df'],
+        data['spo2_df'], data['stress_df'], data['detailed_hr_df'], data['detailed_steps_df'])
+
+
+def build_report(data, options, progress=None):
+    """
+    Build the PDF report for a loaded dataset without touching the page.
+
+    progress(step, fraction) is called as the work advances. Returns a dict
+    with the PDF bytes, or the standalone HTML and pdf_error when WeasyPrint
+    is unavailable, plus chart timings / errors.
+    """
+    def _progress(step, fraction):
+        if progress is not None:
+            progress(step, fraction)
+
+    _progress("Building charts", 0.0)
+    # One envelope point pair per device pixel column of a PNG; vectors are
+    # resolution-independent, so SVG keeps one per layout pixel
+    if options['chart_format'] == 'svg':
+        print_columns = options['chart_width']
+    else:
+        print_columns = options['chart_width'] * options['chart_scale']
+    figs = {}
+    if not data['detailed_hr_df'].empty:
+        figs['heart_rate'] = create_continuous_hr_chart(data['detailed_hr_df'], print_columns)
+    if not data['sleep_df'].empty:
+        figs['sleep'] = create_sleep_chart(data['sleep_df'])
+    if not data['spo2_df'].empty:
+        figs['spo2'] = create_spo2_chart(data['spo2_df'])
+    if not data['hrv_df'].empty:
+        figs['hrv'] = create_hrv_chart(data['hrv_df'])
+    if not data['detailed_steps_df'].empty:
+        figs['activity'] = create_continuous_activity_chart(
+            data['detailed_steps_df'], data['detailed_cals_df'], print_columns)
+    figs = {name: fig for name, fig in figs.items() if fig}
+
+    # Charts take most of the time: spread 10-70% over them
+    rendered = []
+    def _on_chart(name):
+        rendered.append(name)
+        _progress(f"Rendered {len(rendered)}/{len(figs)} charts", 0.1 + 0.6 * len(rendered) / len(figs))
+
+    _progress(f"Rendering {len(figs)} charts", 0.1)
+    started = time.perf_counter()
+    try:
+        chart_images, chart_timings, chart_errors = render_chart_images(
+            figs, width=options['chart_width'], height=options['chart_height'],
+            scale=options['chart_scale'], on_chart=_on_chart,
+            image_format=options['chart_format'])
+    except Exception as e:
+        chart_images, chart_timings, chart_errors = {}, {}, {'all': str(e)}
+    charts_elapsed = time.perf_counter() - started
+
+    # The dashboard computes report metrics once at load; batch runs do it here
+    metrics = data.get('report_metrics') or report_metrics_for(data)
+
+    # Charts reach WeasyPrint by URL, so the PNGs are never base64-inflated
+    _progress("Building HTML", 0.75)
+    html_content = render_report_html(metrics, chart_images, inline_images=False)
+
+    _progress("Writing PDF", 0.8)
+    try:
+        pdf_bytes, pdf_error = generate_pdf_from_html(html_content, chart_images), None
+    except Exception as e:
+        pdf_bytes, pdf_error = None, str(e)
+
+    # The standalone HTML fallback needs the charts inlined
+    html_fallback = None
+    if not pdf_bytes:
+        html_fallback = render_report_html(metrics, chart_images)
+
+    _progress("Done", 1.0)
+    return {
+        'pdf': pdf_bytes,
+        'html': html_fallback,
+        'pdf_error': pdf_error,
+        'chart_timings': chart_timings,
+        'chart_errors': chart_errors,
+        'charts_elapsed': charts_elapsed,
+        'chart_bytes': sum(len(image) for image in chart_images.values()),
+    }
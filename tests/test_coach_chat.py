@@ -0,0 +1,50 @@
+from fake_gemini import FakeGemini, canned_plan_text
+from health_coach import CoachChat, ContextCache
+from health_data import estimate_tokens
+
+SUMMARY = "Resting HR 58 bpm, HRV 52 ms, 7.1 h sleep, 8,400 steps a day.\n" * 20
+REPLY = "Move the long run to Sunday and keep it under 150 bpm. " * 20
+
+
+def long_plan(min_tokens):
+    plan = canned_plan_text()
+    return plan * (min_tokens // estimate_tokens(plan) + 1)
+
+
+def test_plan_longer_than_the_history_cap_is_always_sent():
+    plan = long_plan(2 * 300)
+    client = FakeGemini(text=REPLY, latency=0.0, chars_per_second=0)
+    chat = CoachChat(SUMMARY, "key", client=client, context_cache=ContextCache(),
+                     history_tokens=300, goals="Run a 10 km race", plan=plan)
+    prefix = chat.context_cache.get(chat.prefix_key)
+    assert plan in prefix and "Run a 10 km race" in prefix
+
+    for i in range(6):
+        reply = chat.send(f"Question {i}")
+        assert reply['history_tokens'] <= 300
+        assert reply['sent_tokens'] >= estimate_tokens(plan)
+    # Older turns were trimmed, the plan never was
+    assert reply['history_turns'] < len(chat.turns) - 2
+    assert all(call['prompt_chars'] > len(plan) for call in client.calls)
+    assert not any(plan in text for _, text in chat.turns)
+
+
+def test_plan_in_prefix_reaches_the_provider_cache():
+    plan = long_plan(1000)
+    client = FakeGemini(text=REPLY, latency=0.0, chars_per_second=0, context_caching=True)
+    cache = ContextCache(min_tokens=1000)
+    without_plan = CoachChat(SUMMARY, "key", client=client, context_cache=cache)
+    assert without_plan.prefix_tokens < 1000
+    assert "below the provider's 1,000-token minimum" in without_plan.provider_caching_skipped
+    assert not without_plan.send("Hello")['prefix_cached']
+
+    chat = CoachChat(SUMMARY, "key", client=client, context_cache=cache, plan=plan)
+    assert chat.prefix_tokens >= 1000
+    assert chat.provider_caching_skipped is None
+    assert chat.send("Hello")['prefix_cached']
+    assert plan in client.cached_contents[-1].system_instruction
+
+
+def test_client_without_context_caching_is_reported():
+    chat = CoachChat(SUMMARY, "key", client=FakeGemini(), context_cache=ContextCache(min_tokens=0))
+    assert chat.provider_caching_skipped == "the Gemini client has no context caching"
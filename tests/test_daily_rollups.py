@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from health_data import HR_BAND_QUANTILES, compute_daily_hr_percentiles, grouped_quantiles
+
+
+def naive_quantiles(keys, values, quantiles):
+    """One pandas quantile call per group."""
+    grouped = pd.Series(values, dtype=float).groupby(keys)
+    return {q: grouped.quantile(q).to_numpy() for q in quantiles}, grouped
+
+
+@pytest.mark.parametrize('sorted_keys', [True, False])
+@pytest.mark.parametrize('seed', range(10))
+def test_grouped_quantiles_match_pandas(seed, sorted_keys):
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(0, 8, size=rng.integers(1, 300))
+    if sorted_keys:
+        keys = np.sort(keys)
+    values = rng.normal(70, 20, size=len(keys)).round(rng.integers(0, 3))
+    quantiles = (0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0)
+
+    uniq, counts, mins, maxs, result = grouped_quantiles(keys, values, quantiles)
+    expected, grouped = naive_quantiles(keys, values, quantiles)
+
+    np.testing.assert_array_equal(uniq, np.array(sorted(set(keys))))
+    np.testing.assert_array_equal(counts, grouped.size().to_numpy())
+    np.testing.assert_allclose(mins, grouped.min().to_numpy())
+    np.testing.assert_allclose(maxs, grouped.max().to_numpy())
+    for q in quantiles:
+        np.testing.assert_allclose(result[q], expected[q], rtol=1e-9, atol=1e-9, err_msg=str(q))
+
+
+def test_daily_hr_percentiles_per_calendar_day():
+    rng = np.random.default_rng(0)
+    ts = pd.Timestamp('2026-01-20') + pd.to_timedelta(np.sort(rng.integers(0, 3 * 86400, 5000)), unit='s')
+    hr_df = pd.DataFrame({'timestamp': ts, 'bpm': rng.integers(50, 180, len(ts))})
+
+    df = compute_daily_hr_percentiles(hr_df)
+    by_day = hr_df.groupby(hr_df['timestamp'].dt.normalize())['bpm']
+
+    assert list(df['date']) == list(by_day.size().index)
+    np.testing.assert_array_equal(df['readings'], by_day.size())
+    np.testing.assert_allclose(df['min'], by_day.min())
+    np.testing.assert_allclose(df['max'], by_day.max())
+    for q in HR_BAND_QUANTILES:
+        np.testing.assert_allclose(df[f'p{int(round(q * 100))}'], by_day.quantile(q))
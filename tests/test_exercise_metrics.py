@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from health_data import HR_ZONES, compute_exercise_hr_metrics
+
+MAX_HR = 190
+T0 = pd.Timestamp('2026-01-20 06:00')
+
+
+def hr_series(seed, hours=3):
+    rng = np.random.default_rng(seed)
+    gaps = rng.integers(3, 20, size=hours * 400)
+    # An off-wrist gap in the middle, to exercise the 60 s cap on time in zone
+    gaps[len(gaps) // 2] = 900
+    ts = T0 + pd.to_timedelta(np.cumsum(gaps), unit='s')
+    bpm = rng.integers(55, 185, size=len(ts)).astype(float)
+    return pd.DataFrame({'timestamp': ts, 'bpm': bpm})
+
+
+def sessions(seed):
+    rng = np.random.default_rng(seed + 100)
+    rows = []
+    for _ in range(12):
+        start = T0 + pd.Timedelta(seconds=int(rng.integers(-1800, 4 * 3600)))
+        rows.append({'start_time': start,
+                     'end_time': start + pd.Timedelta(seconds=int(rng.integers(0, 3600)))})
+    rows.append({'start_time': pd.NaT, 'end_time': T0 + pd.Timedelta(hours=1)})
+    rows.append({'start_time': T0 + pd.Timedelta(hours=1), 'end_time': pd.NaT})
+    return pd.DataFrame(rows, index=[f's{i}' for i in range(len(rows))])
+
+
+def nearest(ts, target, tol):
+    """Closest reading to target (the earlier one on ties), or None beyond tol."""
+    best = None
+    for i, t in enumerate(ts):
+        if abs(t - target) <= tol and (best is None or abs(t - target) < abs(ts[best] - target)):
+            best = i
+    return best
+
+
+def naive_metrics(exercise_df, hr_df, max_hr, tolerance_s=15):
+    ts = list(hr_df['timestamp'])
+    bpm = list(hr_df['bpm'])
+    dt = [min((ts[i + 1] - ts[i]).total_seconds(), 60.0) for i in range(len(ts) - 1)] + [0.0]
+    zone_edges = [max_hr * frac for _, _, frac in HR_ZONES] + [np.inf]
+    tol = pd.Timedelta(seconds=tolerance_s)
+    rows = {}
+    for name, session in exercise_df.iterrows():
+        start, end = session['start_time'], session['end_time']
+        row = {}
+        if pd.isna(start) or pd.isna(end):
+            rows[name] = {'hr_samples': 0}
+            continue
+        end = max(end, start)
+        inside = [i for i, t in enumerate(ts) if start <= t < end]
+        values = [bpm[i] for i in inside]
+        row['hr_samples'] = len(inside)
+        row['hr_avg'] = np.mean(values) if values else np.nan
+        row['hr_peak'] = max(values) if values else np.nan
+        mid = start + (end - start) / 2
+        first = [bpm[i] for i in inside if ts[i] < mid]
+        second = [bpm[i] for i in inside if ts[i] >= mid]
+        row['hr_drift'] = np.mean(second) - np.mean(first) if first and second else np.nan
+        for (key, _, _), low, high in zip(HR_ZONES, zone_edges[:-1], zone_edges[1:]):
+            row[f'{key}_min'] = sum(dt[i] for i in inside if low <= bpm[i] < high) / 60
+        at_end = nearest(ts, end, tol)
+        for label, offset in (('hrr_1min', 60), ('hrr_2min', 120)):
+            after = nearest(ts, end + pd.Timedelta(seconds=offset), tol)
+            row[label] = (bpm[at_end] - bpm[after]
+                          if at_end is not None and after is not None else np.nan)
+        rows[name] = row
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_per_session_loop(seed):
+    hr_df, exercise_df = hr_series(seed), sessions(seed)
+    got = compute_exercise_hr_metrics(exercise_df, hr_df, MAX_HR)
+    expected = naive_metrics(exercise_df, hr_df, MAX_HR)
+    valid = exercise_df.notna().all(axis=1)
+
+    assert list(got.index) == list(exercise_df.index)
+    np.testing.assert_array_equal(got.loc[valid, 'hr_samples'], expected.loc[valid, 'hr_samples'])
+    assert (got.loc[~valid, 'hr_samples'] == 0).all()
+    for column in expected.columns.drop('hr_samples'):
+        np.testing.assert_allclose(got.loc[valid, column].astype(float),
+                                   expected.loc[valid, column].astype(float),
+                                   rtol=1e-9, atol=1e-9, err_msg=column)
+
+
+def test_empty_inputs_give_empty_metrics():
+    exercise_df = sessions(0)
+    got = compute_exercise_hr_metrics(exercise_df, pd.DataFrame(), MAX_HR)
+    assert list(got.index) == list(exercise_df.index)
+    assert got.isna().all().all()
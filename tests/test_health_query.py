@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from health_data import DailyAggregates
+from health_query import parse_question, run_query
+
+TODAY = pd.Timestamp('2026-03-31')
+DAY = pd.Timedelta(days=1)
+
+
+# ── Question grammar ──────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('question, expected', [
+    ("average heart rate during runs last month",
+     {'metric': 'hr', 'agg': 'mean', 'activity': 'run',
+      'window': (TODAY - 29 * DAY, TODAY, "over the last 30 days")}),
+    ("how many nights did I sleep over 8 hours",
+     {'metric': 'sleep_hours', 'agg': 'count', 'threshold': ('>', 8.0), 'window': None}),
+    ("what was my resting heart rate on weekends this month",
+     {'metric': 'resting_hr', 'agg': 'mean', 'days': 'weekend',
+      'window': (pd.Timestamp('2026-03-01'), TODAY, "this month")}),
+    ("longest run this year",
+     {'metric': 'exercise_minutes', 'agg': 'max', 'activity': 'run'}),
+    ("how many steps yesterday",
+     {'metric': 'steps', 'agg': 'mean', 'window': (TODAY - DAY, TODAY - DAY, "yesterday")}),
+    ("days with at least 10k steps in february",
+     {'metric': 'steps', 'agg': 'count', 'threshold': ('>=', 10000.0),
+      'window': (pd.Timestamp('2026-02-01'), pd.Timestamp('2026-02-28'), "in February 2026")}),
+    ("how many days did I get at least 10,000 steps",
+     {'metric': 'steps', 'agg': 'count', 'threshold': ('>=', 10000.0)}),
+    ("how many nights did I sleep at most 6 hours",
+     {'metric': 'sleep_hours', 'agg': 'count', 'threshold': ('<=', 6.0)}),
+    ("how many days was my longest run over 10 km",
+     {'metric': 'distance', 'agg': 'count', 'activity': 'run', 'threshold': ('>', 10.0)}),
+    ("highest daily steps", {'metric': 'steps', 'agg': 'max'}),
+    ("average steps over 2 weeks",
+     {'metric': 'steps', 'agg': 'mean', 'threshold': None,
+      'window': (TODAY - 13 * DAY, TODAY, "over the last 14 days")}),
+    ("days over 10k steps in the last 12 weeks",
+     {'agg': 'count', 'threshold': ('>', 10000.0), 'window': (TODAY - 83 * DAY, TODAY, "over the last 84 days")}),
+    ("how many hours did I sleep last night",
+     {'metric': 'sleep_hours', 'agg': 'mean', 'window': (TODAY, TODAY, "last night")}),
+    ("how many hours did I sleep last week", {'metric': 'sleep_hours', 'agg': 'sum'}),
+    ("how many minutes of exercise last week",
+     {'metric': 'exercise_minutes', 'agg': 'sum', 'activity': 'workout'}),
+    ("max heart rate while asleep in the past 2 weeks",
+     {'metric': 'hr', 'agg': 'max', 'asleep': True,
+      'window': (TODAY - 13 * DAY, TODAY, "over the last 14 days")}),
+    ("how far did I ride since 2026-03-10",
+     {'metric': 'distance', 'agg': 'sum', 'activity': 'ride'}),
+])
+def test_parse_question(question, expected):
+    query = parse_question(question, TODAY)
+    assert query is not None
+    for key, value in expected.items():
+        assert query[key] == value, key
+
+
+@pytest.mark.parametrize('question', [
+    "why is my resting heart rate going up",
+    "should I run more",
+    "what's the weather like",
+    "how can I improve my sleep",
+])
+def test_open_ended_questions_go_to_the_coach(question):
+    assert parse_question(question, TODAY) is None
+
+
+# ── Query execution ───────────────────────────────────────────────────────────
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    start = TODAY - 89 * DAY
+    ts = start + pd.to_timedelta(np.arange(0, 90 * 86400, 60), unit='s')
+    hr_df = pd.DataFrame({'timestamp': ts, 'bpm': rng.integers(50, 170, len(ts)).astype(float)})
+
+    days = pd.date_range(start, TODAY, freq='D')
+    run_days = days[::3]
+    ride_days = days[1::5]
+    exercise_df = pd.DataFrame({
+        'start_time': list(run_days + pd.Timedelta(hours=7)) + list(ride_days + pd.Timedelta(hours=18)),
+        'activity_name': ['Run'] * len(run_days) + ['Outdoor Bike'] * len(ride_days),
+    })
+    exercise_df['duration_minutes'] = rng.integers(20, 90, len(exercise_df)).astype(float)
+    exercise_df['distance_km'] = rng.uniform(3, 40, len(exercise_df)).round(2)
+    exercise_df['end_time'] = exercise_df['start_time'] + pd.to_timedelta(
+        exercise_df['duration_minutes'], unit='min')
+    exercise_df = exercise_df.sort_values('start_time', ignore_index=True)
+
+    sleep_df = pd.DataFrame({'start_time': days - pd.Timedelta(hours=1),
+                             'end_time': days + pd.Timedelta(hours=6, minutes=30),
+                             'main_sleep': True})
+    daily = pd.DataFrame({'steps': rng.integers(2000, 16000, len(days)).astype(float),
+                          'resting_hr': rng.normal(60, 4, len(days)),
+                          'sleep_hours': rng.normal(7.5, 1, len(days))},
+                         index=pd.DatetimeIndex(days, name='date'))
+    aggregates = DailyAggregates()
+    aggregates.add_series(hr_df['timestamp'], hr_df['bpm'], 'bpm')
+    return {'detailed_hr_df': hr_df, 'exercise_df': exercise_df, 'sleep_df': sleep_df,
+            'daily_metrics': daily, 'aggregates': aggregates}
+
+
+def inside(ts, intervals):
+    """Readings inside any [start_time, end_time) interval, one interval at a time."""
+    mask = pd.Series(False, index=ts.index)
+    for _, row in intervals.iterrows():
+        mask |= (ts >= row['start_time']) & (ts < row['end_time'])
+    return mask
+
+
+def in_window(dates, first, last):
+    return (dates >= first) & (dates < last + DAY)
+
+
+def ask(question, data):
+    return run_query(parse_question(question, TODAY), data)['value']
+
+
+def test_hr_from_stored_aggregates(data):
+    hr = data['detailed_hr_df']
+    last_week = hr[in_window(hr['timestamp'], TODAY - 6 * DAY, TODAY)]['bpm']
+    assert ask("average heart rate last week", data) == pytest.approx(last_week.mean())
+    assert ask("highest heart rate last week", data) == last_week.max()
+    assert ask("lowest heart rate last week", data) == last_week.min()
+
+
+def test_hr_during_activity_and_sleep(data):
+    hr, ex = data['detailed_hr_df'], data['exercise_df']
+    runs = ex[ex['activity_name'] == 'Run']
+    runs = runs[in_window(runs['start_time'].dt.normalize(), TODAY - 29 * DAY, TODAY)]
+    during_runs = hr[inside(hr['timestamp'], runs)]['bpm']
+    assert ask("average heart rate during runs last month", data) == pytest.approx(during_runs.mean())
+    assert ask("median heart rate during runs last month", data) == during_runs.median()
+
+    recent = hr[in_window(hr['timestamp'], TODAY - 13 * DAY, TODAY)]
+    asleep = recent[inside(recent['timestamp'], data['sleep_df'])]['bpm']
+    assert ask("max heart rate while asleep in the past 2 weeks", data) == asleep.max()
+    assert ask("how many readings of heart rate over 150 while asleep in the past 2 weeks",
+               data) == (asleep > 150).sum()
+
+
+def test_exercise_log(data):
+    ex = data['exercise_df']
+    rides = ex[ex['activity_name'].str.contains('bike', case=False)]
+    since = rides[rides['start_time'] >= '2026-03-10']
+    assert ask("how far did I ride since 2026-03-10", data) == pytest.approx(since['distance_km'].sum())
+    runs = ex[ex['activity_name'] == 'Run']
+    assert ask("how many runs last 2 weeks", data) == in_window(
+        runs['start_time'].dt.normalize(), TODAY - 13 * DAY, TODAY).sum()
+    assert ask("longest run", data) == runs['duration_minutes'].max()
+    assert ask("how many runs over 60 minutes", data) == (runs['duration_minutes'] > 60).sum()
+
+
+def test_how_many_of_an_amount(data):
+    daily, ex = data['daily_metrics'], data['exercise_df']
+    assert ask("how many hours did I sleep last night", data) == pytest.approx(
+        daily.at[TODAY, 'sleep_hours'])
+    assert ask("how many hours did I sleep last week", data) == pytest.approx(
+        daily.loc[in_window(daily.index, TODAY - 6 * DAY, TODAY), 'sleep_hours'].sum())
+    last_week = ex[in_window(ex['start_time'].dt.normalize(), TODAY - 6 * DAY, TODAY)]
+    assert ask("how many minutes of exercise last week", data) == pytest.approx(
+        last_week['duration_minutes'].sum())
+
+
+def test_daily_metrics(data):
+    daily = data['daily_metrics']
+    last_week = daily[in_window(daily.index, TODAY - 6 * DAY, TODAY)]
+    assert ask("how many steps last week", data) == pytest.approx(last_week['steps'].sum())
+    assert ask("how many nights did I sleep over 8 hours", data) == (daily['sleep_hours'] > 8).sum()
+    assert ask("how many nights did I sleep at most 6 hours", data) == (daily['sleep_hours'] <= 6).sum()
+    assert ask("how many days did I get at least 10,000 steps", data) == (daily['steps'] >= 10000).sum()
+    weekends = daily[daily.index.dayofweek >= 5]
+    assert ask("average resting heart rate on weekends", data) == pytest.approx(
+        weekends['resting_hr'].mean())
+    run_days = data['exercise_df'].query("activity_name == 'Run'")['start_time'].dt.normalize()
+    assert ask("average steps on days with a run", data) == pytest.approx(
+        daily.loc[daily.index.isin(run_days), 'steps'].mean())
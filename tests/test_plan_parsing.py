@@ -0,0 +1,99 @@
+import json
+import random
+
+import pytest
+
+from fake_gemini import CANNED_PLAN, canned_plan_text
+from health_coach import PlanParser, parse_plan_json, repair_json, split_plan_text
+
+ANSWER = canned_plan_text()
+BLOCK_START = ANSWER.index('```json')
+BLOCK_END = ANSWER.index('```', BLOCK_START + 3)
+ALL_SESSIONS = [s for week in CANNED_PLAN['weeks'] for s in week['sessions']]
+
+
+def session_ends(text):
+    """End offset of every session object, found by decoding at each '{'."""
+    decoder = json.JSONDecoder()
+    ends = []
+    for pos, char in enumerate(text):
+        if char == '{' and pos > BLOCK_START:
+            try:
+                obj, end = decoder.raw_decode(text, pos)
+            except ValueError:
+                continue
+            if isinstance(obj, dict) and 'day' in obj:
+                ends.append(end)
+    return ends
+
+
+def feed_in_chunks(text, seed):
+    rng = random.Random(seed)
+    parser, events, i = PlanParser(), [], 0
+    while i < len(text):
+        step = rng.randint(1, 50)
+        events += parser.feed(text[i:i + step])
+        i += step
+    return parser, events
+
+
+def test_complete_answer():
+    prose, plan, pending = split_plan_text(ANSWER)
+    assert plan == CANNED_PLAN
+    assert not pending
+    assert '```' not in prose and '## Heart rate targets' in prose
+    assert parse_plan_json(ANSWER) == CANNED_PLAN
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_chunking_does_not_change_the_result(seed):
+    parser, events = feed_in_chunks(ANSWER, seed)
+    assert parser.closed
+    assert parser.plan == CANNED_PLAN
+    assert [kind for kind, _, _ in events] == (['session'] * 3 + ['week']) * 4
+    assert [item for kind, _, item in events if kind == 'session'] == ALL_SESSIONS
+    assert [(i, item) for kind, i, item in events if kind == 'week'] == list(
+        enumerate(CANNED_PLAN['weeks']))
+
+
+def test_truncated_answers_keep_every_finished_session():
+    ends = session_ends(ANSWER)
+    assert len(ends) == len(ALL_SESSIONS)
+    for cut in range(BLOCK_START, BLOCK_END, 7):
+        text = ANSWER[:cut]
+        finished = sum(end <= cut for end in ends)
+        plan = parse_plan_json(text)
+        if finished == 0:
+            assert plan is None
+            continue
+        sessions = [s for week in plan['weeks'] for s in week['sessions']]
+        assert sessions == ALL_SESSIONS[:finished], cut
+        for got, full in zip(plan['weeks'], CANNED_PLAN['weeks']):
+            # Only complete fields of a week, never a partial value
+            assert all(got[key] == full[key] for key in got if key != 'sessions'), cut
+
+        prose, split_plan, pending = split_plan_text(text)
+        assert pending and split_plan == plan
+        assert prose == ANSWER[:ANSWER.index('## 4-week plan')]
+
+
+def test_common_model_mistakes_are_tolerated():
+    broken = (ANSWER
+              .replace('"checkpoint": "Three sessions done without soreness"',
+                       '"checkpoint": "Three sessions done without soreness",')
+              .replace('nose breathing', 'nose\nbreathing'))
+    plan = parse_plan_json(broken)
+    assert [w['week'] for w in plan['weeks']] == [1, 2, 3, 4]
+    assert plan['weeks'][0]['checkpoint'] == "Three sessions done without soreness"
+    assert plan['weeks'][0]['sessions'][0]['details'].startswith("Conversational pace, nose\nbreathing")
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": [1, 2, {"b": "x', {'a': [1, 2, {}]}),
+    ('{"a": 12', {}),
+    ('{"a": "q\\"x", "b": "unfinis', {'a': 'q"x'}),
+    ('{"a": 1, "b": [true, nul', {'a': 1, 'b': [True]}),
+    ('{"a": {"b": 1}, ', {'a': {'b': 1}}),
+])
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
@@ -0,0 +1,113 @@
+import os
+import random
+import time
+from collections import OrderedDict
+
+import pytest
+
+import health_coach
+from health_coach import ResponseCache
+
+
+def entry_size(cache, key):
+    return os.path.getsize(os.path.join(cache.directory, f"{key}.json"))
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        return ResponseCache(str(tmp_path) if request.param == 'disk' else None, **kwargs)
+    return make
+
+
+def test_memory_is_the_default(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    cache = ResponseCache()
+    cache.put("k", "answer", "m")
+    assert cache.get("k")['text'] == "answer"
+    assert cache.directory is None and not os.listdir(tmp_path)
+    assert health_coach.COACH_CACHE.directory == health_coach.COACH_CACHE_DIR
+
+
+def test_round_trip(make_cache):
+    cache = make_cache()
+    key = cache.key("prompt", ["model-a"])
+    assert cache.get(key) is None
+    cache.put(key, "answer", "model-a")
+    entry = cache.get(key)
+    assert (entry['text'], entry['model']) == ("answer", "model-a")
+    assert cache.key("prompt", ["model-b"]) != key
+
+
+def test_expired_entries_are_ignored_and_removed(make_cache, monkeypatch):
+    cache = make_cache(ttl=60)
+    cache.put("k", "answer", "m")
+    later = time.time() + 61
+    monkeypatch.setattr(health_coach.time, 'time', lambda: later)
+    assert cache.get("k") is None
+    if cache.directory is not None:
+        assert not os.path.exists(os.path.join(cache.directory, "k.json"))
+    monkeypatch.undo()
+    assert cache.get("k") is None
+
+
+def test_clear(make_cache):
+    cache = make_cache()
+    for key in ("a", "b"):
+        cache.put(key, "answer", "m")
+    cache.clear()
+    assert cache.get("a") is None and cache.get("b") is None
+    if cache.directory is not None:
+        assert not os.listdir(cache.directory)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_memory_eviction_matches_an_lru_model(seed):
+    rng = random.Random(seed)
+    cache = ResponseCache(max_bytes=400)
+    model = OrderedDict()
+    for step in range(60):
+        key = f"k{rng.randrange(8)}"
+        if rng.random() < 0.5:
+            assert (cache.get(key) is not None) == (key in model), step
+            if key in model:
+                model.move_to_end(key)
+        else:
+            cache.put(key, "x" * 100, "m")
+            model[key] = True
+            model.move_to_end(key)
+            while len(model) > 4:
+                model.popitem(last=False)
+        assert list(cache._memory) == list(model), step
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_eviction_matches_an_lru_model(tmp_path, seed):
+    rng = random.Random(seed)
+    probe = ResponseCache(str(tmp_path / "probe"))
+    probe.put("k00", "x" * 100, "m")
+    size = entry_size(probe, "k00")
+
+    # Room for four entries; sizes vary by a few bytes with the timestamp
+    cache = ResponseCache(str(tmp_path / "cache"), max_bytes=4 * size + size // 2)
+    os.makedirs(cache.directory)
+    model = OrderedDict()
+    clock = time.time() - 10_000
+    for step in range(40):
+        clock += 1
+        key = f"k{rng.randrange(8):02d}"
+        if rng.random() < 0.5:
+            hit = cache.get(key)
+            assert (hit is not None) == (key in model), step
+            if hit is not None:
+                model.move_to_end(key)
+        else:
+            cache.put(key, "x" * 100, "m")
+            model[key] = True
+            model.move_to_end(key)
+            while len(model) > 4:
+                model.popitem(last=False)
+        if key in model:
+            # Stand in for the wall clock so that every access has its own mtime
+            os.utime(os.path.join(cache.directory, f"{key}.json"), (clock, clock))
+        assert sorted(n[:-5] for n in os.listdir(cache.directory)) == sorted(model), step
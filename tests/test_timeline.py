@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from health_data import align_series_to_grid
+
+REDUCERS = {'sum': np.sum, 'mean': np.mean, 'min': np.min, 'max': np.max}
+
+
+def naive_align(edges, ts, values, how):
+    """One bucket at a time: edges[i] <= ts < edges[i + 1], the last edge inclusive."""
+    out = []
+    for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+        last = i == len(edges) - 2
+        inside = [v for t, v in zip(ts, values) if lo <= t < hi or (last and t == hi)]
+        if inside:
+            out.append(REDUCERS[how](inside))
+        else:
+            out.append(0.0 if how == 'sum' else np.nan)
+    return np.array(out, dtype=float)
+
+
+@pytest.mark.parametrize('how', list(REDUCERS))
+def test_trailing_empty_buckets_keep_last_reading(how):
+    edges = np.array([0, 10, 20, 30, 40])
+    ts = np.array([1, 2, 11, 12, 15])
+    values = np.array([1, 1, 1, 1, 100.0])
+    expected = {'sum': [2, 102, 0, 0], 'mean': [1, 34, np.nan, np.nan],
+                'min': [1, 1, np.nan, np.nan], 'max': [1, 100, np.nan, np.nan]}[how]
+    np.testing.assert_allclose(align_series_to_grid(edges, ts, values, how), expected)
+
+
+@pytest.mark.parametrize('how', list(REDUCERS))
+def test_reading_on_the_last_edge_is_kept(how):
+    # A 40-unit span split into four buckets puts the final reading exactly on edges[-1]
+    edges = np.array([0, 10, 20, 30, 40])
+    ts = np.array([0, 10, 20, 30, 40])
+    values = np.array([1, 2, 3, 4, 6.0])
+    expected = {'sum': [1, 2, 3, 10], 'mean': [1, 2, 3, 5],
+                'min': [1, 2, 3, 4], 'max': [1, 2, 3, 6]}[how]
+    np.testing.assert_allclose(align_series_to_grid(edges, ts, values, how), expected)
+
+
+@pytest.mark.parametrize('how', list(REDUCERS))
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_naive_loop(how, seed):
+    rng = np.random.default_rng(seed)
+    edges = np.sort(rng.choice(np.arange(0, 200), size=rng.integers(2, 12), replace=False))
+    ts = np.sort(rng.integers(-20, 220, size=rng.integers(0, 40)))
+    values = rng.normal(70, 15, size=len(ts))
+    np.testing.assert_allclose(align_series_to_grid(edges, ts, values, how),
+                               naive_align(edges, ts, values, how))
+
+
+def test_unknown_aggregation():
+    with pytest.raises(ValueError):
+        align_series_to_grid(np.array([0, 10]), np.array([1]), np.array([1.0]), 'median')
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from health_data import window_aggregates
+
+END = pd.Timestamp('2026-03-31')
+
+
+def daily_table(seed, days=200):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(END - pd.Timedelta(days=days - 20), periods=days, freq='D')
+    # Some missing days entirely, some missing single metrics, some after END
+    dates = dates[np.sort(rng.choice(len(dates), size=days - 30, replace=False))]
+    table = pd.DataFrame({
+        'steps': rng.integers(2000, 15000, len(dates)).astype(float),
+        'resting_hr': rng.normal(60, 4, len(dates)),
+        'hrv': rng.normal(45, 10, len(dates)),
+    }, index=pd.DatetimeIndex(dates, name='date'))
+    return table.mask(rng.random(table.shape) < 0.15)
+
+
+def naive_window(daily, window, end):
+    """Slice the window's days and let pandas describe them."""
+    days = daily.loc[end - pd.Timedelta(days=window - 1):end]
+    return pd.DataFrame({'days': days.count(), 'mean': days.mean(), 'std': days.std(ddof=1),
+                         'min': days.min(), 'max': days.max()})
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_per_window_slices(seed):
+    daily = daily_table(seed)
+    windows = (1, 7, 30, 90, 365)
+    got = window_aggregates(daily, windows, end=END)
+    assert sorted(got) == list(windows)
+    for window in windows:
+        expected = naive_window(daily, window, END)
+        np.testing.assert_array_equal(got[window]['days'], expected['days'])
+        for column in ('mean', 'std', 'min', 'max'):
+            np.testing.assert_allclose(got[window][column], expected[column],
+                                       rtol=1e-9, err_msg=f"{window} {column}")
+
+
+def test_window_without_data():
+    daily = daily_table(0)
+    got = window_aggregates(daily, (7,), end=daily.index[0] - pd.Timedelta(days=30))
+    assert (got[7]['days'] == 0).all()
+    assert got[7][['mean', 'std', 'min', 'max']].isna().all().all()